@@ -9,4 +9,5 @@ plugin = {
     "version": __version__,
     "description": "A plugin to send notifications for GBP events.",
     "app": "gbp_notifications.django.gbp_notifications",
+    "urls": "gbp_notifications.django.gbp_notifications.urls",
 }
@@ -0,0 +1 @@
+"""gbpcli subcommands for gbp-notifications"""
@@ -0,0 +1,146 @@
+"""List and replay dead letters"""
+
+import argparse
+import datetime as dt
+import itertools
+
+from gbpcli.gbp import GBP
+from gbpcli.render import LOCAL_TIMEZONE, format_timestamp
+from gbpcli.types import Console
+from rich import box
+from rich.table import Table
+
+from gbp_notifications.deadletters import DeadLetter, get_dead_letter_store, replay
+from gbp_notifications.settings import Settings
+
+HELP = """List and replay notifications that failed to be delivered
+
+Failed deliveries are recorded when GBP_NOTIFICATIONS_DEAD_LETTER_DB is set.
+"""
+STATUS_CODE_UNKNOWN_ACTION = 255
+
+
+def handler(args: argparse.Namespace, _gbp: GBP, console: Console) -> int:
+    """List and replay dead letters"""
+    settings = Settings.from_environ()
+
+    if not settings.DEAD_LETTER_DB:
+        console.err.print("GBP_NOTIFICATIONS_DEAD_LETTER_DB is not set")
+        return 1
+
+    match args.action:
+        case "list":
+            return list_action(args, settings, console)
+        case "replay":
+            return replay_action(args, settings, console)
+        case "delete":
+            return delete_action(args, settings, console)
+
+    console.err.print(f"Unknown action: {args.action}")
+    return STATUS_CODE_UNKNOWN_ACTION
+
+
+def parse_args(parser: argparse.ArgumentParser) -> None:
+    """Set subcommand arguments"""
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    list_parser = subparsers.add_parser("list", description="List dead letters")
+    replay_parser = subparsers.add_parser(
+        "replay", description="Deliver dead letters again"
+    )
+    replay_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=100,
+        help="Number of dead letters to deliver (concurrently) at a time",
+    )
+    delete_parser = subparsers.add_parser("delete", description="Delete dead letters")
+
+    for subparser in [list_parser, replay_parser, delete_parser]:
+        add_filter_args(subparser)
+
+
+def add_filter_args(parser: argparse.ArgumentParser) -> None:
+    """Add the arguments to select dead letters to the given parser"""
+    parser.add_argument("--method", "-m", default="", help="Only the given method")
+    parser.add_argument(
+        "--recipient", "-r", default="", help="Only the given recipient"
+    )
+    parser.add_argument(
+        "--destination", "-d", default="", help="Only the given destination (host)"
+    )
+    parser.add_argument(
+        "--limit", "-n", type=int, default=0, help="At most this many dead letters"
+    )
+    parser.add_argument(
+        "ids", metavar="ID", type=int, nargs="*", help="Only the given dead letters"
+    )
+
+
+def select(args: argparse.Namespace, settings: Settings) -> list[DeadLetter]:
+    """Return the dead letters selected by the command-line arguments"""
+    return get_dead_letter_store(settings).find(
+        ids=args.ids,
+        limit=args.limit,
+        method=args.method,
+        recipient=args.recipient,
+        destination=args.destination,
+    )
+
+
+def list_action(args: argparse.Namespace, settings: Settings, console: Console) -> int:
+    """handle the "list" action"""
+    table = Table(box=box.ROUNDED, title_style="header", style="box")
+    table.add_column("ID", justify="right")
+    table.add_column("Failed")
+    table.add_column("Method")
+    table.add_column("Recipient")
+    table.add_column("Destination")
+    table.add_column("Attempts", justify="right")
+    table.add_column("Error", overflow="fold")
+
+    for letter in select(args, settings):
+        failed = dt.datetime.fromtimestamp(letter.created, tz=dt.UTC)
+        table.add_row(
+            str(letter.id),
+            format_timestamp(failed.astimezone(LOCAL_TIMEZONE)),
+            letter.method,
+            letter.recipient,
+            letter.destination,
+            str(letter.attempts),
+            letter.error,
+        )
+
+    console.out.print(table)
+
+    return 0
+
+
+def replay_action(
+    args: argparse.Namespace, settings: Settings, console: Console
+) -> int:
+    """handle the "replay" action"""
+    store = get_dead_letter_store(settings)
+    letters = select(args, settings)
+    failed = 0
+
+    for batch in itertools.batched(letters, max(args.batch_size, 1)):
+        for letter, error in replay(store, batch, settings):
+            if error is not None:
+                failed += 1
+                console.err.print(f"{letter.id}: {error!r}")
+
+    console.out.print(f"Replayed {len(letters)} dead letters. {failed} failed again")
+
+    return 1 if failed else 0
+
+
+def delete_action(
+    args: argparse.Namespace, settings: Settings, console: Console
+) -> int:
+    """handle the "delete" action"""
+    store = get_dead_letter_store(settings)
+    deleted = store.delete(letter.id for letter in select(args, settings))
+
+    console.out.print(f"Deleted {deleted} dead letters")
+
+    return 0
@@ -0,0 +1,314 @@
+"""Connection pools for notification workers
+
+Workers deliver many notifications to the same servers. Rather than connecting (and
+authenticating) for every notification, connections are kept per worker process and
+re-used.
+"""
+
+import atexit
+import logging
+import os
+import smtplib
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Iterator
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+SMTPKey = tuple[str, int, str]
+SessionKey = tuple[str, str, int, int]
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, kw_only=True)
+class SMTPServer:
+    """Where and how to connect to an SMTP server"""
+
+    host: str
+    port: int = 465
+    username: str = ""
+    password: str = field(default="", repr=False)
+
+    @property
+    def key(self) -> SMTPKey:
+        """The pool key for connections to this server"""
+        return (self.host, self.port, self.username)
+
+
+@dataclass(kw_only=True)
+class IdleConnection:
+    """A connection waiting in the pool"""
+
+    smtp: smtplib.SMTP
+    since: float
+
+
+class SMTPPool:
+    """Pool of authenticated SMTP connections
+
+    Connections are kept for idle_timeout seconds after they were last used. If
+    idle_timeout is 0, connections are closed after each use.
+    """
+
+    def __init__(self, idle_timeout: float = 60) -> None:
+        self.idle_timeout = idle_timeout
+        self._idle: dict[SMTPKey, list[IdleConnection]] = {}
+        self._lock = threading.Lock()
+
+    def sendmail(
+        self, server: SMTPServer, from_addr: str, to_addrs: list[str], msg: str
+    ) -> None:
+        """Send the message using a pooled connection to the given server
+
+        Pooled connections that the server has dropped are replaced before the message
+        is sent (see checkout()). Once sending has started, errors are raised, as the
+        server may already have accepted the message. Resending is left to the retry
+        policy.
+        """
+        with self.connection(server) as smtp:
+            smtp.sendmail(from_addr, to_addrs, msg)
+
+    @contextmanager
+    def connection(self, server: SMTPServer) -> Iterator[smtplib.SMTP]:
+        """Context manager for a (pooled) connection to the given server
+
+        The connection is returned to the pool unless an error occurred while using it.
+        """
+        smtp = self.checkout(server.key) or connect(server)
+
+        try:
+            yield smtp
+        except BaseException:
+            close(smtp)
+            raise
+
+        self.checkin(server.key, smtp)
+
+    def checkout(self, key: SMTPKey) -> smtplib.SMTP | None:
+        """Return a live idle connection for the key from the pool, if there is one
+
+        A connection's first command after leaving the pool is a NOOP. Connections that
+        fail it are closed and the next one is tried.
+        """
+        self.reap()
+
+        while True:
+            with self._lock:
+                if not (idle := self._idle.get(key)):
+                    return None
+                smtp = idle.pop().smtp
+
+            if is_alive(smtp):
+                return smtp
+            close(smtp)
+
+    def checkin(self, key: SMTPKey, smtp: smtplib.SMTP) -> None:
+        """Return the connection to the pool
+
+        Connections (to any server) that have been idle for too long are closed.
+        """
+        if self.idle_timeout <= 0:
+            close(smtp)
+            return
+
+        with self._lock:
+            self._idle.setdefault(key, []).append(
+                IdleConnection(smtp=smtp, since=time.monotonic())
+            )
+
+        self.reap()
+
+    def reap(self) -> None:
+        """Close connections that have been idle for longer than idle_timeout"""
+        expired: list[smtplib.SMTP] = []
+        cutoff = time.monotonic() - self.idle_timeout
+
+        with self._lock:
+            for key, idle in self._idle.items():
+                expired.extend(conn.smtp for conn in idle if conn.since < cutoff)
+                self._idle[key] = [conn for conn in idle if conn.since >= cutoff]
+
+        for smtp in expired:
+            close(smtp)
+
+    def close(self) -> None:
+        """Close all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for conn in (conn for conns in idle.values() for conn in conns):
+            close(conn.smtp)
+
+    def reset(self) -> None:
+        """Forget all idle connections without closing them
+
+        This is for child processes, whose parent still owns the connections.
+        """
+        self._lock = threading.Lock()
+        self._idle = {}
+
+
+def connect(server: SMTPServer) -> smtplib.SMTP:
+    """Connect and log in to the given SMTP server"""
+    logger.info("Connecting to %s:%s", server.host, server.port)
+    smtp = smtplib.SMTP_SSL(server.host, port=server.port)
+
+    try:
+        smtp.login(server.username, server.password)
+    except BaseException:
+        close(smtp)
+        raise
+
+    return smtp
+
+
+def is_alive(smtp: smtplib.SMTP) -> bool:
+    """Return True if the server still responds on the given connection"""
+    try:
+        status, _ = smtp.noop()
+    except (smtplib.SMTPException, OSError):
+        return False
+
+    return status == 250
+
+
+def close(smtp: smtplib.SMTP) -> None:
+    """Close the connection, ignoring any errors"""
+    try:
+        smtp.quit()
+    except (smtplib.SMTPException, OSError):
+        smtp.close()
+
+
+class HTTPSessions:
+    """requests Sessions per scheme/host
+
+    Sessions keep connections alive so that subsequent requests to the same host don't
+    need to re-connect.
+    """
+
+    def __init__(self) -> None:
+        self._sessions: dict[SessionKey, requests.Session] = {}
+        self._lock = threading.Lock()
+
+    def session(self, url: str, *, pool_size: int, retries: int) -> requests.Session:
+        """Return the Session for the given URL
+
+        pool_size is the maximum number of connections to keep for the host. Failed
+        connection attempts are retried up to `retries` times (see new_session()).
+        """
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc, pool_size, retries)
+
+        with self._lock:
+            if (session := self._sessions.get(key)) is None:
+                session = self._sessions[key] = new_session(
+                    parts.scheme, pool_size=pool_size, retries=retries
+                )
+
+        return session
+
+    def close(self) -> None:
+        """Close all Sessions"""
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+
+        for session in sessions.values():
+            session.close()
+
+    def reset(self) -> None:
+        """Forget all Sessions without closing them
+
+        This is for child processes, whose parent still owns the connections.
+        """
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+
+def new_session(scheme: str, *, pool_size: int, retries: int) -> requests.Session:
+    """Return a new Session for the given scheme
+
+    Only failed connection attempts are retried, right away, as the request hasn't been
+    sent. Other failures, e.g. 429/5xx responses, are left to the retry policy (see the
+    retry module), which neither sleeps in the worker nor re-sends requests that
+    succeeded.
+    """
+    retry = Retry(total=None, connect=retries, read=False, redirect=False, status=0)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount(f"{scheme}://", adapter)
+
+    return session
+
+
+class SQLiteDatabase:
+    """A process's connection to an SQLite database that is shared between processes
+
+    The database is opened in WAL mode so that many processes can use it at once. The
+    connection is created, along with the schema, on first use and is not shared with
+    child processes. Hold .lock while using the connection.
+    """
+
+    def __init__(self, path: str, schema: str, **kwargs: Any) -> None:
+        self.path = path
+        self.schema = schema
+        self.kwargs = kwargs
+        self.lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._pid = os.getpid()
+
+    def connection(self) -> sqlite3.Connection:
+        """Return the connection to the database"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._conn = None
+
+        if self._conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=30, check_same_thread=False, **self.kwargs
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self.schema)
+            self._conn = conn
+
+        return self._conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Hold the lock and yield the connection inside an immediate transaction
+
+        The database must have been opened with isolation_level=None.
+        """
+        with self.lock:
+            conn = self.connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def close(self) -> None:
+        """Close the database connection"""
+        with self.lock:
+            conn, self._conn = self._conn, None
+
+        if conn is not None and self._pid == os.getpid():
+            conn.close()
+
+
+smtp_pool = SMTPPool()
+atexit.register(smtp_pool.close)
+os.register_at_fork(after_in_child=smtp_pool.reset)
+
+http_sessions = HTTPSessions()
+atexit.register(http_sessions.close)
+os.register_at_fork(after_in_child=http_sessions.reset)
@@ -0,0 +1,213 @@
+"""Dead letters
+
+When DEAD_LETTER_DB is set, deliveries that fail for good (permanent errors, or transient
+errors once their retries are used up) are recorded in an SQLite database along with
+their method, recipient, destination and error. They can then be listed and replayed
+with the "gbp deadletters" command.
+"""
+
+import json
+import logging
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Iterable
+
+from gbp_notifications.connections import SQLiteDatabase
+from gbp_notifications.delivery import Delivery, Job, deliver_each
+
+if TYPE_CHECKING:  # pragma: nocover
+    from gbp_notifications.settings import Settings
+
+SCHEMA = """\
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    method TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    job TEXT NOT NULL,
+    error TEXT NOT NULL,
+    attempts INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dead_letters_method ON dead_letters (method, created);
+"""
+FILTERS = ("method", "recipient", "destination")
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, kw_only=True)
+class DeadLetter:  # pylint: disable=too-many-instance-attributes
+    """A delivery that failed for good"""
+
+    id: int = 0
+    created: float = 0.0
+    method: str
+    recipient: str
+    destination: str
+    job: Job
+    """The failed delivery, as a Delivery.to_job() job"""
+
+    error: str
+    attempts: int
+
+    @property
+    def delivery(self) -> Delivery:
+        """The failed Delivery"""
+        return Delivery.from_job(self.job)
+
+
+class DeadLetterStore:
+    """SQLite store of DeadLetters
+
+    The database can be shared by all the processes on the host.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.db = SQLiteDatabase(path, SCHEMA, isolation_level=None)
+
+    def add(self, letter: DeadLetter) -> int:
+        """Add the DeadLetter to the store. Return its id"""
+        with self.db.transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO dead_letters"
+                " (created, method, recipient, destination, job, error, attempts)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    letter.created or time.time(),
+                    letter.method,
+                    letter.recipient,
+                    letter.destination,
+                    json.dumps(letter.job),
+                    letter.error,
+                    letter.attempts,
+                ),
+            )
+
+        return cursor.lastrowid or 0
+
+    def find(
+        self, *, ids: Iterable[int] = (), limit: int = 0, **filters: str
+    ) -> list[DeadLetter]:
+        """Return the DeadLetters, oldest first
+
+        If ids are given, only the DeadLetters with those ids are returned. filters are
+        exact matches on the "method", "recipient" and/or "destination" fields.
+        """
+        where, params = self.where(ids, filters)
+        query = f"SELECT * FROM dead_letters{where} ORDER BY id"
+
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        with self.db.lock:
+            rows = self.db.connection().execute(query, params).fetchall()
+
+        return [
+            DeadLetter(
+                id=row[0],
+                created=row[1],
+                method=row[2],
+                recipient=row[3],
+                destination=row[4],
+                job=json.loads(row[5]),
+                error=row[6],
+                attempts=row[7],
+            )
+            for row in rows
+        ]
+
+    def delete(self, ids: Iterable[int]) -> int:
+        """Delete the DeadLetters with the given ids. Return the number deleted"""
+        with self.db.transaction() as conn:
+            cursor = conn.executemany(
+                "DELETE FROM dead_letters WHERE id = ?", [(id_,) for id_ in ids]
+            )
+
+        deleted: int = cursor.rowcount
+
+        return deleted
+
+    @staticmethod
+    def where(ids: Iterable[int], filters: dict[str, str]) -> tuple[str, list[Any]]:
+        """Return the WHERE clause and its parameters for the given ids and filters"""
+        clauses: list[str] = []
+        params: list[Any] = []
+
+        if unknown := set(filters) - set(FILTERS):
+            raise TypeError(f"Unknown filters: {', '.join(sorted(unknown))}")
+
+        if ids := list(ids):
+            clauses.append(f"id IN ({', '.join('?' * len(ids))})")
+            params.extend(ids)
+
+        for name, value in filters.items():
+            if value:
+                clauses.append(f"{name} = ?")
+                params.append(value)
+
+        return (f" WHERE {' AND '.join(clauses)}" if clauses else ""), params
+
+    def close(self) -> None:
+        """Close the database connection"""
+        self.db.close()
+
+
+def bury(settings: "Settings", letter: DeadLetter) -> None:
+    """Record the DeadLetter, if DEAD_LETTER_DB is set"""
+    if not settings.DEAD_LETTER_DB:
+        return
+
+    try:
+        get_dead_letter_store(settings).add(letter)
+    except Exception:  # pylint: disable=broad-exception-caught
+        logger.exception("Failed to record dead letter for %s", letter.destination)
+
+
+def replay(
+    store: DeadLetterStore, letters: Iterable[DeadLetter], settings: "Settings"
+) -> list[tuple[DeadLetter, Exception | None]]:
+    """Deliver the DeadLetters again, concurrently, and remove them from the store
+
+    Deliveries that fail again are recorded as new DeadLetters (or retried) the same way
+    as any other delivery. Return the result of each replayed DeadLetter.
+    """
+    letters = list(letters)
+    results = deliver_each(
+        [letter.delivery for letter in letters],
+        max_concurrency=settings.ASYNC_MAX_CONCURRENCY,
+        max_per_destination=settings.ASYNC_MAX_PER_DESTINATION,
+    )
+    store.delete(letter.id for letter in letters)
+
+    return list(zip(letters, results))
+
+
+_store: DeadLetterStore | None = None  # pylint: disable=invalid-name
+
+
+def get_dead_letter_store(settings: "Settings") -> DeadLetterStore:
+    """Return the DeadLetterStore for the given Settings"""
+    global _store  # pylint: disable=global-statement
+
+    store = previous = _store
+
+    if store is None or store.path != settings.DEAD_LETTER_DB:
+        store = _store = DeadLetterStore(settings.DEAD_LETTER_DB)
+
+        if previous is not None:
+            previous.close()
+
+    return store
+
+
+def clear_dead_letter_store() -> None:
+    """Close and discard the current DeadLetterStore"""
+    global _store  # pylint: disable=global-statement
+
+    store, _store = _store, None
+
+    if store is not None:
+        store.close()
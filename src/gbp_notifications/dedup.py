@@ -0,0 +1,170 @@
+"""Duplicate notification suppression
+
+When DEDUP_TTL is set, a recipient is only notified once per (method, machine, build,
+event name) within DEDUP_TTL seconds. Notifications that were already sent are kept in
+a bounded in-memory cache and, if DEDUP_DB is set, in an SQLite database that can be
+shared by all processes on the host.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Sequence
+
+from gbp_notifications.connections import SQLiteDatabase
+from gbp_notifications.types import Event, NotificationMethod, Recipient
+
+if TYPE_CHECKING:  # pragma: nocover
+    from gbp_notifications.settings import Settings
+
+DedupKey = tuple[str, str, str, str, str]
+
+# Purge expired keys from the database every this many claims
+PURGE_INTERVAL = 1000
+
+
+class Deduplicator:
+    """Remember the notifications sent within the last `ttl` seconds
+
+    At most `size` notifications are kept in memory. If a DedupStore is given, it is
+    consulted for notifications that are not in memory.
+    """
+
+    def __init__(
+        self, *, ttl: float, size: int, store: "DedupStore | None" = None
+    ) -> None:
+        self.ttl = ttl
+        self.size = size
+        self.store = store
+        self._seen: OrderedDict[DedupKey, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def first(self, key: DedupKey) -> bool:
+        """Return True if the notification with the given key was not recently sent
+
+        The notification is recorded as sent.
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            if (expires := self._seen.get(key)) is not None and expires > now:
+                return False
+
+        first = self.store.claim(key, self.ttl) if self.store else True
+
+        with self._lock:
+            self._seen[key] = now + self.ttl
+            self._seen.move_to_end(key)
+
+            while len(self._seen) > self.size:
+                self._seen.popitem(last=False)
+
+        return first
+
+    @property
+    def path(self) -> str:
+        """The path of the store's database. Empty if there is no store"""
+        return self.store.path if self.store else ""
+
+    def filter(
+        self, method: NotificationMethod, event: Event, recipients: Sequence[Recipient]
+    ) -> list[Recipient]:
+        """Return the recipients that have not recently been sent the event"""
+        if (build_id := event_build_id(event)) is None:
+            return list(recipients)
+
+        method_name = f"{type(method).__module__}:{type(method).__qualname__}"
+
+        return [
+            recipient
+            for recipient in recipients
+            if self.first(
+                (recipient.name, method_name, event.machine, build_id, event.name)
+            )
+        ]
+
+
+class DedupStore:
+    """SQLite store of sent notifications
+
+    The database can be shared by all the processes on the host.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.db = SQLiteDatabase(
+            path,
+            "CREATE TABLE IF NOT EXISTS dedup (key TEXT PRIMARY KEY, expires REAL)",
+        )
+        self._claims = 0
+
+    def claim(self, key: DedupKey, ttl: float) -> bool:
+        """Record the key for `ttl` seconds
+
+        Return False if the key was already recorded and has not yet expired.
+        """
+        now = time.time()
+
+        with self.db.lock:
+            conn = self.db.connection()
+            with conn:
+                cursor = conn.execute(
+                    "INSERT INTO dedup (key, expires) VALUES (?, ?)"
+                    " ON CONFLICT (key) DO UPDATE SET expires = excluded.expires"
+                    " WHERE dedup.expires <= ?",
+                    (json.dumps(key), now + ttl, now),
+                )
+                self._claims += 1
+
+                if self._claims % PURGE_INTERVAL == 0:
+                    conn.execute("DELETE FROM dedup WHERE expires <= ?", (now,))
+
+        return cursor.rowcount == 1
+
+    def close(self) -> None:
+        """Close the database connection"""
+        self.db.close()
+
+
+def event_build_id(event: Event) -> str | None:
+    """Return the id of the event's build, if it has one"""
+    if (build := event.data.get("build")) is None:
+        return None
+
+    build_id: str | None = getattr(build, "build_id", None)
+
+    return build_id
+
+
+_deduplicator: Deduplicator | None = None  # pylint: disable=invalid-name
+
+
+def get_deduplicator(settings: "Settings") -> Deduplicator:
+    """Return the Deduplicator for the given Settings
+
+    The Deduplicator is reused as long as the dedup settings don't change.
+    """
+    global _deduplicator  # pylint: disable=global-statement
+
+    dedup = previous = _deduplicator
+    ttl, size, path = settings.DEDUP_TTL, settings.DEDUP_CACHE_SIZE, settings.DEDUP_DB
+
+    if dedup is None or (dedup.ttl, dedup.size, dedup.path) != (ttl, size, path):
+        store = DedupStore(path) if path else None
+        dedup = _deduplicator = Deduplicator(ttl=ttl, size=size, store=store)
+
+        if previous is not None and previous.store is not None:
+            previous.store.close()
+
+    return dedup
+
+
+def clear_deduplicator() -> None:
+    """Discard the current Deduplicator"""
+    global _deduplicator  # pylint: disable=global-statement
+
+    dedup, _deduplicator = _deduplicator, None
+
+    if dedup is not None and dedup.store is not None:
+        dedup.store.close()
@@ -0,0 +1,246 @@
+"""Notification delivery
+
+NotificationMethods hand their (worker) functions to enqueue(), which normally submits
+them to the GBP worker. Within a collect() block, deliveries are instead collected so
+that they can be sent together, e.g. concurrently by deliver().
+"""
+
+import asyncio
+import contextvars
+import importlib
+import logging
+import pickle
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, fields, is_dataclass, replace
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator
+
+from gentoo_build_publisher import worker
+
+from gbp_notifications import metrics, tracing
+
+if TYPE_CHECKING:  # pragma: nocover
+    from gbp_notifications.types import Event
+
+Job = list[Any]
+EVENT_SALT = "gbp_notifications.event"
+
+# Fields of the event's build that encode_event() leaves out. Neither the templates nor
+# the webhook payloads use them, and the logs alone can be megabytes
+UNSENT_BUILD_FIELDS = frozenset({"logs", "note"})
+
+logger = logging.getLogger(__name__)
+_local = threading.local()
+
+
+@dataclass(frozen=True, kw_only=True)
+class Delivery:
+    """A (worker) function call that delivers a notification"""
+
+    func: Callable[..., Any]
+    args: tuple[Any, ...]
+
+    destination: str = ""
+    """The host (or other destination) of the delivery. Used for concurrency limits"""
+
+    def __call__(self) -> Any:
+        return self.func(*self.args)
+
+    def to_job(self) -> Job:
+        """Return the delivery as a (serializable) worker job argument"""
+        func = f"{self.func.__module__}:{self.func.__qualname__}"
+
+        return [func, list(self.args), self.destination]
+
+    @classmethod
+    def from_job(cls, job: Job) -> "Delivery":
+        """Convert the job created by .to_job() back into a Delivery"""
+        func, args, destination = job
+        module_name, _, name = func.partition(":")
+        module = importlib.import_module(module_name)
+
+        return cls(
+            func=getattr(module, name), args=tuple(args), destination=destination
+        )
+
+
+def enqueue(func: Callable[..., Any], *args: Any, destination: str = "") -> None:
+    """Submit the function call to the worker
+
+    If called inside a collect() block, the call is collected instead.
+    """
+    payload = sum(len(arg) for arg in args if isinstance(arg, str))
+    metrics.PAYLOAD_BYTES.observe(payload, task=metrics.task_label(func))
+
+    if (deliveries := getattr(_local, "deliveries", None)) is not None:
+        deliveries.append(Delivery(func=func, args=args, destination=destination))
+    else:
+        submit(func, *args, destination=destination)
+
+
+def submit(func: Callable[..., Any], *args: Any, destination: str = "") -> None:
+    """Submit the function call to the GBP worker"""
+    with tracing.span(
+        "enqueue", task=metrics.task_label(func), destination=destination
+    ):
+        worker.run(func, *args)
+
+
+@contextmanager
+def collect() -> Iterator[list[Delivery]]:
+    """Collect the enqueue()d deliveries (of the current thread) into a list"""
+    deliveries: list[Delivery] = []
+    previous = getattr(_local, "deliveries", None)
+    _local.deliveries = deliveries
+
+    try:
+        yield deliveries
+    finally:
+        _local.deliveries = previous
+
+
+@contextmanager
+def attempt_number(attempt: int) -> Iterator[None]:
+    """Make deliveries made (by the current thread) in this block the given attempt"""
+    previous = current_attempt()
+    _local.attempt = attempt
+
+    try:
+        yield
+    finally:
+        _local.attempt = previous
+
+
+def current_attempt() -> int:
+    """Return the number of the current thread's delivery attempt"""
+    attempt: int = getattr(_local, "attempt", 1)
+
+    return attempt
+
+
+def deliver(
+    deliveries: Iterable[Delivery], *, max_concurrency: int, max_per_destination: int
+) -> list[Exception]:
+    """Run the given deliveries concurrently
+
+    At most max_concurrency deliveries are run at the same time and at most
+    max_per_destination for any given destination. A slow destination therefore only
+    holds up deliveries to itself.
+
+    Return the exceptions raised by failed deliveries.
+    """
+    results = deliver_each(
+        deliveries,
+        max_concurrency=max_concurrency,
+        max_per_destination=max_per_destination,
+    )
+
+    return [error for error in results if error is not None]
+
+
+def deliver_each(
+    deliveries: Iterable[Delivery], *, max_concurrency: int, max_per_destination: int
+) -> list[Exception | None]:
+    """Like deliver() but return the result of each delivery, in order
+
+    The result is the exception raised by the delivery or None if it succeeded.
+    """
+    return asyncio.run(
+        deliver_async(
+            deliveries,
+            max_concurrency=max_concurrency,
+            max_per_destination=max_per_destination,
+        )
+    )
+
+
+async def deliver_async(
+    deliveries: Iterable[Delivery], *, max_concurrency: int, max_per_destination: int
+) -> list[Exception | None]:
+    """Async version of deliver_each()
+
+    The (blocking) delivery functions are run in a thread pool, in the caller's
+    context so that their tracing spans are children of the caller's.
+    """
+    loop = asyncio.get_running_loop()
+    destinations: defaultdict[str, asyncio.Semaphore] = defaultdict(
+        lambda: asyncio.Semaphore(max_per_destination)
+    )
+
+    with ThreadPoolExecutor(max_concurrency, "gbp-notifications") as executor:
+
+        async def run(delivery: Delivery) -> Exception | None:
+            # Wait on the destination first so that we don't hold up a thread waiting
+            async with destinations[delivery.destination]:
+                try:
+                    context = contextvars.copy_context()
+                    await loop.run_in_executor(executor, context.run, delivery)
+                except Exception as error:  # pylint: disable=broad-exception-caught
+                    logger.exception("Delivery to %s failed", delivery.destination)
+                    return error
+            return None
+
+        return await asyncio.gather(*(run(delivery) for delivery in deliveries))
+
+
+class PickleSerializer:
+    """django.core.signing serializer for (trusted) Python objects"""
+
+    def dumps(self, obj: Any) -> bytes:
+        """Serialize the object"""
+        return pickle.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        """Deserialize the object"""
+        return pickle.loads(data)
+
+
+def encode_event(event: "Event") -> str:
+    """Encode the event (including its data) as a string that can be sent to workers
+
+    The UNSENT_BUILD_FIELDS of the event's build are left out (see trim_event()). The
+    string is signed so that decode_event() only unpickles events that we encoded.
+    """
+    # pylint: disable=import-outside-toplevel
+    from django.core import signing
+
+    return signing.dumps(
+        trim_event(event), salt=EVENT_SALT, serializer=PickleSerializer, compress=True
+    )
+
+
+def trim_event(event: "Event") -> "Event":
+    """Return the event with its build's UNSENT_BUILD_FIELDS cleared
+
+    The event itself is returned if there is nothing to clear.
+    """
+    build = event.data.get("build")
+
+    if not (is_dataclass(build) and not isinstance(build, type)):
+        return event
+
+    unsent = {
+        field.name: None
+        for field in fields(build)
+        if field.name in UNSENT_BUILD_FIELDS and getattr(build, field.name) is not None
+    }
+
+    if not unsent:
+        return event
+
+    return replace(event, data={**event.data, "build": replace(build, **unsent)})
+
+
+def decode_event(data: str) -> "Event":
+    """Decode the event encoded by encode_event()
+
+    Raise django.core.signing.BadSignature if the data was not signed by us.
+    """
+    # pylint: disable=import-outside-toplevel
+    from django.core import signing
+
+    event: "Event" = signing.loads(data, salt=EVENT_SALT, serializer=PickleSerializer)
+
+    return event
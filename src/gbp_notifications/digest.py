@@ -0,0 +1,352 @@
+"""Event coalescing
+
+When DIGEST_WINDOW is set, events aren't sent right away. Instead they are buffered per
+(NotificationMethod, Recipient) for DIGEST_WINDOW seconds after the first buffered
+event. Then each Recipient is sent a single digest of the buffered events per method.
+
+Buffered events are kept in an SQLite database. If DIGEST_DB is set, the database is
+shared by all the processes on the host and the buffered events survive the process
+that handled the signal: digests that are due are sent by the flush_digests() worker
+task, which the poller (see the poller module) submits. Otherwise the events live in
+the memory of the process that handled the signal. The poller sends its digests when
+they are due and the rest are sent when the process exits normally, but they are lost
+if it is killed.
+
+Digests are sent like any other notifications: their deliveries are spooled to the
+outbox, handed to the worker as one job or enqueued one by one, depending on the
+settings.
+"""
+
+import atexit
+import hashlib
+import importlib
+import logging
+import time
+from typing import TYPE_CHECKING, Iterable, Sequence, cast
+
+from gbp_notifications.connections import SQLiteDatabase
+from gbp_notifications.delivery import collect, decode_event, encode_event
+from gbp_notifications.types import (
+    DigestNotificationMethod,
+    Event,
+    NotificationMethod,
+    Recipient,
+)
+
+if TYPE_CHECKING:  # pragma: nocover
+    from gbp_notifications.settings import Settings
+
+SCHEMA = """\
+CREATE TABLE IF NOT EXISTS digest_event_data (
+    key TEXT PRIMARY KEY,
+    event TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS digest_entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    method TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    event TEXT NOT NULL REFERENCES digest_event_data (key),
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS digest_entries_group ON digest_entries (method, recipient);
+CREATE INDEX IF NOT EXISTS digest_entries_event ON digest_entries (event);
+"""
+MEMORY = ":memory:"
+
+# (method, recipient name, encoded events) of a digest
+Group = tuple[str, str, list[str]]
+
+logger = logging.getLogger(__name__)
+
+
+class DigestStore:
+    """SQLite store of buffered events
+
+    Events are grouped by method and recipient name. Each (encoded) event is stored
+    once, keyed by its hash, and referenced by an entry per recipient. It is removed
+    once the last of its entries is taken. Taking the events of a group is a single
+    (immediate) transaction, so the store can be shared by many processes.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.db = SQLiteDatabase(path, SCHEMA, isolation_level=None)
+
+    def add(self, method: str, recipients: Iterable[str], event: str) -> None:
+        """Add the (encoded) event for the given method and recipients"""
+        now = time.time()
+        key = hashlib.sha256(event.encode()).hexdigest()
+
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO digest_event_data (key, event) VALUES (?, ?)",
+                (key, event),
+            )
+            conn.executemany(
+                "INSERT INTO digest_entries (method, recipient, event, created)"
+                " VALUES (?, ?, ?, ?)",
+                [(method, recipient, key, now) for recipient in recipients],
+            )
+
+    def due(self, window: float, max_events: int) -> bool:
+        """Return True if any group is due
+
+        A group is due `window` seconds after its first event or once it has
+        `max_events` events.
+        """
+        with self.db.lock:
+            row = (
+                self.db.connection()
+                .execute(
+                    "SELECT 1 FROM digest_entries GROUP BY method, recipient"
+                    " HAVING MIN(created) <= ? OR COUNT(*) >= ? LIMIT 1",
+                    (time.time() - window, max_events),
+                )
+                .fetchone()
+            )
+
+        return row is not None
+
+    def take(
+        self, window: float, max_events: int, *, everything: bool = False
+    ) -> list[Group]:
+        """Remove and return the groups that are due (see due())
+
+        If everything is True, all the groups are taken.
+        """
+        before = float("inf") if everything else time.time() - window
+        groups: list[Group] = []
+
+        with self.db.transaction() as conn:
+            due = conn.execute(
+                "SELECT method, recipient, MAX(id) FROM digest_entries"
+                " GROUP BY method, recipient HAVING MIN(created) <= ? OR COUNT(*) >= ?",
+                (before, max_events),
+            ).fetchall()
+
+            for method, recipient, last in due:
+                where = "method = ? AND recipient = ? AND id <= ?"
+                events = conn.execute(
+                    "SELECT data.event FROM digest_entries AS entry"
+                    " JOIN digest_event_data AS data ON data.key = entry.event"
+                    f" WHERE {where} ORDER BY id",
+                    (method, recipient, last),
+                ).fetchall()
+                conn.execute(
+                    f"DELETE FROM digest_entries WHERE {where}",
+                    (method, recipient, last),
+                )
+                groups.append((method, recipient, [event for (event,) in events]))
+
+            if groups:
+                conn.execute(
+                    "DELETE FROM digest_event_data WHERE key NOT IN"
+                    " (SELECT event FROM digest_entries)"
+                )
+
+        return groups
+
+    def __len__(self) -> int:
+        with self.db.lock:
+            [count] = (
+                self.db.connection()
+                .execute("SELECT COUNT(*) FROM digest_entries")
+                .fetchone()
+            )
+
+        return int(count)
+
+    def close(self) -> None:
+        """Close the database connection"""
+        self.db.close()
+
+
+class DigestBuffer:
+    """Buffer of events to be sent as digests
+
+    Events are buffered for DIGEST_WINDOW seconds after the first event is added. A
+    (method, recipient) with DIGEST_MAX_EVENTS buffered events is sent its digest right
+    away.
+    """
+
+    def __init__(self, settings: "Settings", store: DigestStore | None = None) -> None:
+        self.settings = settings
+        self.window = settings.DIGEST_WINDOW
+        self.max_events = settings.DIGEST_MAX_EVENTS
+        self.store = store or DigestStore(settings.DIGEST_DB or MEMORY)
+
+    @property
+    def shared(self) -> bool:
+        """True if the buffered events are kept in DIGEST_DB"""
+        return self.store.path != MEMORY
+
+    def add(
+        self, method: NotificationMethod, event: Event, recipients: Sequence[Recipient]
+    ) -> None:
+        """Add the event for the given method and recipients to the buffer
+
+        The digests that are due are sent.
+        """
+        self.store.add(
+            method_path(method),
+            [recipient.name for recipient in recipients],
+            encode_event(event),
+        )
+        self.flush()
+
+    def due(self) -> bool:
+        """Return True if any digests are due"""
+        return self.store.due(self.window, self.max_events)
+
+    def flush(self, *, everything: bool = False) -> None:
+        """Send the digests that are due
+
+        If everything is True, all the buffered events are sent.
+        """
+        # pylint: disable=import-outside-toplevel,cyclic-import
+        from gbp_notifications.signals import submit_deliveries
+
+        groups = self.store.take(self.window, self.max_events, everything=everything)
+        digests = list(self.digests(groups))
+        settings = self.settings
+
+        if not (settings.ASYNC_DELIVERY or settings.OUTBOX_DB):
+            for method, events, recipient in digests:
+                try:
+                    send_digest(method, events, recipient)
+                except Exception:  # pylint: disable=broad-exception-caught
+                    logger.exception("Failed to send digest to %s", recipient.name)
+            return
+
+        for method, events, recipient in digests:
+            with collect() as deliveries:
+                try:
+                    send_digest(method, events, recipient)
+                except Exception:  # pylint: disable=broad-exception-caught
+                    logger.exception("Failed to send digest to %s", recipient.name)
+                    continue
+            submit_deliveries(events[-1], deliveries, settings)
+
+    def digests(
+        self, groups: Iterable[Group]
+    ) -> Iterable[tuple[NotificationMethod, list[Event], Recipient]]:
+        """Resolve the stored groups into (method, events, recipient)
+
+        Groups whose recipient is no longer configured are logged and left out.
+        """
+        # pylint: disable=import-outside-toplevel,cyclic-import
+        from gbp_notifications.routing import get_routing_table
+
+        instances = get_routing_table(self.settings).instances
+        recipients = self.settings.recipients_by_name
+
+        for path, name, events in groups:
+            if (recipient := recipients.get(name)) is None:
+                logger.warning("Recipient %r not found. Dropping its digest", name)
+                continue
+
+            method = instances.get(method_class(path))
+
+            yield method, [decode_event(event) for event in events], recipient
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def close(self) -> None:
+        """Close the buffer's store"""
+        self.store.close()
+
+
+def send_digest(
+    method: NotificationMethod, events: Sequence[Event], recipient: Recipient
+) -> None:
+    """Send the events to the recipient using the given method
+
+    If the method implements send_digest() and there is more than one event, the events
+    are sent as a single digest. Otherwise they are sent one by one.
+    """
+    if len(events) > 1 and hasattr(type(method), "send_digest"):
+        cast(DigestNotificationMethod, method).send_digest(events, recipient)
+        return
+
+    for event in events:
+        method.send(event, recipient)
+
+
+def method_path(method: NotificationMethod) -> str:
+    """Return the (importable) path of the NotificationMethod's class"""
+    return f"{type(method).__module__}:{type(method).__qualname__}"
+
+
+def method_class(path: str) -> type[NotificationMethod]:
+    """Import the NotificationMethod class with the given method_path()"""
+    module_name, _, name = path.partition(":")
+    method: type[NotificationMethod] = getattr(
+        importlib.import_module(module_name), name
+    )
+
+    return method
+
+
+_buffer: DigestBuffer | None = None  # pylint: disable=invalid-name
+
+
+def get_digest_buffer(settings: "Settings") -> DigestBuffer:
+    """Return the DigestBuffer for the given Settings
+
+    The buffer is reused as long as it is given the same Settings object (see
+    get_routing_table()). When the settings change, the new buffer takes over the
+    previous buffer's store if it is at the same path. Otherwise the previous buffer is
+    flushed (unless its events are kept in DIGEST_DB) and closed.
+    """
+    global _buffer  # pylint: disable=global-statement
+
+    buffer = previous = _buffer
+
+    if buffer is None or buffer.settings is not settings:
+        if previous is not None and previous.store.path == (
+            settings.DIGEST_DB or MEMORY
+        ):
+            buffer = _buffer = DigestBuffer(settings, previous.store)
+        else:
+            buffer = _buffer = DigestBuffer(settings)
+
+            if previous is not None:
+                close_buffer(previous)
+
+    return buffer
+
+
+def flush_digests() -> None:
+    """Discard the current DigestBuffer
+
+    Unless its events are kept in DIGEST_DB, where they outlive the process, they are
+    sent first.
+    """
+    global _buffer  # pylint: disable=global-statement
+
+    buffer, _buffer = _buffer, None
+
+    if buffer is not None:
+        close_buffer(buffer)
+
+
+def clear_digest_buffer() -> None:
+    """Close and discard the current DigestBuffer without sending its events"""
+    global _buffer  # pylint: disable=global-statement
+
+    buffer, _buffer = _buffer, None
+
+    if buffer is not None:
+        buffer.close()
+
+
+def close_buffer(buffer: DigestBuffer) -> None:
+    """Close the DigestBuffer, sending its events unless they are kept in DIGEST_DB"""
+    if not buffer.shared:
+        buffer.flush(everything=True)
+
+    buffer.close()
+
+
+atexit.register(flush_digests)
@@ -16,3 +16,8 @@ class GBPNotificationsConfig(AppConfig):
         """Django app initialization"""
         # register signal handlers
         import_module("gbp_notifications.signals")
+
+        # send the outbox deliveries and digests that are due
+        poller = import_module("gbp_notifications.poller")
+        if poller.enabled():
+            poller.start()
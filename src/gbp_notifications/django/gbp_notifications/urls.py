@@ -0,0 +1,9 @@
+"""Django urlconf for gbp-notifications"""
+
+from django.urls import path
+
+from . import views
+
+urlpatterns = [
+    path("notifications/metrics", views.metrics, name="gbp-notifications-metrics")
+]
@@ -0,0 +1,17 @@
+"""Django views for gbp-notifications"""
+
+from django.http import HttpRequest, HttpResponse
+
+from gbp_notifications.metrics import render
+from gbp_notifications.settings import Settings
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def metrics(_request: HttpRequest) -> HttpResponse:
+    """The metrics, in the Prometheus text exposition format
+
+    These are the metrics of all the processes if METRICS_DB is set, otherwise the
+    metrics of this process.
+    """
+    return HttpResponse(render(Settings.from_environ()), content_type=CONTENT_TYPE)
@@ -15,3 +15,25 @@ class TemplateNotFoundError(
     jinja2.exceptions.TemplateNotFound, NotificationMethodError
 ):
     """Raised when the given template was not found"""
+
+
+class WebhookConfigError(ValueError, NotificationMethodError):
+    """Raised when a recipient's webhook config is invalid"""
+
+
+class CircuitOpenError(NotificationMethodError):
+    """Raised when deliveries to a destination are suspended by its circuit breaker"""
+
+    def __init__(self, destination: str, wait: float) -> None:
+        super().__init__(f"Circuit open for {destination}. Retry in {wait:.1f}s")
+        self.destination = destination
+        self.wait = wait
+
+
+class RateLimitedError(NotificationMethodError):
+    """Raised when a rate-limited delivery can't be deferred or waited for"""
+
+    def __init__(self, destination: str, wait: float) -> None:
+        super().__init__(f"Rate limit exceeded for {destination} for {wait:.1f}s")
+        self.destination = destination
+        self.wait = wait
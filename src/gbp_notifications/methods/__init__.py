@@ -6,25 +6,136 @@ Currently only email is supported.
 """
 
 import importlib.metadata
-from functools import lru_cache
-from typing import TYPE_CHECKING
-
-from gbp_notifications.exceptions import MethodNotFoundError
+import logging
+import threading
+from typing import TYPE_CHECKING, cast
 
 if TYPE_CHECKING:  # pragma: nocover
-    from gbp_notifications.types import NotificationMethod
+    from gbp_notifications.settings import Settings
+    from gbp_notifications.types import ManagedNotificationMethod, NotificationMethod
+
+ENTRY_POINT_GROUP = "gbp_notifications.notification_method"
+
+logger = logging.getLogger(__name__)
+
+
+class MethodRegistry:
+    """Registry of NotificationMethods by name
+
+    The entry points of the gbp_notifications.notification_method group are scanned
+    once, on first use, and each method is only loaded when it is first requested.
+    Methods can also be registered directly, without an entry point.
+    """
+
+    def __init__(self) -> None:
+        self._entry_points: dict[str, importlib.metadata.EntryPoint] | None = None
+        self._methods: dict[str, type["NotificationMethod"]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> type["NotificationMethod"]:
+        """Return the NotificationMethod with the given name"""
+        # pylint: disable=import-outside-toplevel
+        from gbp_notifications.exceptions import MethodNotFoundError
+
+        if (method := self._methods.get(name)) is not None:
+            return method
+
+        if (entry_point := self.entry_points().get(name)) is None:
+            raise MethodNotFoundError(name)
+
+        method = entry_point.load()
+
+        with self._lock:
+            return self._methods.setdefault(name, method)
+
+    def register(self, name: str, method: type["NotificationMethod"]) -> None:
+        """Register the NotificationMethod under the given name
+
+        This takes precedence over any entry point of the same name.
+        """
+        with self._lock:
+            self._methods[name] = method
+
+    def entry_points(self) -> dict[str, importlib.metadata.EntryPoint]:
+        """Return the method entry points by name"""
+        if (entry_points := self._entry_points) is None:
+            group = importlib.metadata.entry_points(group=ENTRY_POINT_GROUP)
+            entry_points = self._entry_points = {ep.name: ep for ep in group}
+
+        return entry_points
+
+    def warm(self) -> None:
+        """Scan the entry points and load all the methods
+
+        Prefork servers can call this (e.g. from a gunicorn when_ready hook) before
+        forking so that the child processes don't have to. Nothing calls it
+        implicitly, as it loads every installed method, used or not.
+        """
+        for name in self.entry_points():
+            try:
+                self.get(name)
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Failed to load notification method %r", name)
+
+    def clear(self) -> None:
+        """Forget the loaded and registered methods
+
+        The entry points are not re-scanned.
+        """
+        with self._lock:
+            self._methods = {}
+
+
+registry = MethodRegistry()
 
 
-@lru_cache
 def get_method(name: str) -> type["NotificationMethod"]:
     """Return the NotificationMethod with the given name"""
-    try:
-        [entry_point] = importlib.metadata.entry_points(
-            group="gbp_notifications.notification_method", name=name
-        )
-    except ValueError:
-        raise MethodNotFoundError(name) from None
+    return registry.get(name)
+
+
+def register_method(name: str, method: type["NotificationMethod"]) -> None:
+    """Register the given NotificationMethod under the given name"""
+    registry.register(name, method)
+
+
+class MethodInstances:
+    """Shared NotificationMethod instances for a given Settings
+
+    Each NotificationMethod is instantiated once, when first requested. Instances that
+    have an open() method are opened then. close() closes the instances that have a
+    close() method and forgets all of them.
+    """
+
+    def __init__(self, settings: "Settings") -> None:
+        self.settings = settings
+        self._instances: dict[type["NotificationMethod"], "NotificationMethod"] = {}
+        self._lock = threading.Lock()
+
+    def get(self, method: type["NotificationMethod"]) -> "NotificationMethod":
+        """Return the (shared) instance of the given NotificationMethod"""
+        if (instance := self._instances.get(method)) is not None:
+            return instance
+
+        with self._lock:
+            if (instance := self._instances.get(method)) is None:
+                instance = method(self.settings)
+
+                if hasattr(method, "open"):
+                    cast("ManagedNotificationMethod", instance).open()
+                self._instances[method] = instance
+
+        return instance
 
-    notification_method: type["NotificationMethod"] = entry_point.load()
+    def close(self) -> None:
+        """Close and forget the instances"""
+        with self._lock:
+            instances, self._instances = self._instances, {}
 
-    return notification_method
+        for method, instance in instances.items():
+            if not hasattr(method, "close"):
+                continue
+            try:
+                cast("ManagedNotificationMethod", instance).close()
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Failed to close %s", method.__name__)
@@ -1,19 +1,26 @@
 """Email NotificationMethod"""
 
+import itertools as it
 import logging
 from copy import deepcopy
 from email.message import EmailMessage
 from pathlib import Path
+from typing import Sequence
 
-from gentoo_build_publisher import worker
 from gentoo_build_publisher.types import GBPMetadata
 
-from gbp_notifications import tasks
+from gbp_notifications import tasks, tracing, utils
+from gbp_notifications.delivery import enqueue
 from gbp_notifications.exceptions import TemplateNotFoundError
 from gbp_notifications.settings import Settings
-from gbp_notifications.templates import load_template, render_template
+from gbp_notifications.templates import load_template, render_template, template_uses
 from gbp_notifications.types import Event, Recipient
 
+# "To" header for messages sent to a batch of recipients
+UNDISCLOSED_RECIPIENTS = "undisclosed-recipients:;"
+
+DIGEST_TEMPLATE = "email_digest.eml"
+
 logger = logging.getLogger(__name__)
 
 SUBJECT_MAP = {
@@ -32,11 +39,84 @@ class EmailMethod:  # pylint: disable=too-few-public-methods
 
     def __init__(self, settings: Settings):
         self.settings = settings
+        self._content: utils.EventMemo[str] = utils.EventMemo()
 
     def send(self, event: Event, recipient: Recipient) -> None:
         """Notify the given Recipient of the given Event"""
         if msg := self.create_message(event, recipient):
-            worker.run(tasks.sendmail, msg["From"], [msg["To"]], msg.as_string())
+            enqueue(
+                tasks.sendmail,
+                msg["From"],
+                [msg["To"]],
+                msg.as_string(),
+                destination=self.settings.EMAIL_SMTP_HOST,
+            )
+
+    def send_batch(self, event: Event, recipients: Sequence[Recipient]) -> None:
+        """Notify the given Recipients of the given Event
+
+        If EMAIL_BATCH_SIZE is greater than 1 and the event's email doesn't depend on
+        the recipient, one message is sent to up to EMAIL_BATCH_SIZE recipients at a
+        time. Otherwise each recipient is sent their own message.
+        """
+        batch_size = self.settings.EMAIL_BATCH_SIZE
+
+        if batch_size < 2 or self.is_personalized(event):
+            for recipient in recipients:
+                self.send(event, recipient)
+            return
+
+        for batch in it.batched(recipients, batch_size):
+            msg = self.compose_batch(event, batch)
+            to_addrs = [recipient_address(recipient) for recipient in batch]
+            enqueue(
+                tasks.sendmail,
+                msg["From"],
+                to_addrs,
+                msg.as_string(),
+                destination=self.settings.EMAIL_SMTP_HOST,
+            )
+
+    def send_digest(self, events: Sequence[Event], recipient: Recipient) -> None:
+        """Notify the given Recipient of the given Events in a single message
+
+        Events that don't have an email template are left out, as they would be when
+        sent individually.
+        """
+        events = [event for event in events if has_template(event)]
+
+        if len(events) < 2:
+            for event in events:
+                self.send(event, recipient)
+            return
+
+        with tracing.span(
+            "build", method="email", events=len(events), recipient=recipient.name
+        ):
+            msg = set_headers(
+                EmailMessage(),
+                Subject=digest_subject(events),
+                From=self.settings.EMAIL_FROM,
+                To=recipient_address(recipient),
+            )
+            msg.set_content(generate_digest_content(events, recipient))
+        enqueue(
+            tasks.sendmail,
+            msg["From"],
+            [msg["To"]],
+            msg.as_string(),
+            destination=self.settings.EMAIL_SMTP_HOST,
+        )
+
+    def is_personalized(self, event: Event) -> bool:
+        """Return True if the email for the given event depends on the recipient
+
+        Also return True if there is no template for the event.
+        """
+        try:
+            return template_uses(template_name(event), "recipient")
+        except TemplateNotFoundError:
+            return True
 
     def create_message(self, event: Event, recipient: Recipient) -> EmailMessage | None:
         """Return the email message for the recipient
@@ -52,16 +132,52 @@ class EmailMethod:  # pylint: disable=too-few-public-methods
 
     def compose(self, event: Event, recipient: Recipient) -> EmailMessage:
         """Compose message for the given event"""
-        msg = set_headers(
-            EmailMessage(),
-            Subject=f"Gentoo Build Publisher: {SUBJECT_MAP.get(event.name, event.name)}",
-            From=self.settings.EMAIL_FROM,
-            To=f'{recipient.name.replace("_", " ")} <{recipient.config["email"]}>',
-        )
-        msg.set_content(generate_email_content(event, recipient))
+        with tracing.span(
+            "build", method="email", event=event.name, recipient=recipient.name
+        ):
+            msg = set_headers(
+                EmailMessage(),
+                Subject=subject(event),
+                From=self.settings.EMAIL_FROM,
+                To=recipient_address(recipient),
+            )
+            msg.set_content(self.email_content(event, recipient))
 
         return msg
 
+    def compose_batch(
+        self, event: Event, recipients: Sequence[Recipient]
+    ) -> EmailMessage:
+        """Compose a message for the given event to be sent to all the recipients
+
+        The recipients are not listed in the message headers.
+        """
+        with tracing.span(
+            "build", method="email", event=event.name, recipients=len(recipients)
+        ):
+            msg = set_headers(
+                EmailMessage(),
+                Subject=subject(event),
+                From=self.settings.EMAIL_FROM,
+                To=UNDISCLOSED_RECIPIENTS,
+            )
+            msg.set_content(self.email_content(event, recipients[0]))
+
+        return msg
+
+    def email_content(self, event: Event, recipient: Recipient) -> str:
+        """Return the email body for the given event and recipient
+
+        If the event's template doesn't reference the recipient, the body is only
+        rendered once per event and shared by all of the event's recipients.
+        """
+        if template_uses(template_name(event), "recipient"):
+            return generate_email_content(event, recipient)
+
+        return self._content.get(
+            event, lambda: generate_email_content(event, recipient)
+        )
+
 
 def set_headers(msg: EmailMessage, **headers: str) -> EmailMessage:
     """Set the given headers in the given message"""
@@ -76,13 +192,56 @@ def generate_email_content(event: Event, recipient: Recipient) -> str:
     """Generate the email body"""
     gbp_meta: GBPMetadata | None = event.data.get("gbp_metadata")
     packages = gbp_meta.packages.built if gbp_meta else []
-    template_name = f"email_{event.name}.eml"
-    template = load_template(template_name)
+    template = load_template(template_name(event))
     context = {"packages": packages, "recipient": recipient, "event": event.data}
 
     return render_template(template, context)
 
 
+def generate_digest_content(events: Sequence[Event], recipient: Recipient) -> str:
+    """Generate the email body of a digest of the given events"""
+    template = load_template(DIGEST_TEMPLATE)
+    context = {
+        "events": [
+            {"name": event.name, "machine": event.machine, **event.data}
+            for event in events
+        ],
+        "recipient": recipient,
+    }
+
+    return render_template(template, context)
+
+
+def subject(event: Event) -> str:
+    """Return the email subject for the given event"""
+    return f"Gentoo Build Publisher: {SUBJECT_MAP.get(event.name, event.name)}"
+
+
+def digest_subject(events: Sequence[Event]) -> str:
+    """Return the email subject for a digest of the given events"""
+    return f"Gentoo Build Publisher: {len(events)} events"
+
+
+def recipient_address(recipient: Recipient) -> str:
+    """Return the email address (with name) of the given recipient"""
+    return f'{recipient.name.replace("_", " ")} <{recipient.config["email"]}>'
+
+
+def template_name(event: Event) -> str:
+    """Return the name of the email template for the given event"""
+    return f"email_{event.name}.eml"
+
+
+def has_template(event: Event) -> bool:
+    """Return True if there is an email template for the given event"""
+    try:
+        load_template(template_name(event))
+    except TemplateNotFoundError:
+        return False
+
+    return True
+
+
 def email_password(settings: Settings) -> str:
     """Return the email password depending on the settings"""
     if path := settings.EMAIL_SMTP_PASSWORD_FILE:
@@ -7,10 +7,10 @@ See https://pushover.net
 """
 
 from typing import Any
-
-from gentoo_build_publisher import worker
+from urllib.parse import urlsplit
 
 from gbp_notifications import tasks
+from gbp_notifications.delivery import enqueue
 from gbp_notifications.settings import Settings
 from gbp_notifications.types import Event, Recipient
 
@@ -25,9 +25,10 @@ class PushoverMethod:  # pylint: disable=too-few-public-methods
 
     def send(self, event: Event, recipient: Recipient) -> Any:
         """Send the given Event to the given Recipient"""
-        worker.run(
+        enqueue(
             tasks.send_pushover_notification,
             recipient.config["pushover"],
             "Gentoo Build Publisher",
             f"{event.machine}: {event.name.replace('_', ' ')}",
+            destination=urlsplit(URL).netloc,
         )
@@ -1,12 +1,12 @@
 """Webhook NotificationMethod"""
 
-from dataclasses import asdict
-from typing import Any, cast
+import logging
+from typing import Any, Sequence, cast
 
 import orjson
-from gentoo_build_publisher import worker
 
-from gbp_notifications import tasks
+from gbp_notifications import tasks, tracing, utils
+from gbp_notifications.delivery import enqueue
 from gbp_notifications.settings import Settings
 from gbp_notifications.types import Event, Recipient
 
@@ -15,6 +15,8 @@ dumps = orjson.dumps  # pylint: disable=no-member
 # Build fields we want to send in the payload
 WANTED_FIELDS = ("machine", "build_id", "keep", "submitted", "completed", "built")
 
+logger = logging.getLogger(__name__)
+
 
 class WebhookMethod:  # pylint: disable=too-few-public-methods
     """Webhook method"""
@@ -22,11 +24,69 @@ class WebhookMethod:  # pylint: disable=too-few-public-methods
     def __init__(self, settings: Settings) -> None:
         """Initialize with the given Settings"""
         self.settings = settings
+        self._body: utils.EventMemo[str] = utils.EventMemo()
 
     def send(self, event: Event, recipient: Recipient) -> Any:
         """Send the given Event to the given Recipient"""
-        body = create_body(event, recipient)
-        worker.run(tasks.send_http_request, recipient.name, body)
+        if not self.has_endpoint(recipient):
+            return
+
+        enqueue(
+            tasks.send_http_request,
+            recipient.name,
+            self.body(event, recipient),
+            destination=self.settings.webhook_endpoints[recipient.name].host,
+        )
+
+    def send_batch(self, event: Event, recipients: Sequence[Recipient]) -> Any:
+        """Send the given Event to the given Recipients
+
+        The body is the same for all recipients, so it is only created once. Each
+        endpoint is still sent its own delivery, with the endpoint's host as its
+        destination, so that rate limits, circuit breakers and retries apply per
+        endpoint. Recipients without a valid endpoint are logged and skipped.
+        """
+        for recipient in recipients:
+            self.send(event, recipient)
+
+    def send_digest(self, events: Sequence[Event], recipient: Recipient) -> Any:
+        """Send the given Events to the given Recipient
+
+        The body is a JSON array of the events' payloads.
+        """
+        if not self.has_endpoint(recipient):
+            return
+
+        with tracing.span(
+            "build", method="webhook", events=len(events), recipient=recipient.name
+        ):
+            body = cast(
+                str, dumps([create_payload(event) for event in events]).decode()
+            )
+        enqueue(
+            tasks.send_http_request,
+            recipient.name,
+            body,
+            destination=self.settings.webhook_endpoints[recipient.name].host,
+        )
+
+    def has_endpoint(self, recipient: Recipient) -> bool:
+        """Return True if the recipient has a (valid) webhook endpoint
+
+        Recipients whose webhook config is invalid are logged and skipped.
+        """
+        if recipient.name in self.settings.webhook_endpoints:
+            return True
+
+        logger.warning("No valid webhook for %s. Skipping", recipient.name)
+        return False
+
+    def body(self, event: Event, recipient: Recipient) -> str:
+        """Return the JSON body for the event
+
+        The body is only created once per event.
+        """
+        return self._body.get(event, lambda: create_body(event, recipient))
 
 
 def create_body(event: Event, _recipient: Recipient) -> str:
@@ -34,11 +94,22 @@ def create_body(event: Event, _recipient: Recipient) -> str:
 
     Return None if no message could be created for the event/recipient combo.
     """
-    event_dict = asdict(event)
+    with tracing.span("build", method="webhook", event=event.name):
+        return cast(str, dumps(create_payload(event)).decode("utf8"))
+
+
+def create_payload(event: Event) -> dict[str, Any]:
+    """Return the (JSON-serializable) webhook payload for the event
+
+    The event data is not copied. orjson serializes the (dataclass) values directly. Of
+    the build, only the WANTED_FIELDS are included, as the logs/notes take up way too
+    much payload in the HTTP request.
+    """
+    data = dict(event.data)
 
-    if build := event_dict["data"].get("build"):
-        # remove logs/notes as they take up way too much payload in the HTTP request
-        build = dict((k, v) for k, v in build.items() if k in WANTED_FIELDS)
-        event_dict["data"]["build"] = build
+    if build := data.get("build"):
+        data["build"] = {
+            name: getattr(build, name) for name in WANTED_FIELDS if hasattr(build, name)
+        }
 
-    return cast(str, dumps(event_dict).decode("utf8"))
+    return {"name": event.name, "machine": event.machine, "data": data}
@@ -0,0 +1,505 @@
+"""In-process metrics
+
+Counters and histograms are kept in the process's Registry and rendered in the
+Prometheus text exposition format by the metrics view. Each process (web server, worker)
+has its own Registry.
+
+If METRICS_DB is set, each process also adds its metrics to an SQLite database that is
+shared by all the processes on the host: flush() adds what was recorded since the last
+flush. The metrics view then renders the metrics of all the processes.
+"""
+
+import bisect
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterable, Iterator, Sequence, TypeVar
+
+if TYPE_CHECKING:  # pragma: nocover
+    from gbp_notifications.settings import Settings
+
+LabelValues = tuple[str, ...]
+# label values -> the metric's values (see Metric.state())
+State = dict[LabelValues, list[float]]
+
+logger = logging.getLogger(__name__)
+
+# Default histogram buckets, in seconds
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Histogram buckets for sizes, in bytes
+BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Metric:
+    """Base class for metrics"""
+
+    type = ""
+
+    def __init__(self, name: str, help_: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help_
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def label_values(self, labels: dict[str, str]) -> LabelValues:
+        """Return the values of the given labels in the metric's label order
+
+        Raise ValueError if the labels don't match the metric's.
+        """
+        if set(labels) != set(self.labels):
+            raise ValueError(
+                f"{self.name} has labels {self.labels}, not {tuple(labels)}"
+            )
+
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        """Yield the metric's (sample name, labels, value) samples"""
+        raise NotImplementedError
+
+    def reset(self) -> None:
+        """Reset the metric's values"""
+        raise NotImplementedError
+
+    def state(self) -> State:
+        """Return (a copy of) the metric's values by label values"""
+        raise NotImplementedError
+
+    def merge(self, state: State) -> None:
+        """Add the given state (of the same metric) to the metric's values"""
+        raise NotImplementedError
+
+    def clone(self) -> "Metric":
+        """Return a copy of the metric without its values"""
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """A value that only goes up"""
+
+    type = "counter"
+
+    def __init__(self, name: str, help_: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, help_, labels)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increment the counter with the given labels by the given amount"""
+        key = self.label_values(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        """Return the counter's value for the given labels"""
+        with self._lock:
+            return self._values.get(self.label_values(labels), 0.0)
+
+    def samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        with self._lock:
+            values = dict(self._values)
+
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labels, key)), value
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values = {}
+
+    def state(self) -> State:
+        with self._lock:
+            return {key: [value] for key, value in self._values.items()}
+
+    def merge(self, state: State) -> None:
+        with self._lock:
+            for key, [value] in state.items():
+                self._values[key] = self._values.get(key, 0.0) + value
+
+    def clone(self) -> "Counter":
+        return Counter(self.name, self.help, self.labels)
+
+
+class Histogram(Metric):
+    """Distribution of observed values"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = SECONDS,
+    ) -> None:
+        super().__init__(name, help_, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [bucket counts..., +Inf count, sum]
+        self._values: dict[LabelValues, list[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Record the given value"""
+        key = self.label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            if (values := self._values.get(key)) is None:
+                values = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            values[index] += 1
+            values[-1] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the number of seconds spent in the with block"""
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        """Return the number of values observed with the given labels"""
+        with self._lock:
+            values = self._values.get(self.label_values(labels))
+
+        return int(sum(values[:-1])) if values else 0
+
+    def sum(self, **labels: str) -> float:
+        """Return the sum of the values observed with the given labels"""
+        with self._lock:
+            values = self._values.get(self.label_values(labels))
+
+        return values[-1] if values else 0.0
+
+    def samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        with self._lock:
+            values = {key: list(value) for key, value in self._values.items()}
+
+        for key, counts in sorted(values.items()):
+            labels = dict(zip(self.labels, key))
+            cumulative = 0.0
+
+            for bound, count in zip([*self.buckets, math.inf], counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else format_value(bound)
+                yield f"{self.name}_bucket", {**labels, "le": le}, cumulative
+
+            yield f"{self.name}_sum", labels, counts[-1]
+            yield f"{self.name}_count", labels, cumulative
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values = {}
+
+    def state(self) -> State:
+        with self._lock:
+            return {key: list(values) for key, values in self._values.items()}
+
+    def merge(self, state: State) -> None:
+        size = len(self.buckets) + 2
+
+        with self._lock:
+            for key, values in state.items():
+                if len(values) != size:
+                    continue  # the buckets have changed
+                current = self._values.setdefault(key, [0.0] * size)
+                current[:] = [a + b for a, b in zip(current, values)]
+
+    def clone(self) -> "Histogram":
+        return Histogram(self.name, self.help, self.labels, self.buckets)
+
+
+_M = TypeVar("_M", bound=Metric)
+
+
+class Registry:
+    """Registry of metrics by name"""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+        self._lock = threading.Lock()
+        # The metrics' states when they were last flushed
+        self._flushed: dict[str, State] = {}
+        self._flush_lock = threading.Lock()
+
+    def counter(self, name: str, help_: str, labels: Sequence[str] = ()) -> Counter:
+        """Return the Counter with the given name, registering it if needed"""
+        return self.register(Counter(name, help_, labels))
+
+    def histogram(
+        self,
+        name: str,
+        help_: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = SECONDS,
+    ) -> Histogram:
+        """Return the Histogram with the given name, registering it if needed"""
+        return self.register(Histogram(name, help_, labels, buckets))
+
+    def register(self, metric: _M) -> _M:
+        """Register the given metric and return it
+
+        If a metric of the same name and type is already registered, return that one
+        instead. Raise ValueError if the existing metric is of another type.
+        """
+        with self._lock:
+            existing = self._metrics.setdefault(metric.name, metric)
+
+        if type(existing) is not type(metric):
+            raise ValueError(
+                f"{metric.name} is already registered as a {existing.type}"
+            )
+
+        return existing  # type: ignore[return-value]
+
+    def get(self, name: str) -> Metric:
+        """Return the metric with the given name"""
+        return self._metrics[name]
+
+    def render(self) -> str:
+        """Return the metrics in the Prometheus text exposition format"""
+        lines: list[str] = []
+
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f"# HELP {name} {escape(metric.help, quote=False)}")
+            lines.append(f"# TYPE {name} {metric.type}")
+
+            for sample, labels, value in metric.samples():
+                lines.append(f"{sample}{format_labels(labels)} {format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """Reset the values of all the metrics"""
+        with self._flush_lock:
+            for metric in list(self._metrics.values()):
+                metric.reset()
+            self._flushed = {}
+
+    def flush(self, store: "MetricsStore") -> None:
+        """Add the values recorded since the last flush to the store"""
+        with self._flush_lock:
+            states = {name: m.state() for name, m in list(self._metrics.items())}
+            deltas: list[tuple[str, LabelValues, int, float]] = []
+
+            for name, state in states.items():
+                flushed = self._flushed.get(name, {})
+
+                for key, values in state.items():
+                    previous = flushed.get(key, [0.0] * len(values))
+                    deltas.extend(
+                        (name, key, index, value - old)
+                        for index, (value, old) in enumerate(zip(values, previous))
+                        if value != old
+                    )
+            store.add(deltas)
+            self._flushed = states
+
+    def mark_flushed(self) -> None:
+        """Consider the current values flushed
+
+        This is done in forked child processes, whose parent flushes the values they
+        inherit.
+        """
+        with self._flush_lock:
+            self._flushed = {name: m.state() for name, m in self._metrics.items()}
+
+    def aggregate(self, store: "MetricsStore") -> "Registry":
+        """Return a Registry of the (registered) metrics with the values in the store"""
+        aggregated = Registry()
+        states = store.load()
+
+        for name, metric in sorted(self._metrics.items()):
+            aggregated.register(metric.clone()).merge(states.get(name, {}))
+
+        return aggregated
+
+
+def method_label(method: object) -> str:
+    """Return the metric label (e.g. "email") for the given NotificationMethod"""
+    return type(method).__name__.removesuffix("Method").lower()
+
+
+def task_label(func: object) -> str:
+    """Return the metric label (e.g. "sendmail") for the given worker function"""
+    return str(getattr(func, "__name__", type(func).__name__))
+
+
+def escape(value: str, quote: bool = True) -> str:
+    """Escape the value for the text exposition format"""
+    value = value.replace("\\", "\\\\").replace("\n", "\\n")
+
+    return value.replace('"', '\\"') if quote else value
+
+
+def format_labels(labels: dict[str, str]) -> str:
+    """Format the labels for the text exposition format"""
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def format_value(value: float) -> str:
+    """Format the value for the text exposition format"""
+    if value == math.inf:
+        return "+Inf"
+
+    return repr(float(value))
+
+
+class MetricsStore:
+    """SQLite store of metrics' values
+
+    Values are added (rather than set) so that the store sums the values of all the
+    processes that flush to it.
+    """
+
+    def __init__(self, path: str) -> None:
+        # pylint: disable=import-outside-toplevel
+        from gbp_notifications.connections import SQLiteDatabase
+
+        self.path = path
+        self.db = SQLiteDatabase(
+            path,
+            "CREATE TABLE IF NOT EXISTS metric_values (name TEXT, labels TEXT,"
+            " idx INTEGER, value REAL, PRIMARY KEY (name, labels, idx))",
+            isolation_level=None,
+        )
+
+    def add(self, values: Iterable[tuple[str, LabelValues, int, float]]) -> None:
+        """Add the (metric name, label values, index, value) values to the store"""
+        rows = [
+            (name, json.dumps(key), index, value) for name, key, index, value in values
+        ]
+
+        if not rows:
+            return
+
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO metric_values (name, labels, idx, value)"
+                " VALUES (?, ?, ?, ?) ON CONFLICT (name, labels, idx)"
+                " DO UPDATE SET value = value + excluded.value",
+                rows,
+            )
+
+    def load(self) -> dict[str, State]:
+        """Return the stored values as metric name -> State"""
+        with self.db.lock:
+            rows = (
+                self.db.connection()
+                .execute(
+                    "SELECT name, labels, idx, value FROM metric_values"
+                    " ORDER BY name, labels, idx"
+                )
+                .fetchall()
+            )
+
+        states: dict[str, State] = {}
+
+        for name, labels, index, value in rows:
+            values = states.setdefault(name, {}).setdefault(
+                tuple(json.loads(labels)), []
+            )
+            values.extend([0.0] * (index + 1 - len(values)))
+            values[index] = value
+
+        return states
+
+    def close(self) -> None:
+        """Close the database connection"""
+        self.db.close()
+
+
+_store: MetricsStore | None = None  # pylint: disable=invalid-name
+
+
+def get_metrics_store(settings: "Settings") -> MetricsStore:
+    """Return the MetricsStore for the given Settings"""
+    global _store  # pylint: disable=global-statement
+
+    store = previous = _store
+
+    if store is None or store.path != settings.METRICS_DB:
+        store = _store = MetricsStore(settings.METRICS_DB)
+
+        if previous is not None:
+            previous.close()
+
+    return store
+
+
+def clear_metrics_store() -> None:
+    """Close and discard the current MetricsStore"""
+    global _store  # pylint: disable=global-statement
+
+    if _store is not None:
+        _store.close()
+        _store = None
+
+
+def flush(settings: "Settings") -> None:
+    """Add the process's metrics recorded since the last flush to METRICS_DB, if set
+
+    Failures are logged.
+    """
+    if not settings.METRICS_DB:
+        return
+
+    try:
+        registry.flush(get_metrics_store(settings))
+    except Exception:  # pylint: disable=broad-exception-caught
+        logger.exception("Failed to flush metrics to %s", settings.METRICS_DB)
+
+
+def render(settings: "Settings") -> str:
+    """Render the metrics (of all processes if METRICS_DB is set)"""
+    if not settings.METRICS_DB:
+        return registry.render()
+
+    store = get_metrics_store(settings)
+    registry.flush(store)
+
+    return registry.aggregate(store).render()
+
+
+registry = Registry()
+os.register_at_fork(after_in_child=registry.mark_flushed)
+
+EVENTS = registry.counter(
+    "gbp_notifications_events_total", "Events received", ["machine", "event"]
+)
+RECIPIENTS = registry.counter(
+    "gbp_notifications_recipients_total", "Recipients resolved for events", ["method"]
+)
+DISPATCH_SECONDS = registry.histogram(
+    "gbp_notifications_dispatch_seconds",
+    "Time spent routing, rendering and queuing an event's notifications",
+)
+RENDER_SECONDS = registry.histogram(
+    "gbp_notifications_render_seconds", "Template render time", ["template"]
+)
+PAYLOAD_BYTES = registry.histogram(
+    "gbp_notifications_payload_bytes",
+    "Size of the notifications handed to the worker",
+    ["task"],
+    BYTES,
+)
+QUEUE_SECONDS = registry.histogram(
+    "gbp_notifications_queue_seconds",
+    "Time deliveries spent in the outbox before they were sent",
+    ["task"],
+)
+SEND_SECONDS = registry.histogram(
+    "gbp_notifications_send_seconds", "Time spent sending notifications", ["method"]
+)
+FAILURES = registry.counter(
+    "gbp_notifications_failures_total",
+    "Failed sends by error type",
+    ["method", "error"],
+)
@@ -0,0 +1,357 @@
+"""Durable outbox of deliveries
+
+When OUTBOX_DB is set, an event's notifications are rendered by the process that handled
+the signal and the resulting deliveries are appended, in a single transaction, to an
+SQLite (WAL) outbox. The worker's drain_outbox() task then claims them in batches,
+delivers them and marks them done. Deliveries that are in the outbox survive worker
+crashes and restarts.
+
+Claims are leases. If a drainer dies before marking its batch done, the batch is claimed
+again once the lease expires. Deliveries that are to be retried (or that are held back
+by a rate limit) stay in the outbox: they are pending again, as their next attempt, but
+aren't claimed before their not_before time. The poller (see the poller module) queues
+drain_outbox() tasks for them. Each entry's key identifies the delivery: the event
+(machine, build and name), the worker task, the destination and the dispatch that
+spooled it. Deliveries with the same content (e.g. Pushover notifications of two builds
+of a machine) are therefore separate entries. Delivered entries are kept for
+OUTBOX_RETENTION seconds.
+"""
+
+import functools
+import json
+import logging
+import time
+import uuid
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Iterable, Sequence
+
+from gbp_notifications import metrics
+from gbp_notifications.connections import SQLiteDatabase
+from gbp_notifications.dedup import event_build_id
+from gbp_notifications.delivery import Delivery, attempt_number, deliver_each
+from gbp_notifications.types import Event
+
+if TYPE_CHECKING:  # pragma: nocover
+    from gbp_notifications.settings import Settings
+
+SCHEMA = """\
+CREATE TABLE IF NOT EXISTS outbox (
+    key TEXT PRIMARY KEY,
+    job TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending',
+    lease TEXT NOT NULL DEFAULT '',
+    leased_until REAL NOT NULL DEFAULT 0,
+    claims INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0,
+    attempt INTEGER NOT NULL DEFAULT 1,
+    error TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status, created);
+"""
+
+# The condition of entries that can be claimed (at the given time, given twice)
+DUE = "status = 'pending' AND leased_until <= ? AND not_before <= ?"
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, kw_only=True)
+class Entry:
+    """A Delivery claimed from the Outbox"""
+
+    key: str
+    lease: str
+    created: float
+    delivery: Delivery
+
+    attempt: int = 1
+    """The number of the delivery attempt, the original delivery being attempt 1"""
+
+
+_entry: ContextVar[Entry | None] = ContextVar("gbp_notifications_entry", default=None)
+
+
+class Outbox:
+    """SQLite outbox of deliveries
+
+    The database can be shared by all the processes on the host.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.db = SQLiteDatabase(path, SCHEMA, isolation_level=None)
+
+    def append(
+        self,
+        deliveries: Iterable[tuple[str, Delivery]],
+        *,
+        not_before: float = 0.0,
+        attempt: int = 1,
+    ) -> int:
+        """Append the (key, Delivery) pairs to the outbox
+
+        The deliveries are not claimed before the not_before time. Keys that are already
+        in the outbox are ignored. Return the number of deliveries appended.
+        """
+        now = time.time()
+        rows = [
+            (key, json.dumps(delivery.to_job()), now, not_before, attempt)
+            for key, delivery in deliveries
+        ]
+
+        with self.db.transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO outbox (key, job, created, not_before, attempt)"
+                " VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            appended: int = conn.total_changes - before
+
+        return appended
+
+    def claim(self, limit: int, lease_time: float) -> list[Entry]:
+        """Claim up to `limit` pending deliveries for `lease_time` seconds
+
+        Deliveries whose leases have expired are pending again. Deliveries whose
+        not_before time hasn't come are not claimed.
+        """
+        now = time.time()
+        lease = uuid.uuid4().hex
+
+        with self.db.transaction() as conn:
+            rows = conn.execute(
+                f"SELECT key, job, created, attempt FROM outbox WHERE {DUE}"
+                " ORDER BY created LIMIT ?",
+                (now, now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE outbox SET lease = ?, leased_until = ?, claims = claims + 1"
+                " WHERE key = ?",
+                [(lease, now + lease_time, row[0]) for row in rows],
+            )
+
+        return [
+            Entry(
+                key=row[0],
+                lease=lease,
+                created=row[2],
+                delivery=Delivery.from_job(json.loads(row[1])),
+                attempt=row[3],
+            )
+            for row in rows
+        ]
+
+    def done(self, entries: Iterable[Entry]) -> None:
+        """Mark the claimed entries as delivered
+
+        Entries whose lease was lost (to another drainer) are not touched.
+        """
+        self.set_status(((entry, "done", "") for entry in entries))
+
+    def failed(self, entry: Entry, error: Exception) -> None:
+        """Mark the claimed entry as failed with the given error"""
+        self.set_status([(entry, "failed", repr(error))])
+
+    def defer(self, entry: Entry, not_before: float, attempt: int) -> bool:
+        """Put the claimed entry back, to be claimed (as the given attempt) later
+
+        The entry is not claimed before the not_before time. Return False if the entry's
+        lease was lost (to another drainer).
+        """
+        with self.db.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE outbox SET not_before = ?, attempt = ?, updated = ?, lease = '',"
+                " leased_until = 0 WHERE key = ? AND lease = ? AND status = 'pending'",
+                (not_before, attempt, time.time(), entry.key, entry.lease),
+            )
+
+        return cursor.rowcount > 0
+
+    def set_status(self, updates: Iterable[tuple[Entry, str, str]]) -> None:
+        """Set the (status, error) of the claimed entries"""
+        now = time.time()
+
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "UPDATE outbox SET status = ?, error = ?, updated = ?, leased_until = 0"
+                " WHERE key = ? AND lease = ? AND status = 'pending'",
+                [
+                    (status, error, now, entry.key, entry.lease)
+                    for entry, status, error in updates
+                ],
+            )
+
+    def purge(self, before: float) -> int:
+        """Delete the delivered entries that were delivered before the given time
+
+        Return the number of entries deleted.
+        """
+        with self.db.transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM outbox WHERE status = 'done' AND updated < ?", (before,)
+            )
+
+        deleted: int = cursor.rowcount
+
+        return deleted
+
+    def pending(self) -> int:
+        """Return the number of deliveries that have not yet been delivered"""
+        with self.db.lock:
+            [count] = (
+                self.db.connection()
+                .execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'")
+                .fetchone()
+            )
+
+        return int(count)
+
+    def due(self) -> bool:
+        """Return True if the outbox has deliveries that can be claimed now"""
+        now = time.time()
+
+        with self.db.lock:
+            row = (
+                self.db.connection()
+                .execute(f"SELECT 1 FROM outbox WHERE {DUE} LIMIT 1", (now, now))
+                .fetchone()
+            )
+
+        return row is not None
+
+    def close(self) -> None:
+        """Close the database connection"""
+        self.db.close()
+
+
+def entry_keys(event: Event, deliveries: Sequence[Delivery]) -> list[str]:
+    """Return the outbox keys of the deliveries made for (one dispatch of) the event
+
+    A key looks like "babette.1234.postpull/sendmail/smtp.host.invalid/<dispatch>.0"
+    """
+    dispatch = uuid.uuid4().hex
+    prefix = f"{event.machine}.{event_build_id(event) or '-'}.{event.name}"
+
+    return [
+        f"{prefix}/{metrics.task_label(delivery.func)}/{delivery.destination}"
+        f"/{dispatch}.{index}"
+        for index, delivery in enumerate(deliveries)
+    ]
+
+
+def drain(outbox: Outbox, settings: "Settings") -> list[Exception]:
+    """Deliver the outbox's pending deliveries, a batch at a time
+
+    Deliveries that are deferred (see defer()) stay pending. Return the errors of failed
+    deliveries.
+    """
+    errors: list[Exception] = []
+
+    while entries := outbox.claim(settings.OUTBOX_BATCH_SIZE, settings.OUTBOX_LEASE):
+        now = time.time()
+
+        for entry in entries:
+            metrics.QUEUE_SECONDS.observe(
+                now - entry.created, task=metrics.task_label(entry.delivery.func)
+            )
+
+        results = deliver_each(
+            [
+                Delivery(
+                    func=functools.partial(run_entry, entry),
+                    args=(),
+                    destination=entry.delivery.destination,
+                )
+                for entry in entries
+            ],
+            max_concurrency=settings.ASYNC_MAX_CONCURRENCY,
+            max_per_destination=settings.ASYNC_MAX_PER_DESTINATION,
+        )
+        outbox.done(entry for entry, error in zip(entries, results) if error is None)
+
+        for entry, error in zip(entries, results):
+            if error is not None:
+                outbox.failed(entry, error)
+                errors.append(error)
+
+    if purged := outbox.purge(time.time() - settings.OUTBOX_RETENTION):
+        logger.debug("Purged %s delivered entries from the outbox", purged)
+
+    metrics.flush(settings)
+
+    return errors
+
+
+def run_entry(entry: Entry) -> Any:
+    """Make the claimed entry's delivery (as the entry's attempt)
+
+    defer() puts the entry back if the delivery defers itself.
+    """
+    token = _entry.set(entry)
+
+    try:
+        with attempt_number(entry.attempt):
+            return entry.delivery()
+    finally:
+        _entry.reset(token)
+
+
+def defer(
+    settings: "Settings", delivery: Delivery, delay: float, *, attempt: int
+) -> bool:
+    """Keep the delivery in the outbox, to be made (as the given attempt) later
+
+    The delivery is not made for `delay` seconds. If it is the delivery of the entry
+    being drained, the entry is put back. Otherwise it is appended to the outbox.
+
+    Return False if there is no outbox (OUTBOX_DB is not set).
+    """
+    if not settings.OUTBOX_DB:
+        return False
+
+    outbox = get_outbox(settings)
+    not_before = time.time() + delay
+
+    if (entry := _entry.get()) is not None and entry.delivery == delivery:
+        # If the lease was lost, the entry is another drainer's to deliver
+        outbox.defer(entry, not_before, attempt)
+    else:
+        key = (
+            f"deferred/{metrics.task_label(delivery.func)}/{delivery.destination}"
+            f"/{uuid.uuid4().hex}"
+        )
+        outbox.append([(key, delivery)], not_before=not_before, attempt=attempt)
+
+    return True
+
+
+_outbox: Outbox | None = None  # pylint: disable=invalid-name
+
+
+def get_outbox(settings: "Settings") -> Outbox:
+    """Return the Outbox for the given Settings"""
+    global _outbox  # pylint: disable=global-statement
+
+    outbox = previous = _outbox
+
+    if outbox is None or outbox.path != settings.OUTBOX_DB:
+        outbox = _outbox = Outbox(settings.OUTBOX_DB)
+
+        if previous is not None:
+            previous.close()
+
+    return outbox
+
+
+def clear_outbox() -> None:
+    """Close and discard the current Outbox"""
+    global _outbox  # pylint: disable=global-statement
+
+    outbox, _outbox = _outbox, None
+
+    if outbox is not None:
+        outbox.close()
@@ -0,0 +1,172 @@
+"""Poller of the outbox and the digest buffer
+
+Deliveries in the outbox are only delivered when a drain_outbox() task runs. The dispatch
+that spools them submits one, but nothing is submitted for deliveries that are deferred
+(retries) or whose drainer died before marking them done. Likewise nothing sends
+buffered digests once their window has passed. So each process that loads the Django
+app, and whose environment sets OUTBOX_DB or DIGEST_WINDOW, runs a poller thread. It
+polls first when the process starts, then every POLL_INTERVAL seconds.
+
+When OUTBOX_DB is set, the poller submits a drain_outbox() task whenever the outbox has
+deliveries that are due. When DIGEST_WINDOW is set, it submits a flush_digests() task
+whenever digests (in DIGEST_DB) are due, or sends the digests buffered in the process's
+memory itself. Only one process's poller submits tasks for a given database: the one
+holding the database's lease (see Election), so that the worker isn't sent a task by
+every process.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Mapping
+
+if TYPE_CHECKING:  # pragma: nocover
+    from gbp_notifications.settings import Settings
+
+LEASE_SCHEMA = """\
+CREATE TABLE IF NOT EXISTS poller_lease (
+    name TEXT PRIMARY KEY,
+    holder INTEGER NOT NULL,
+    until REAL NOT NULL
+);
+"""
+# The lease lasts this many POLL_INTERVALs, so its holder renews it well before it
+# expires
+LEASE_INTERVALS = 3
+
+logger = logging.getLogger(__name__)
+_lock = threading.Lock()
+_thread: threading.Thread | None = None  # pylint: disable=invalid-name
+_elections: dict[str, "Election"] = {}
+
+
+class Election:
+    """Election of a single poller (process) for an SQLite database
+
+    The lease is kept in a row of the database itself. The poller holding it renews it
+    each time it polls. Once it expires, e.g. because its holder exited, the next poller
+    to poll takes it over.
+    """
+
+    def __init__(self, path: str) -> None:
+        # pylint: disable=import-outside-toplevel
+        from gbp_notifications.connections import SQLiteDatabase
+
+        self.db = SQLiteDatabase(path, LEASE_SCHEMA, isolation_level=None)
+
+    def elected(self, lease: float) -> bool:
+        """Return True if this process holds the lease, taking or renewing it
+
+        The lease is renewed for `lease` seconds.
+        """
+        holder = os.getpid()
+        now = time.time()
+
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                "SELECT holder, until FROM poller_lease WHERE name = 'poller'"
+            ).fetchone()
+
+            if row is not None and row[0] != holder and row[1] > now:
+                return False
+
+            conn.execute(
+                "INSERT OR REPLACE INTO poller_lease (name, holder, until)"
+                " VALUES ('poller', ?, ?)",
+                (holder, now + lease),
+            )
+
+        return True
+
+    def close(self) -> None:
+        """Close the database connection"""
+        self.db.close()
+
+
+def elected(path: str, settings: "Settings") -> bool:
+    """Return True if this process's poller is the one to poll the given database"""
+    if (election := _elections.get(path)) is None:
+        election = _elections[path] = Election(path)
+
+    return election.elected(LEASE_INTERVALS * settings.POLL_INTERVAL)
+
+
+def clear_elections() -> None:
+    """Close and discard the process's Elections"""
+    while _elections:
+        _, election = _elections.popitem()
+        election.close()
+
+
+def poll(settings: "Settings") -> None:
+    """Have the outbox deliveries and the digests that are due sent"""
+    # pylint: disable=import-outside-toplevel,cyclic-import
+    from gentoo_build_publisher import worker
+
+    from gbp_notifications import tasks
+    from gbp_notifications.digest import get_digest_buffer
+    from gbp_notifications.outbox import get_outbox
+
+    if (
+        settings.OUTBOX_DB
+        and elected(settings.OUTBOX_DB, settings)
+        and get_outbox(settings).due()
+    ):
+        worker.run(tasks.drain_outbox)
+
+    if settings.DIGEST_WINDOW > 0:
+        buffer = get_digest_buffer(settings)
+
+        if not buffer.shared:
+            if buffer.due():
+                buffer.flush()
+        elif elected(settings.DIGEST_DB, settings) and buffer.due():
+            worker.run(tasks.flush_digests)
+
+
+def polling(settings: "Settings") -> bool:
+    """Return True if there is anything to poll"""
+    return bool(settings.OUTBOX_DB) or settings.DIGEST_WINDOW > 0
+
+
+def enabled(environ: Mapping[str, str] = os.environ) -> bool:
+    """Return True if the environment sets anything to poll
+
+    This is polling() for the environment, without loading the Settings.
+    """
+    try:
+        window = int(environ.get("GBP_NOTIFICATIONS_DIGEST_WINDOW") or 0)
+    except ValueError:
+        window = 0
+
+    return bool(environ.get("GBP_NOTIFICATIONS_OUTBOX_DB")) or window > 0
+
+
+def run() -> None:
+    """Poll until the process exits. Runs in the poller thread
+
+    Return right away if there is nothing to poll.
+    """
+    # pylint: disable=import-outside-toplevel
+    from gbp_notifications.settings import Settings
+
+    while polling(settings := Settings.from_environ()):
+        try:
+            poll(settings)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Failed to poll")
+
+        time.sleep(settings.POLL_INTERVAL)
+
+
+def start() -> None:
+    """Start the process's poller thread, unless it is already running"""
+    global _thread  # pylint: disable=global-statement
+
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(
+                target=run, name="gbp-notifications-poller", daemon=True
+            )
+            _thread.start()
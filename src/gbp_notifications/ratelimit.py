@@ -0,0 +1,264 @@
+"""Outbound rate limiting
+
+Rate limits are token buckets keyed by notification method ("method:email") or by
+destination host ("destination:smtp.host.invalid"). Worker functions call throttle()
+before sending, which takes a token from every applicable bucket. It doesn't block: if
+a bucket is empty it returns the time until it has a token, and the delivery is
+deferred in the outbox until then (see retry.retrying()). Without OUTBOX_DB the worker
+waits instead, for up to RATE_LIMIT_MAX_WAIT seconds. Buckets are shared by the threads
+of a process and, if RATE_LIMIT_DB is set, by all processes using the same SQLite
+database.
+"""
+
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Mapping, Self
+
+from gbp_notifications.connections import SQLiteDatabase
+
+if TYPE_CHECKING:  # pragma: nocover
+    from gbp_notifications.settings import Settings
+
+PERIODS = {"s": 1.0, "m": 60.0, "h": 3600.0}
+RATE_RE = re.compile(r"(?P<tokens>\d+)/(?P<period>[smh])")
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, kw_only=True)
+class Rate:
+    """A rate of `tokens` per `period` seconds
+
+    Up to `tokens` requests may be sent in a burst.
+    """
+
+    tokens: int
+    period: float
+
+    @property
+    def per_second(self) -> float:
+        """Tokens added to the bucket per second"""
+        return self.tokens / self.period
+
+    @classmethod
+    def from_string(cls, string: str) -> Self:
+        """Create the Rate from a string like "10/m"
+
+        The period is one of s(econd), m(inute) or h(our).
+        """
+        if not (match := RATE_RE.fullmatch(string)) or int(match["tokens"]) < 1:
+            raise ValueError(f"Invalid rate: {string!r}")
+
+        return cls(tokens=int(match["tokens"]), period=PERIODS[match["period"]])
+
+
+def parse_rate_limits(string: str, prefix: str) -> dict[str, Rate]:
+    """Parse rate limits like "email=10/m pushover=1/s" into a dict of key -> Rate
+
+    The keys are prefixed with `prefix`.
+    """
+    limits: dict[str, Rate] = {}
+
+    for item in string.split():
+        name, sep, rate = item.partition("=")
+
+        if not (name and sep):
+            raise ValueError(f"Invalid rate limit: {item!r}")
+        limits[f"{prefix}:{name}"] = Rate.from_string(rate)
+
+    return limits
+
+
+@dataclass(kw_only=True)
+class Bucket:
+    """State of a token bucket"""
+
+    tokens: float
+    updated: float
+
+    def take(self, rate: Rate, now: float) -> float:
+        """Take a token from the bucket
+
+        Return 0 if a token was taken. Otherwise return the number of seconds until the
+        bucket will have a token.
+        """
+        elapsed = max(now - self.updated, 0.0)
+        self.tokens = min(float(rate.tokens), self.tokens + elapsed * rate.per_second)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+
+        return (1 - self.tokens) / rate.per_second
+
+    def give(self, rate: Rate) -> None:
+        """Give a (taken) token back to the bucket"""
+        self.tokens = min(float(rate.tokens), self.tokens + 1)
+
+
+class RateLimiter:
+    """Token bucket rate limiter
+
+    If a RateLimitStore is given, the buckets are kept there instead of in memory.
+    """
+
+    def __init__(
+        self, limits: Mapping[str, Rate], store: "RateLimitStore | None" = None
+    ) -> None:
+        self.limits = limits
+        self.store = store
+        self._buckets: dict[str, Bucket] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, *keys: str) -> float:
+        """Take a token for each of the keys that has a limit
+
+        Return 0 if the tokens were taken. Otherwise no tokens are taken and the seconds
+        until the exhausted bucket has a token are returned.
+        """
+        taken: list[tuple[str, Rate]] = []
+
+        for key in keys:
+            if (rate := self.limits.get(key)) is None:
+                continue
+
+            if (wait := self.take(key, rate)) > 0:
+                logger.debug(
+                    "Rate limit for %s reached. Next token in %.2fs", key, wait
+                )
+
+                for taken_key, taken_rate in taken:
+                    self.give(taken_key, taken_rate)
+
+                return wait
+            taken.append((key, rate))
+
+        return 0.0
+
+    @property
+    def path(self) -> str:
+        """The path of the store's database. Empty if there is no store"""
+        return self.store.path if self.store else ""
+
+    def take(self, key: str, rate: Rate) -> float:
+        """Try to take a token from the key's bucket
+
+        Return 0 if a token was taken, otherwise the seconds until one is available.
+        """
+        now = time.time()
+
+        if self.store is not None:
+            return self.store.take(key, rate, now)
+
+        with self._lock:
+            if (bucket := self._buckets.get(key)) is None:
+                bucket = self._buckets[key] = Bucket(tokens=rate.tokens, updated=now)
+
+            return bucket.take(rate, now)
+
+    def give(self, key: str, rate: Rate) -> None:
+        """Give a token taken with take() back to the key's bucket"""
+        if self.store is not None:
+            self.store.give(key, rate)
+            return
+
+        with self._lock:
+            if (bucket := self._buckets.get(key)) is not None:
+                bucket.give(rate)
+
+
+class RateLimitStore:
+    """SQLite store of token buckets
+
+    Each take() is a single (immediate) transaction, so the buckets can be shared by
+    many processes.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.db = SQLiteDatabase(
+            path,
+            "CREATE TABLE IF NOT EXISTS buckets"
+            " (key TEXT PRIMARY KEY, tokens REAL, updated REAL)",
+            isolation_level=None,
+        )
+
+    def take(self, key: str, rate: Rate, now: float) -> float:
+        """Try to take a token from the key's bucket. See Bucket.take()"""
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+            ).fetchone()
+            bucket = Bucket(
+                tokens=row[0] if row else rate.tokens, updated=row[1] if row else now
+            )
+            wait = bucket.take(rate, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                (key, bucket.tokens, bucket.updated),
+            )
+
+        return wait
+
+    def give(self, key: str, rate: Rate) -> None:
+        """Give a token back to the key's bucket. See Bucket.give()"""
+        with self.db.transaction() as conn:
+            conn.execute(
+                "UPDATE buckets SET tokens = MIN(tokens + 1, ?) WHERE key = ?",
+                (float(rate.tokens), key),
+            )
+
+    def close(self) -> None:
+        """Close the database connection"""
+        self.db.close()
+
+
+_limiter: RateLimiter | None = None  # pylint: disable=invalid-name
+
+
+def get_rate_limiter(settings: "Settings") -> RateLimiter:
+    """Return the RateLimiter for the given Settings
+
+    The RateLimiter (and its buckets) is reused as long as the limits don't change.
+    """
+    global _limiter  # pylint: disable=global-statement
+
+    limiter = previous = _limiter
+    limits = settings.rate_limits
+    path = settings.RATE_LIMIT_DB
+
+    if limiter is None or (limiter.limits, limiter.path) != (limits, path):
+        limiter = _limiter = RateLimiter(limits, RateLimitStore(path) if path else None)
+
+        if previous is not None and previous.store is not None:
+            previous.store.close()
+
+    return limiter
+
+
+def clear_rate_limiter() -> None:
+    """Discard the current RateLimiter"""
+    global _limiter  # pylint: disable=global-statement
+
+    limiter, _limiter = _limiter, None
+
+    if limiter is not None and limiter.store is not None:
+        limiter.store.close()
+
+
+def throttle(settings: "Settings", method: str, destination: str) -> float:
+    """Take a token from the method's and the destination's rate limits
+
+    Return 0 if they allow sending. Otherwise return the seconds to wait before trying
+    again.
+    """
+    if not settings.rate_limits:
+        return 0.0
+
+    return get_rate_limiter(settings).acquire(
+        f"method:{method}", f"destination:{destination}"
+    )
@@ -0,0 +1,321 @@
+"""Retries of failed deliveries
+
+Worker functions make their deliveries through retrying(). Transient failures (SMTP 4xx
+replies, connection errors and timeouts, HTTP 429 and 5xx responses) are retried
+according to the notification method's RetryPolicy: after an exponential backoff with
+jitter or, if the server sent one, after the Retry-After delay. Retries don't sleep in
+the worker. They are kept in the outbox until they are due, so they survive the worker
+process. Without an outbox (OUTBOX_DB) a retry can't be guaranteed, so failed deliveries
+are not retried.
+
+A CircuitBreaker per destination stops deliveries to a destination after a number of
+consecutive transient failures and lets a single delivery through after a cool-down.
+"""
+
+import logging
+import random
+import smtplib
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import TYPE_CHECKING, Any, Callable, Self
+
+from gbp_notifications import metrics, tracing
+from gbp_notifications.deadletters import DeadLetter, bury
+from gbp_notifications.delivery import Delivery, current_attempt
+from gbp_notifications.exceptions import CircuitOpenError, RateLimitedError
+from gbp_notifications.outbox import defer
+from gbp_notifications.ratelimit import throttle
+
+if TYPE_CHECKING:  # pragma: nocover
+    from gbp_notifications.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, kw_only=True)
+class RetryPolicy:
+    """How (often) to retry a notification method's failed deliveries"""
+
+    max_attempts: int
+    """Total number of attempts, including the first. 1 means don't retry"""
+
+    base_delay: float
+    max_delay: float
+
+    def delay(self, attempt: int, retry_after: float | None = None) -> float:
+        """Return the seconds to wait before retrying the given (failed) attempt
+
+        The delay doubles with each attempt, up to max_delay, and is jittered so that
+        deliveries that failed together aren't all retried together. retry_after, if
+        given, is used instead (but also capped at max_delay).
+        """
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+
+        backoff = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+    @classmethod
+    def from_string(cls, string: str, default: "RetryPolicy") -> Self:
+        """Create the RetryPolicy from a string like "max_attempts[,base[,max]]"
+
+        Omitted values are taken from the default policy.
+        """
+        try:
+            values = [int(value) for value in string.split(",")]
+        except ValueError:
+            values = []
+
+        if not 1 <= len(values) <= 3 or min(values) < 0 or values[0] < 1:
+            raise ValueError(f"Invalid retry policy: {string!r}")
+
+        defaults = [default.base_delay, default.max_delay]
+        delays: list[float] = [*values[1:], *defaults[len(values) - 1 :]]
+
+        return cls(max_attempts=values[0], base_delay=delays[0], max_delay=delays[1])
+
+
+def parse_retry_policies(string: str, default: RetryPolicy) -> dict[str, RetryPolicy]:
+    """Parse retry policies like "email=5 webhook=10,30,3600" into a dict"""
+    policies: dict[str, RetryPolicy] = {}
+
+    for item in string.split():
+        name, sep, policy = item.partition("=")
+
+        if not (name and sep):
+            raise ValueError(f"Invalid retry policy: {item!r}")
+        policies[name] = RetryPolicy.from_string(policy, default)
+
+    return policies
+
+
+def is_transient(error: Exception) -> bool:
+    """Return True if the failed delivery might succeed if retried"""
+    if isinstance(error, CircuitOpenError):
+        return True
+
+    if (response := getattr(error, "response", None)) is not None:
+        status: int = response.status_code
+        return status == 429 or status >= 500
+
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+
+    # Connection errors and timeouts (including requests' and smtplib's)
+    return isinstance(error, OSError)
+
+
+def requested_delay(error: Exception) -> float | None:
+    """Return the delay requested by the Retry-After header of the error's response"""
+    if isinstance(error, CircuitOpenError):
+        return error.wait
+
+    if (response := getattr(error, "response", None)) is None:
+        return None
+
+    if not (value := response.headers.get("Retry-After")):
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(when.timestamp() - time.time(), 0.0)
+
+
+class CircuitBreaker:
+    """Per-destination circuit breaker
+
+    A destination's circuit opens after `threshold` consecutive failures. While it is
+    open, deliveries to it are not attempted. After `reset_timeout` seconds a single
+    delivery is let through. If it succeeds the circuit closes, otherwise it opens
+    again. A threshold of 0 disables the breaker.
+    """
+
+    def __init__(self, *, threshold: int, reset_timeout: float) -> None:
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._failures: dict[str, int] = {}
+        self._opened: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def check(self, destination: str) -> float:
+        """Return 0 if a delivery to the destination may be attempted
+
+        Otherwise return the seconds until the destination's circuit may be retried.
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            if (opened := self._opened.get(destination)) is None:
+                return 0.0
+
+            if (wait := opened + self.reset_timeout - now) > 0:
+                return wait
+
+            # Let this one through and keep the others out until we know how it went
+            self._opened[destination] = now
+
+            return 0.0
+
+    def success(self, destination: str) -> None:
+        """Record a successful delivery to the destination"""
+        with self._lock:
+            self._failures.pop(destination, None)
+            self._opened.pop(destination, None)
+
+    def failure(self, destination: str) -> None:
+        """Record a failed delivery to the destination"""
+        if not self.threshold:
+            return
+
+        with self._lock:
+            failures = self._failures[destination] = (
+                self._failures.get(destination, 0) + 1
+            )
+
+            if failures >= self.threshold:
+                if destination not in self._opened:
+                    logger.warning("Circuit opened for %s", destination)
+                self._opened[destination] = time.monotonic()
+
+
+def get_policy(settings: "Settings", method: str) -> RetryPolicy:
+    """Return the RetryPolicy for the given notification method"""
+    return settings.retry_policies.get(method, settings.retry_policies[""])
+
+
+def retrying(
+    settings: "Settings",
+    method: str,
+    delivery: Delivery,
+    send: Callable[[], Any],
+    *,
+    recipient: str = "",
+) -> None:
+    """Make the delivery by calling send()
+
+    delivery is the worker function call being made. If a rate limit doesn't allow
+    sending yet, the delivery is deferred in the outbox until it does. Without an
+    outbox, the worker waits up to RATE_LIMIT_MAX_WAIT seconds, after which the
+    delivery fails with RateLimitedError. If send() fails
+    with a transient error, the delivery is deferred in the outbox to be retried
+    according to the method's RetryPolicy. Otherwise, if there are no attempts left or
+    if there is no outbox to keep the retry in, the delivery is recorded as a dead
+    letter and the error is raised.
+    """
+    destination = delivery.destination
+    breaker = get_circuit_breaker(settings)
+    attempt = current_attempt()
+
+    try:
+        with tracing.span(
+            "send",
+            method=method,
+            recipient=recipient,
+            destination=destination,
+            attempt=attempt,
+        ):
+            if wait := breaker.check(destination):
+                raise CircuitOpenError(destination, wait)
+
+            waited = 0.0
+            while wait := throttle(settings, method, destination):
+                # Don't hold up the worker. Make this attempt once the limits allow
+                if defer(settings, delivery, wait, attempt=attempt):
+                    return
+
+                # There is no outbox to keep the delivery in. Wait, but not for long
+                if waited + wait > settings.RATE_LIMIT_MAX_WAIT:
+                    raise RateLimitedError(destination, wait)
+                time.sleep(wait)
+                waited += wait
+
+            with metrics.SEND_SECONDS.time(method=method):
+                send()
+    except Exception as error:  # pylint: disable=broad-exception-caught
+        metrics.FAILURES.inc(method=method, error=type(error).__name__)
+        transient = is_transient(error)
+
+        if transient and not isinstance(error, CircuitOpenError):
+            breaker.failure(destination)
+
+        policy = get_policy(settings, method)
+
+        if transient and attempt < policy.max_attempts:
+            delay = policy.delay(attempt, requested_delay(error))
+
+            if defer(settings, delivery, delay, attempt=attempt + 1):
+                logger.warning(
+                    "Delivery to %s failed (attempt %s of %s): %s. Retrying in %.1fs",
+                    destination,
+                    attempt,
+                    policy.max_attempts,
+                    error,
+                    delay,
+                )
+                return
+            logger.warning(
+                "Delivery to %s failed: %s. Not retrying because OUTBOX_DB is not set",
+                destination,
+                error,
+            )
+
+        letter = DeadLetter(
+            method=method,
+            recipient=recipient,
+            destination=destination,
+            job=delivery.to_job(),
+            error=repr(error),
+            attempts=attempt,
+        )
+        bury(settings, letter)
+        raise
+    finally:
+        metrics.flush(settings)
+
+    breaker.success(destination)
+
+
+_breaker: CircuitBreaker | None = None  # pylint: disable=invalid-name
+
+
+def get_circuit_breaker(settings: "Settings") -> CircuitBreaker:
+    """Return the CircuitBreaker for the given Settings
+
+    The CircuitBreaker (and its state) is reused as long as its settings don't change.
+    """
+    global _breaker  # pylint: disable=global-statement
+
+    breaker = _breaker
+    threshold = settings.CIRCUIT_BREAKER_THRESHOLD
+    reset_timeout = settings.CIRCUIT_BREAKER_RESET
+
+    if breaker is None or (breaker.threshold, breaker.reset_timeout) != (
+        threshold,
+        reset_timeout,
+    ):
+        breaker = _breaker = CircuitBreaker(
+            threshold=threshold, reset_timeout=reset_timeout
+        )
+
+    return breaker
+
+
+def clear_retries() -> None:
+    """Forget the circuit breaker state"""
+    global _breaker  # pylint: disable=global-statement
+
+    _breaker = None
@@ -0,0 +1,124 @@
+"""Precompiled event routing
+
+The RoutingTable maps (machine, event name) pairs to the NotificationMethod instances
+and Recipients that should receive the event. Wildcard subscriptions are resolved when
+the table is built so that dispatching an event is a single dict lookup.
+"""
+
+import atexit
+import itertools as it
+from typing import TYPE_CHECKING, Iterable, TypeAlias
+
+from gbp_notifications import utils
+from gbp_notifications.methods import MethodInstances
+from gbp_notifications.types import Event, NotificationMethod, Recipient, Subscription
+
+if TYPE_CHECKING:  # pragma: nocover
+    from gbp_notifications.settings import Settings
+
+WILDCARD = "*"
+
+Route: TypeAlias = tuple[NotificationMethod, tuple[Recipient, ...]]
+
+
+class RoutingTable:  # pylint: disable=too-few-public-methods
+    """(machine, event name) -> Routes"""
+
+    def __init__(self, settings: "Settings") -> None:
+        self.settings = settings
+        subs = settings.SUBSCRIPTIONS
+        self.machines = frozenset(event.machine for event in subs) - {WILDCARD}
+        self.names = frozenset(event.name for event in subs) - {WILDCARD}
+
+        self.instances = MethodInstances(settings)
+        self._routes: dict[tuple[str, str], tuple[Route, ...]] = {}
+
+        for machine, name in it.product(
+            (*self.machines, WILDCARD), (*self.names, WILDCARD)
+        ):
+            recipients = event_recipients(Event(name=name, machine=machine), subs)
+            if routes := build_routes(recipients, self.instances):
+                self._routes[machine, name] = routes
+
+    def routes(self, event: Event) -> tuple[Route, ...]:
+        """Return the routes for the given event
+
+        Machines and event names that no subscription mentions explicitly are looked up
+        as wildcards.
+        """
+        machine = event.machine if event.machine in self.machines else WILDCARD
+        name = event.name if event.name in self.names else WILDCARD
+
+        return self._routes.get((machine, name), ())
+
+    def close(self) -> None:
+        """Close the table's NotificationMethod instances"""
+        self.instances.close()
+
+
+def build_routes(
+    recipients: Iterable[Recipient], instances: MethodInstances
+) -> tuple[Route, ...]:
+    """Group the given recipients by their (shared) notification method instances"""
+    grouped: dict[NotificationMethod, list[Recipient]] = {}
+
+    for recipient in utils.sort_items_by(recipients, "name"):
+        for method in recipient.methods:
+            grouped.setdefault(instances.get(method), []).append(recipient)
+
+    return tuple((method, tuple(rs)) for method, rs in grouped.items())
+
+
+def event_recipients(event: Event, subs: dict[Event, Subscription]) -> set[Recipient]:
+    """Given the subscriptions, return all recipients to the given event"""
+    e = event
+    return {r for e in (*wildcard_events(e), e) for r in subs.get(e, Subscription())}
+
+
+def wildcard_events(event: Event) -> list[Event]:
+    """Return the given event's "wildcard" events
+
+    The `data` field is not copied into the wildcard events
+    """
+    return [
+        Event(name=WILDCARD, machine=WILDCARD),
+        Event(name=WILDCARD, machine=event.machine),
+        Event(name=event.name, machine=WILDCARD),
+    ]
+
+
+_table: RoutingTable | None = None  # pylint: disable=invalid-name
+
+
+def get_routing_table(settings: "Settings") -> RoutingTable:
+    """Return the RoutingTable for the given Settings
+
+    The most recently built table is reused as long as it is given the same Settings
+    object (Settings.from_environ() returns the same one until the environment or
+    CONFIG_FILE changes). Equal settings aren't enough because Recipient.config isn't
+    compared. When the settings change, the previous table (and its method instances)
+    is closed.
+    """
+    global _table  # pylint: disable=global-statement
+
+    table = previous = _table
+    if table is None or table.settings is not settings:
+        table = _table = RoutingTable(settings)
+
+        if previous is not None:
+            previous.close()
+
+    return table
+
+
+def clear_routing_table() -> None:
+    """Close and discard the cached RoutingTable"""
+    global _table  # pylint: disable=global-statement
+
+    table, _table = _table, None
+
+    if table is not None:
+        table.close()
+
+
+atexit.register(clear_routing_table)
@@ -1,13 +1,24 @@
 """Settings for gbp-notifications"""
 
 import dataclasses as dc
-import tomllib
+import logging
+import os
 import typing as t
+from functools import cached_property
 from pathlib import Path
+from types import MappingProxyType
 
 from gentoo_build_publisher.settings import BaseSettings
 
-from .types import Event, Recipient, Subscription
+from .types import Event, Recipient, Subscription, WebhookEndpoint
+
+if t.TYPE_CHECKING:  # pragma: nocover
+    from .ratelimit import Rate
+    from .retry import RetryPolicy
+
+_T = t.TypeVar("_T")
+
+logger = logging.getLogger(__name__)
 
 
 @dc.dataclass(frozen=True, kw_only=True)
@@ -33,12 +44,123 @@ class Settings(BaseSettings):
     EMAIL_SMTP_USERNAME: str = ""
     EMAIL_SMTP_PASSWORD: str = ""
     EMAIL_SMTP_PASSWORD_FILE: str = ""
+    # Send the same email to up to this many recipients at once. 0 disables batching
+    EMAIL_BATCH_SIZE: int = 0
+    # Seconds to keep idle SMTP connections open in workers. 0 disables pooling
+    EMAIL_SMTP_POOL_IDLE_TIMEOUT: int = 60
     REQUESTS_TIMEOUT: int = 10
+    # Max (keep-alive) connections per host for each worker process
+    REQUESTS_POOL_SIZE: int = 10
+    # Number of times to retry failed (connection errors/5xx/429) HTTP requests
+    REQUESTS_RETRIES: int = 0
+
+    # Send all of an event's notifications in a single worker job, concurrently
+    ASYNC_DELIVERY: bool = False
+    ASYNC_MAX_CONCURRENCY: int = 16
+    ASYNC_MAX_PER_DESTINATION: int = 4
+    # Send each event to the worker as a single job which renders and delivers it
+    FANOUT_JOB: bool = False
+
+    # Buffer events for this many seconds and send them as digests. 0 disables digests
+    DIGEST_WINDOW: int = 0
+    # Send a recipient's digest early when it has this many events
+    DIGEST_MAX_EVENTS: int = 50
+    # SQLite database to buffer the events in. By default they are kept in memory
+    DIGEST_DB: str = ""
+
+    # Don't send the same notification again within this many seconds. 0 disables
+    DEDUP_TTL: int = 0
+    # Max number of sent notifications to remember in memory
+    DEDUP_CACHE_SIZE: int = 10_000
+    # SQLite database to share sent notifications between processes
+    DEDUP_DB: str = ""
+
+    # Rate limits like "email=10/m pushover=1/s" per method and per destination host
+    METHOD_RATE_LIMITS: str = ""
+    DESTINATION_RATE_LIMITS: str = ""
+    # SQLite database to share the rate limits between processes
+    RATE_LIMIT_DB: str = ""
+    # Without OUTBOX_DB, the seconds a worker may wait for the rate limits to allow a
+    # delivery. Longer waits fail the delivery
+    RATE_LIMIT_MAX_WAIT: int = 10
+
+    # Attempts (including the first) for deliveries that fail with transient errors.
+    # Retries are kept in the outbox, so they require OUTBOX_DB
+    RETRY_MAX_ATTEMPTS: int = 1
+    # Seconds before the first retry. Doubles (with jitter) for each retry after that
+    RETRY_BASE_DELAY: int = 10
+    RETRY_MAX_DELAY: int = 3600
+    # Per-method retry policies like "email=5 webhook=10,30,3600"
+    RETRY_POLICIES: str = ""
+    # Stop delivering to a destination after this many consecutive failures. 0 disables
+    CIRCUIT_BREAKER_THRESHOLD: int = 0
+    # Seconds before a delivery to a destination with an open circuit is tried again
+    CIRCUIT_BREAKER_RESET: int = 60
+
+    # SQLite database to spool deliveries in. The worker drains it in batches
+    OUTBOX_DB: str = ""
+    OUTBOX_BATCH_SIZE: int = 100
+    # Seconds a drainer has to deliver a batch before it is claimed again
+    OUTBOX_LEASE: int = 300
+    # Seconds to keep delivered entries in the outbox
+    OUTBOX_RETENTION: int = 86400
+    # Seconds between the poller's checks for outbox deliveries (retries and deliveries
+    # whose drainer died) and digests that are due
+    POLL_INTERVAL: int = 30
+
+    # SQLite database to record deliveries that failed for good in
+    DEAD_LETTER_DB: str = ""
+
+    # SQLite database to collect the metrics of all processes in
+    METRICS_DB: str = ""
+
+    # Templates
+    TEMPLATE_CACHE_SIZE: int = 400
+    TEMPLATE_BYTECODE_CACHE_DIR: str = ""
 
     # Pushover
     PUSHOVER_USER_KEY: str = ""
     PUSHOVER_APP_TOKEN: str = ""
 
+    def __post_init__(self) -> None:
+        # Report bad webhook configs, rate limits and retry policies (which are left
+        # out) when the settings are loaded rather than when they are first used
+        self.webhook_endpoints  # pylint: disable=pointless-statement
+        self.rate_limits  # pylint: disable=pointless-statement
+        self.retry_policies  # pylint: disable=pointless-statement
+
+    @classmethod
+    def from_environ(cls, prefix: str | None = None) -> t.Self:
+        """Return settings instantiated from environment variables
+
+        Settings are cached. They are only re-created when the (prefixed) environment
+        variables or the CONFIG_FILE they point to change.
+        """
+        prefix = prefix if prefix is not None else cls.env_prefix
+        environ = {k: v for k, v in os.environ.items() if k.startswith(prefix)}
+
+        try:
+            config_stat = file_stat(environ.get(f"{prefix}CONFIG_FILE", ""))
+        except OSError:
+            # Let from_dict() report the error
+            return cls.from_dict(prefix, environ)
+
+        key = (cls, prefix, tuple(sorted(environ.items())), config_stat)
+
+        if (settings := _cache.get(key)) is None:
+            settings = cls.from_dict(prefix, environ)
+
+            if len(_cache) >= CACHE_SIZE:
+                _cache.clear()
+            _cache[key] = settings
+
+        return t.cast(t.Self, settings)
+
+    @staticmethod
+    def cache_clear() -> None:
+        """Clear the from_environ() cache"""
+        _cache.clear()
+
     @classmethod
     def from_dict(cls, prefix: str, data_dict: dict[str, t.Any]) -> t.Self:
         data = data_dict.copy()
@@ -52,6 +174,8 @@ class Settings(BaseSettings):
             )
 
         if config_file := data.get(f"{prefix}CONFIG_FILE"):
+            import tomllib  # pylint: disable=import-outside-toplevel
+
             with Path(config_file).open("rb") as fp:
                 config = tomllib.load(fp)
 
@@ -66,7 +190,123 @@ class Settings(BaseSettings):
             return cls.from_dict(prefix, data)
         return super().from_dict(prefix, data)
 
+    @cached_property
+    def recipients_by_name(self) -> t.Mapping[str, Recipient]:
+        """Read-only mapping of recipient name -> Recipient
+
+        The index is built once per Settings instance.
+        """
+        return MappingProxyType({r.name: r for r in self.RECIPIENTS})
+
+    @cached_property
+    def webhook_endpoints(self) -> t.Mapping[str, WebhookEndpoint]:
+        """Read-only mapping of recipient name -> WebhookEndpoint
+
+        Only recipients with a (valid) webhook are included. Invalid webhook configs are
+        logged and left out, so that one recipient's typo doesn't stop the others'
+        notifications.
+        """
+        # pylint: disable=import-outside-toplevel
+        from .exceptions import WebhookConfigError
+
+        endpoints: dict[str, WebhookEndpoint] = {}
+
+        for recipient in self.RECIPIENTS:
+            if (config := recipient.config.get("webhook")) is None:
+                continue
+            try:
+                endpoints[recipient.name] = WebhookEndpoint.from_config(
+                    config, timeout=self.REQUESTS_TIMEOUT
+                )
+            except WebhookConfigError as error:
+                logger.error("Ignoring webhook of %s: %s", recipient.name, error)
+
+        return MappingProxyType(endpoints)
+
+    @cached_property
+    def rate_limits(self) -> t.Mapping[str, "Rate"]:
+        """Read-only mapping of rate limit key -> Rate
+
+        Keys are "method:<method name>" and "destination:<host>". Invalid rate limits
+        are logged and left out.
+        """
+        # pylint: disable=import-outside-toplevel
+        from .ratelimit import parse_rate_limits
+
+        return MappingProxyType(
+            parse_items(
+                self.METHOD_RATE_LIMITS,
+                lambda item: parse_rate_limits(item, "method"),
+                "rate limit",
+            )
+            | parse_items(
+                self.DESTINATION_RATE_LIMITS,
+                lambda item: parse_rate_limits(item, "destination"),
+                "rate limit",
+            )
+        )
+
+    @cached_property
+    def retry_policies(self) -> t.Mapping[str, "RetryPolicy"]:
+        """Read-only mapping of method name -> RetryPolicy
+
+        The default policy, built from the RETRY_* settings, has the key "". Invalid
+        RETRY_POLICIES are logged and left out.
+        """
+        # pylint: disable=import-outside-toplevel
+        from .retry import RetryPolicy, parse_retry_policies
+
+        default = RetryPolicy(
+            max_attempts=max(self.RETRY_MAX_ATTEMPTS, 1),
+            base_delay=self.RETRY_BASE_DELAY,
+            max_delay=self.RETRY_MAX_DELAY,
+        )
+
+        return MappingProxyType(
+            {"": default}
+            | parse_items(
+                self.RETRY_POLICIES,
+                lambda item: parse_retry_policies(item, default),
+                "retry policy",
+            )
+        )
+
     @staticmethod
     def validate_events(value):
         """Validator for EVENTS"""
         return value.split()
+
+
+CACHE_SIZE = 8
+_cache: dict[t.Hashable, Settings] = {}
+
+
+def parse_items(
+    string: str, parse: t.Callable[[str], dict[str, _T]], kind: str
+) -> dict[str, _T]:
+    """Parse each of the (space-separated) items of the string with parse()
+
+    Items that parse() rejects with ValueError are logged and left out.
+    """
+    parsed: dict[str, _T] = {}
+
+    for item in string.split():
+        try:
+            parsed.update(parse(item))
+        except ValueError as error:
+            logger.error("Ignoring invalid %s: %s", kind, error)
+
+    return parsed
+
+
+def file_stat(path: str) -> tuple[int, int, int] | None:
+    """Return the (mtime, inode, size) of the given file path
+
+    If the path is empty, return None.
+    """
+    if not path:
+        return None
+
+    stat = os.stat(path)
+
+    return stat.st_mtime_ns, stat.st_ino, stat.st_size
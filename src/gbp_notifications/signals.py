@@ -1,12 +1,27 @@
-"""Signal handlers for GBP Notifications"""
+"""Signal handlers for GBP Notifications
 
-from typing import Any
+This module is imported when Django starts, so it only binds the signal handlers. The
+rest (settings, notification methods, ...) is imported and loaded when the first event
+is handled.
+"""
+
+# pylint: disable=import-outside-toplevel
+
+import logging
+import os
+from typing import TYPE_CHECKING, Any, Iterable, Sequence, cast
 
 from gentoo_build_publisher.signals import dispatcher
-from gentoo_build_publisher.types import Build
 
-from gbp_notifications.settings import Settings
-from gbp_notifications.types import Event, Recipient, Subscription
+if TYPE_CHECKING:  # pragma: nocover
+    from gentoo_build_publisher.types import Build
+
+    from gbp_notifications.delivery import Delivery
+    from gbp_notifications.routing import Route
+    from gbp_notifications.settings import Settings
+    from gbp_notifications.types import Event, NotificationMethod, Recipient
+
+logger = logging.getLogger(__name__)
 
 
 class SignalHandler:  # pylint: disable=too-few-public-methods
@@ -16,9 +31,18 @@ class SignalHandler:  # pylint: disable=too-few-public-methods
         self.event_name = event_name
         self.__doc__ = f"SignalHandler for {event_name!r}"
 
-    def __call__(self, *, build: Build, **kwargs: Any) -> None:
+    def __call__(self, *, build: "Build", **kwargs: Any) -> None:
         """We handle signals"""
-        send_event_to_recipients(Event.from_build(self.event_name, build, **kwargs))
+        from gbp_notifications import tracing
+        from gbp_notifications.types import Event
+
+        with tracing.span(
+            "signal",
+            event=self.event_name,
+            machine=build.machine,
+            build_id=build.build_id,
+        ):
+            send_event_to_recipients(Event.from_build(self.event_name, build, **kwargs))
 
 
 class SignalHandlers:  # pylint: disable=too-few-public-methods
@@ -28,10 +52,8 @@ class SignalHandlers:  # pylint: disable=too-few-public-methods
     else they get garbage collected away
     """
 
-    def __init__(self, settings: Settings | None = None) -> None:
-        settings = settings or Settings.from_environ()
-
-        self.bind(*settings.EVENTS)
+    def __init__(self, settings: "Settings | None" = None) -> None:
+        self.bind(*(settings.EVENTS if settings else environ_events()))
 
     def bind(self, *signals: str) -> None:
         """Create signal handlers and bind them to the given signals"""
@@ -41,30 +63,202 @@ class SignalHandlers:  # pylint: disable=too-few-public-methods
             setattr(self, signal, handler)
 
 
-def send_event_to_recipients(event: Event) -> None:
+def environ_events() -> list[str]:
+    """Return the EVENTS setting from the environment
+
+    This is what Settings.from_environ().EVENTS returns, but without importing and
+    loading the Settings, which is comparatively expensive.
+    """
+    if (events := os.environ.get("GBP_NOTIFICATIONS_EVENTS")) is None:
+        return ["postpull", "published"]
+
+    return events.split()
+
+
+def send_event_to_recipients(event: "Event") -> None:
     """Sent the given event to the given recipient given the recipient's methods"""
+    from gbp_notifications import metrics
+    from gbp_notifications.settings import Settings
+
     settings = Settings.from_environ()
-    for recipient in event_recipients(event, settings.SUBSCRIPTIONS):
-        for method in recipient.methods:
-            method(settings).send(event, recipient)
+    metrics.EVENTS.inc(machine=event.machine, event=event.name)
+
+    with metrics.DISPATCH_SECONDS.time():
+        dispatch(event, settings)
+
+    metrics.flush(settings)
+
+
+def dispatch(event: "Event", settings: "Settings") -> None:
+    """Send the event as configured by the settings"""
+    from gbp_notifications import tasks
+    from gbp_notifications.delivery import collect, encode_event, submit
+    from gbp_notifications.routing import get_routing_table
+
+    if settings.DIGEST_WINDOW > 0:
+        buffer_event(event, settings)
+        return
+
+    if settings.FANOUT_JOB and not settings.OUTBOX_DB:
+        if names := subscriber_names(event, settings):
+            submit(tasks.send_event, encode_event(event), names)
+        return
+
+    routes = new_routes(get_routing_table(settings).routes(event), event, settings)
+
+    if not (settings.ASYNC_DELIVERY or settings.OUTBOX_DB):
+        for method, recipients in routes:
+            send(method, event, recipients)
+        return
+
+    with collect() as deliveries:
+        for method, recipients in routes:
+            send(method, event, recipients)
+
+    submit_deliveries(event, deliveries, settings)
+
+
+def submit_deliveries(
+    event: "Event", deliveries: Sequence["Delivery"], settings: "Settings"
+) -> None:
+    """Hand the event's collected deliveries over to the worker
+
+    They are spooled to the outbox if OUTBOX_DB is set. Otherwise they are submitted as
+    a single deliver() job.
+    """
+    from gbp_notifications import tasks
+    from gbp_notifications.delivery import submit
+
+    if not deliveries:
+        return
+
+    if settings.OUTBOX_DB:
+        spool(event, deliveries, settings)
+    else:
+        submit(tasks.deliver, [delivery.to_job() for delivery in deliveries])
+
+
+def subscriber_names(event: "Event", settings: "Settings") -> list[str]:
+    """Return the (sorted) names of the event's subscribers"""
+    from gbp_notifications import tracing
+    from gbp_notifications.routing import event_recipients
+
+    with tracing.span("resolve", event=event.name, machine=event.machine) as span:
+        subscribers = event_recipients(event, settings.SUBSCRIPTIONS)
 
+        if span:
+            span.set(recipients=len(subscribers))
 
-def event_recipients(event: Event, subs: dict[Event, Subscription]) -> set[Recipient]:
-    """Given the subscriptions, return all recipients to the given event"""
-    e = event
-    return {r for e in (*wildcard_events(e), e) for r in subs.get(e, Subscription())}
+    return sorted(subscriber.name for subscriber in subscribers)
 
 
-def wildcard_events(event: Event) -> list[Event]:
-    """Return the given event's "wildcard" events
+def spool(
+    event: "Event", deliveries: Sequence["Delivery"], settings: "Settings"
+) -> None:
+    """Append the event's deliveries to the outbox and have the worker drain it"""
+    from gbp_notifications import tasks, tracing
+    from gbp_notifications.delivery import submit
+    from gbp_notifications.outbox import entry_keys, get_outbox
 
-    The `data` field is not copied into the wildcard events
+    keys = entry_keys(event, deliveries)
+
+    with tracing.span("enqueue", task="outbox", deliveries=len(deliveries)):
+        appended = get_outbox(settings).append(zip(keys, deliveries))
+
+    if appended:
+        submit(tasks.drain_outbox)
+
+
+def buffer_event(event: "Event", settings: "Settings") -> None:
+    """Add the event to the digest buffer of each of its routes"""
+    from gbp_notifications.digest import get_digest_buffer
+    from gbp_notifications.routing import get_routing_table
+
+    buffer = get_digest_buffer(settings)
+
+    routes = get_routing_table(settings).routes(event)
+
+    for method, recipients in new_routes(routes, event, settings):
+        buffer.add(method, event, recipients)
+
+
+def fan_out(
+    event: "Event", recipient_names: Sequence[str], settings: "Settings"
+) -> list[Exception]:
+    """Send the event to the recipients with the given names
+
+    This is done by the worker for FANOUT_JOB. Rather than being enqueued, the
+    notifications are delivered concurrently. Return the errors of failed deliveries.
     """
-    return [
-        Event(name="*", machine="*"),
-        Event(name="*", machine=event.machine),
-        Event(name=event.name, machine="*"),
-    ]
+    from gbp_notifications.delivery import collect, deliver
+    from gbp_notifications.routing import build_routes, get_routing_table
+
+    index = settings.recipients_by_name
+
+    if unknown := [name for name in recipient_names if name not in index]:
+        logger.warning("Recipients not found. Skipping: %s", ", ".join(unknown))
+
+    recipients = [index[name] for name in recipient_names if name in index]
+    instances = get_routing_table(settings).instances
+    routes = new_routes(build_routes(recipients, instances), event, settings)
+
+    with collect() as deliveries:
+        for method, method_recipients in routes:
+            send(method, event, method_recipients)
+
+    return deliver(
+        deliveries,
+        max_concurrency=settings.ASYNC_MAX_CONCURRENCY,
+        max_per_destination=settings.ASYNC_MAX_PER_DESTINATION,
+    )
+
+
+def new_routes(
+    routes: Iterable["Route"], event: "Event", settings: "Settings"
+) -> list["Route"]:
+    """Return the routes without the recipients that were recently sent the event
+
+    Unless DEDUP_TTL is set, the routes are returned as-is.
+    """
+    from gbp_notifications import metrics, tracing
+
+    with tracing.span("resolve", event=event.name, machine=event.machine) as span:
+        if settings.DEDUP_TTL > 0:
+            from gbp_notifications.dedup import get_deduplicator
+
+            dedup = get_deduplicator(settings)
+            routes = [
+                (method, tuple(new))
+                for method, recipients in routes
+                if (new := dedup.filter(method, event, recipients))
+            ]
+
+        routes = list(routes)
+
+        if span:
+            span.set(recipients=sum(len(recipients) for _, recipients in routes))
+
+    for method, recipients in routes:
+        metrics.RECIPIENTS.inc(len(recipients), method=metrics.method_label(method))
+
+    return routes
+
+
+def send(
+    method: "NotificationMethod", event: "Event", recipients: Sequence["Recipient"]
+) -> None:
+    """Send the event to the recipients using the given method
+
+    If the method implements send_batch(), it is passed all the recipients at once.
+    """
+    from gbp_notifications.types import BatchNotificationMethod
+
+    if hasattr(type(method), "send_batch"):
+        cast(BatchNotificationMethod, method).send_batch(event, recipients)
+        return
+
+    for recipient in recipients:
+        method.send(event, recipient)
 
 
 signal_handlers = SignalHandlers()
@@ -2,43 +2,79 @@
 
 # pylint: disable=cyclic-import,import-outside-toplevel
 
+from typing import Any
+
 
 def sendmail(from_addr: str, to_addrs: list[str], msg: str) -> None:
     """Worker function to sent the email message"""
-    import smtplib
-
+    from gbp_notifications import tasks  # pylint: disable=import-self
+    from gbp_notifications.connections import SMTPServer, smtp_pool
+    from gbp_notifications.delivery import Delivery
     from gbp_notifications.methods.email import email_password, logger
+    from gbp_notifications.retry import retrying
     from gbp_notifications.settings import Settings
 
     config = Settings.from_environ()
+    server = SMTPServer(
+        host=config.EMAIL_SMTP_HOST,
+        port=config.EMAIL_SMTP_PORT,
+        username=config.EMAIL_SMTP_USERNAME,
+        password=email_password(config),
+    )
+    smtp_pool.idle_timeout = config.EMAIL_SMTP_POOL_IDLE_TIMEOUT
+    delivery = Delivery(
+        func=tasks.sendmail, args=(from_addr, to_addrs, msg), destination=server.host
+    )
+
+    def send() -> None:
+        logger.info("Sending email notification to %s", to_addrs)
+        smtp_pool.sendmail(server, from_addr, to_addrs, msg)
+        logger.info("Sent email notification to %s", to_addrs)
 
-    logger.info("Sending email notification to %s", to_addrs)
-    with smtplib.SMTP_SSL(config.EMAIL_SMTP_HOST, port=config.EMAIL_SMTP_PORT) as smtp:
-        smtp.login(config.EMAIL_SMTP_USERNAME, email_password(config))
-        smtp.sendmail(from_addr, to_addrs, msg)
-    logger.info("Sent email notification to %s", to_addrs)
+    retrying(config, "email", delivery, send, recipient=", ".join(to_addrs))
 
 
 def send_http_request(recipient_name: str, body: str) -> None:
     """Worker function to call the webhook"""
-    import requests
-
-    from gbp_notifications import plugin, utils
+    from gbp_notifications import tasks  # pylint: disable=import-self
+    from gbp_notifications.connections import http_sessions
+    from gbp_notifications.delivery import Delivery
     from gbp_notifications.methods.email import logger
+    from gbp_notifications.retry import retrying
     from gbp_notifications.settings import Settings
-    from gbp_notifications.types import Recipient
 
     settings = Settings.from_environ()
-    recipient = Recipient.from_name(recipient_name, settings)
-    url, headers = utils.parse_webhook_config(recipient.config["webhook"])
-    post = requests.post
-    headers["Content-Type"] = "application/json"
-    headers["User-Agent"] = f"{plugin['name']}/{plugin['version']}"
-    timeout = settings.REQUESTS_TIMEOUT
 
-    logger.info("Sending webook notification to %s", url)
-    post(url, data=body, headers=headers, timeout=timeout).raise_for_status()
-    logger.info("Sent webhook notification to %s", url)
+    # The recipient, or its endpoint, may have been removed from (or invalidated in)
+    # the config since the delivery was queued
+    if (endpoint := settings.webhook_endpoints.get(recipient_name)) is None:
+        logger.error(
+            "No valid webhook for %s. Dropping the notification", recipient_name
+        )
+        return
+
+    session = http_sessions.session(
+        endpoint.url,
+        pool_size=settings.REQUESTS_POOL_SIZE,
+        retries=settings.REQUESTS_RETRIES,
+    )
+    delivery = Delivery(
+        func=tasks.send_http_request,
+        args=(recipient_name, body),
+        destination=endpoint.host,
+    )
+
+    def send() -> None:
+        logger.info("Sending webook notification to %s", endpoint.url)
+        session.post(
+            endpoint.url,
+            data=body,
+            headers=dict(endpoint.headers),
+            timeout=endpoint.timeout,
+        ).raise_for_status()
+        logger.info("Sent webhook notification to %s", endpoint.url)
+
+    retrying(settings, "webhook", delivery, send, recipient=recipient_name)
 
 
 def send_pushover_notification(device: str, title: str, message: str) -> None:
@@ -48,9 +84,13 @@ def send_pushover_notification(device: str, title: str, message: str) -> None:
 
     https://pushover.net/api
     """
-    import requests
+    from urllib.parse import urlsplit
 
+    from gbp_notifications import tasks  # pylint: disable=import-self
+    from gbp_notifications.connections import http_sessions
+    from gbp_notifications.delivery import Delivery
     from gbp_notifications.methods.pushover import URL
+    from gbp_notifications.retry import retrying
     from gbp_notifications.settings import Settings
 
     settings = Settings.from_environ()
@@ -61,5 +101,77 @@ def send_pushover_notification(device: str, title: str, message: str) -> None:
         "title": title,
         "message": message,
     }
-    response = requests.post(URL, json=params, timeout=settings.REQUESTS_TIMEOUT)
-    response.raise_for_status()
+    session = http_sessions.session(
+        URL, pool_size=settings.REQUESTS_POOL_SIZE, retries=settings.REQUESTS_RETRIES
+    )
+    delivery = Delivery(
+        func=tasks.send_pushover_notification,
+        args=(device, title, message),
+        destination=urlsplit(URL).netloc,
+    )
+
+    def send() -> None:
+        response = session.post(URL, json=params, timeout=settings.REQUESTS_TIMEOUT)
+        response.raise_for_status()
+
+    retrying(settings, "pushover", delivery, send, recipient=device)
+
+
+def send_event(event_data: str, recipient_names: list[str]) -> None:
+    """Worker function to send the event to the given recipients
+
+    event_data is the Event encoded with delivery.encode_event(). The notifications are
+    rendered here and delivered concurrently.
+    """
+    from gbp_notifications.delivery import decode_event
+    from gbp_notifications.settings import Settings
+    from gbp_notifications.signals import fan_out
+
+    settings = Settings.from_environ()
+    errors = fan_out(decode_event(event_data), recipient_names, settings)
+
+    if errors:
+        raise ExceptionGroup(f"{len(errors)} deliveries failed", errors)
+
+
+def deliver(jobs: list[list[Any]]) -> None:
+    """Worker function to run the given deliveries concurrently
+
+    jobs are Deliveries converted with Delivery.to_job().
+    """
+    from gbp_notifications.delivery import Delivery
+    from gbp_notifications.delivery import deliver as deliver_
+    from gbp_notifications.settings import Settings
+
+    settings = Settings.from_environ()
+    errors = deliver_(
+        [Delivery.from_job(job) for job in jobs],
+        max_concurrency=settings.ASYNC_MAX_CONCURRENCY,
+        max_per_destination=settings.ASYNC_MAX_PER_DESTINATION,
+    )
+
+    if errors:
+        raise ExceptionGroup(f"{len(errors)} of {len(jobs)} deliveries failed", errors)
+
+
+def drain_outbox() -> None:
+    """Worker function to deliver the deliveries spooled in the outbox"""
+    from gbp_notifications.outbox import drain, get_outbox
+    from gbp_notifications.settings import Settings
+
+    settings = Settings.from_environ()
+    errors = drain(get_outbox(settings), settings)
+
+    if errors:
+        raise ExceptionGroup(f"{len(errors)} outbox deliveries failed", errors)
+
+
+def flush_digests() -> None:
+    """Worker function to send the digests (buffered in DIGEST_DB) that are due"""
+    from gbp_notifications import metrics
+    from gbp_notifications.digest import get_digest_buffer
+    from gbp_notifications.settings import Settings
+
+    settings = Settings.from_environ()
+    get_digest_buffer(settings).flush()
+    metrics.flush(settings)
@@ -1,24 +1,115 @@
 """GBP Notifications Template handling"""
 
 import typing as t
+from functools import cache
 
 import jinja2.exceptions
-from jinja2 import Environment, PackageLoader, Template, select_autoescape
+from jinja2 import (
+    Environment,
+    FileSystemBytecodeCache,
+    PackageLoader,
+    Template,
+    meta,
+    select_autoescape,
+)
 
+from gbp_notifications import metrics
 from gbp_notifications.exceptions import TemplateNotFoundError
+from gbp_notifications.settings import Settings
+
+# Template names that we've already failed to load -> error message
+_missing: dict[str, str | None] = {}
+
+# Template name -> context variables it references
+_variables: dict[str, frozenset[str]] = {}
+
+
+@cache
+def get_environment(cache_size: int, bytecode_cache_dir: str = "") -> Environment:
+    """Return the (shared) jinja2 Environment for the given cache parameters
+
+    Compiled templates are kept in the environment's cache (of the given size). If
+    bytecode_cache_dir is given, compiled templates are also cached on disk there.
+    """
+    bytecode_cache = (
+        FileSystemBytecodeCache(bytecode_cache_dir) if bytecode_cache_dir else None
+    )
+    return Environment(
+        loader=PackageLoader("gbp_notifications"),
+        autoescape=select_autoescape(["html", "xml"]),
+        cache_size=cache_size,
+        auto_reload=False,
+        bytecode_cache=bytecode_cache,
+    )
+
+
+def environment() -> Environment:
+    """Return the jinja2 Environment for the current Settings"""
+    settings = Settings.from_environ()
+
+    return get_environment(
+        settings.TEMPLATE_CACHE_SIZE, settings.TEMPLATE_BYTECODE_CACHE_DIR
+    )
 
 
 def load_template(name: str) -> Template:
     """Load the template with the given name"""
-    loader = PackageLoader("gbp_notifications")
-    env = Environment(loader=loader, autoescape=select_autoescape(["html", "xml"]))
+    if name in _missing:
+        raise TemplateNotFoundError(name, _missing[name])
 
     try:
-        return env.get_template(name)
+        return environment().get_template(name)
     except jinja2.exceptions.TemplateNotFound as error:
+        _missing[name] = error.message
         raise TemplateNotFoundError(name, error.message) from error
 
 
+def template_uses(name: str, variable: str) -> bool:
+    """Return True if the template with the given name references the given variable
+
+    Templates that the template includes/extends are also taken into account. If the
+    template references other templates dynamically, assume that it does.
+    """
+    if (variables := _variables.get(name)) is None:
+        load_template(name)  # Raise TemplateNotFoundError for missing templates
+        variables = _variables[name] = find_variables(environment(), name)
+
+    return "*" in variables or variable in variables
+
+
+def find_variables(env: Environment, name: str) -> frozenset[str]:
+    """Return the undeclared variables of the template and the templates it refers to
+
+    If the template refers to templates dynamically the set will contain "*".
+    """
+    assert env.loader
+    variables: set[str] = set()
+    seen: set[str] = set()
+    names = [name]
+
+    while names:
+        seen.add(name := names.pop())
+        source, *_ = env.loader.get_source(env, name)
+        ast = env.parse(source)
+        variables.update(meta.find_undeclared_variables(ast))
+
+        for reference in meta.find_referenced_templates(ast):
+            if reference is None:
+                return frozenset({"*"})
+            if reference not in seen:
+                names.append(reference)
+
+    return frozenset(variables)
+
+
 def render_template(template: Template, context: dict[str, t.Any]) -> str:
     """Render the given Template given the context"""
-    return template.render(**context)
+    with metrics.RENDER_SECONDS.time(template=template.name or ""):
+        return template.render(**context)
+
+
+def cache_clear() -> None:
+    """Clear the template caches"""
+    get_environment.cache_clear()
+    _missing.clear()
+    _variables.clear()
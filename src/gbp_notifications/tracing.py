@@ -0,0 +1,201 @@
+"""Tracing hooks
+
+Each stage of the notification pipeline runs in a span():
+
+    signal  - a GBP signal is handled
+    resolve - the recipients of an event are looked up (and deduplicated)
+    build   - a notification's message or body is built
+    enqueue - a delivery is handed to the worker (or collected)
+    send    - a delivery is sent (by the worker)
+
+Hooks are told when each span starts and ends. The Span has the stage, its attributes
+(event, recipient, destination, ...), its timing and, if the stage failed, the error. A
+span started within another span is its child. This is enough to export
+OpenTelemetry-style spans or to run a profiler around a stage without patching the
+library.
+
+Hooks are registered with add_hook() or with an entry point in the
+gbp_notifications.tracing group. The entry point is called (with no arguments) to create
+the hook. When no hooks are registered, span() does nothing.
+"""
+
+import importlib.metadata
+import logging
+import threading
+import time
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Iterator, Protocol
+
+ENTRY_POINT_GROUP = "gbp_notifications.tracing"
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(kw_only=True)
+class Span:  # pylint: disable=too-many-instance-attributes
+    """A (timed) stage of the pipeline"""
+
+    stage: str
+    attributes: dict[str, Any]
+    parent: "Span | None" = None
+
+    start: float = 0.0
+    """time.perf_counter() when the stage started"""
+
+    end: float | None = None
+    """time.perf_counter() when the stage ended. None while it is running"""
+
+    error: BaseException | None = None
+    """The exception that the stage raised, if any"""
+
+    data: dict[Any, Any] = field(default_factory=dict)
+    """Hooks' own state for the span, e.g. the OpenTelemetry span. Key it by hook"""
+
+    @property
+    def duration(self) -> float:
+        """Seconds spent in the stage (so far)"""
+        end = time.perf_counter() if self.end is None else self.end
+
+        return end - self.start
+
+    def set(self, **attributes: Any) -> None:
+        """Add the given attributes to the span, e.g. the result of the stage"""
+        self.attributes.update(attributes)
+
+
+class Hook(Protocol):
+    """Tracing hook"""
+
+    def start(self, span: Span) -> None:  # pylint: disable=redefined-outer-name
+        """Called when the span's stage starts"""
+
+    def end(self, span: Span) -> None:  # pylint: disable=redefined-outer-name
+        """Called when the span's stage ends, whether or not it failed"""
+
+
+class Tracer:
+    """The registered tracing hooks
+
+    The entry points of the gbp_notifications.tracing group are loaded once, on first
+    use.
+    """
+
+    def __init__(self) -> None:
+        self._hooks: tuple[Hook, ...] | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def hooks(self) -> tuple[Hook, ...]:
+        """The registered hooks"""
+        if (hooks := self._hooks) is None:
+            with self._lock:
+                if (hooks := self._hooks) is None:
+                    hooks = self._hooks = tuple(load_entry_points())
+
+        return hooks
+
+    def add(self, hook: Hook) -> None:
+        """Register the given hook"""
+        hooks = self.hooks
+
+        with self._lock:
+            self._hooks = (*hooks, hook)
+
+    def remove(self, hook: Hook) -> None:
+        """Unregister the given hook"""
+        hooks = self.hooks
+
+        with self._lock:
+            self._hooks = tuple(h for h in hooks if h is not hook)
+
+    def clear(self) -> None:
+        """Unregister all hooks
+
+        The entry points are not loaded again.
+        """
+        with self._lock:
+            self._hooks = ()
+
+
+def load_entry_points() -> list[Hook]:
+    """Create the hooks of the gbp_notifications.tracing entry points"""
+    hooks: list[Hook] = []
+
+    for entry_point in importlib.metadata.entry_points(group=ENTRY_POINT_GROUP):
+        try:
+            hooks.append(entry_point.load()())
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Failed to load tracing hook %r", entry_point.name)
+
+    return hooks
+
+
+tracer = Tracer()
+_current: ContextVar[Span | None] = ContextVar("gbp_notifications_span", default=None)
+_disabled: AbstractContextManager[None] = nullcontext()
+
+
+def span(stage: str, **attributes: Any) -> AbstractContextManager[Span | None]:
+    """Trace the with block as the given stage of the pipeline
+
+    The context manager gives the Span, or None if there are no hooks.
+    """
+    if not (hooks := tracer.hooks):
+        return _disabled
+
+    return traced(hooks, stage, attributes)
+
+
+@contextmanager
+def traced(
+    hooks: tuple[Hook, ...], stage: str, attributes: dict[str, Any]
+) -> Iterator[Span]:
+    """Run the with block in a Span, notifying the given hooks"""
+    current = Span(stage=stage, attributes=attributes, parent=_current.get())
+    current.start = time.perf_counter()
+    notify(hooks, "start", current)
+    token = _current.set(current)
+
+    try:
+        yield current
+    except BaseException as error:
+        current.error = error
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _current.reset(token)
+        notify(hooks, "end", current)
+
+
+def notify(hooks: tuple[Hook, ...], name: str, current: Span) -> None:
+    """Call the hooks' given method with the span
+
+    A failing hook is logged, it doesn't fail the stage.
+    """
+    for hook in hooks:
+        try:
+            getattr(hook, name)(current)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Tracing hook %r failed", hook)
+
+
+def current_span() -> Span | None:
+    """Return the innermost running Span, if any"""
+    return _current.get()
+
+
+def add_hook(hook: Hook) -> None:
+    """Register the given tracing hook"""
+    tracer.add(hook)
+
+
+def remove_hook(hook: Hook) -> None:
+    """Unregister the given tracing hook"""
+    tracer.remove(hook)
+
+
+def clear_hooks() -> None:
+    """Unregister all tracing hooks"""
+    tracer.clear()
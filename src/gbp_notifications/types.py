@@ -1,13 +1,17 @@
 """Data types for gbp-notifications"""
 
-from dataclasses import asdict, dataclass, field
-from typing import TYPE_CHECKING, Any, Iterable, Mapping, Protocol, Self
+import logging
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Iterable, Mapping, Protocol, Self, Sequence
+from urllib.parse import urlsplit
 
-from gbp_notifications import methods, utils
+from gbp_notifications import methods, plugin, utils
 
 if TYPE_CHECKING:  # pragma: nocover
     from gbp_notifications.settings import Settings
 
+logger = logging.getLogger(__name__)
+
 
 class NotificationMethod(Protocol):  # pylint: disable=too-few-public-methods
     """Interface for notification methods"""
@@ -19,6 +23,34 @@ class NotificationMethod(Protocol):  # pylint: disable=too-few-public-methods
         """Send the given Event to the given Recipient"""
 
 
+class BatchNotificationMethod(NotificationMethod, Protocol):
+    """NotificationMethods that can send an Event to many Recipients at once"""
+
+    def send_batch(self, event: "Event", recipients: Sequence["Recipient"]) -> Any:
+        """Send the given Event to the given Recipients"""
+
+
+class DigestNotificationMethod(NotificationMethod, Protocol):
+    """NotificationMethods that can send many Events to a Recipient at once"""
+
+    def send_digest(self, events: Sequence["Event"], recipient: "Recipient") -> Any:
+        """Send the given Events to the given Recipient as a single notification"""
+
+
+class ManagedNotificationMethod(NotificationMethod, Protocol):
+    """NotificationMethods that hold resources across sends
+
+    open() is called after the (shared) instance is created and close() when the
+    instance is discarded, e.g. because the Settings changed.
+    """
+
+    def open(self) -> None:
+        """Acquire the method's resources"""
+
+    def close(self) -> None:
+        """Release the method's resources"""
+
+
 @dataclass(frozen=True, kw_only=True)
 class Event:
     """An Event that subscribers want to be notified of"""
@@ -101,16 +133,56 @@ class Recipient:
         return tuple(utils.sort_items_by(recipients, "name"))
 
     @classmethod
-    def from_name(cls, name: str, settings: "Settings") -> Self:
-        """Given the name, return the registered recipient"""
-        recipients = [r for r in settings.RECIPIENTS if r.name == name]
+    def from_name(cls, name: str, settings: "Settings") -> "Recipient":
+        """Given the name, return the registered recipient
+
+        The (shared) Recipient instance of the settings is returned.
+        """
+        try:
+            return settings.recipients_by_name[name]
+        except KeyError:
+            raise LookupError(name) from None
 
-        if not recipients:
-            raise LookupError(name)
 
-        assert len(recipients) == 1
+@dataclass(frozen=True, kw_only=True)
+class WebhookEndpoint:
+    """A (parsed and validated) webhook config"""
 
-        return cls(**asdict(recipients[0]))
+    url: str
+    headers: tuple[tuple[str, str], ...] = ()
+    timeout: int = 10
+
+    @property
+    def host(self) -> str:
+        """The host (and port) of the webhook"""
+        return urlsplit(self.url).netloc
+
+    @classmethod
+    def from_config(cls, config: str, *, timeout: int) -> Self:
+        """Create the endpoint from the recipient's webhook config
+
+        The config looks like this:
+
+            "http://host.invalid/webook|X-Header-A=foo|X-Header-B=bar"
+
+        Raise WebhookConfigError if the config is not valid.
+        """
+        # pylint: disable=import-outside-toplevel
+        from gbp_notifications.exceptions import WebhookConfigError
+
+        try:
+            url, headers = utils.parse_webhook_config(config)
+        except ValueError as error:
+            raise WebhookConfigError(str(error)) from error
+
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.netloc:
+            raise WebhookConfigError(f"Invalid webhook URL: {url!r}")
+
+        headers["Content-Type"] = "application/json"
+        headers["User-Agent"] = f"{plugin['name']}/{plugin['version']}"
+
+        return cls(url=url, headers=tuple(headers.items()), timeout=timeout)
 
 
 class Subscription(tuple[Recipient, ...]):
@@ -124,13 +196,14 @@ class Subscription(tuple[Recipient, ...]):
         # The string looks like this
         # "babette.postpull=albert lighthouse.postpull=user2"
         subscriptions: dict[Event, Self] = {}
+        index = utils.RecipientIndex(recipients)
 
         for item in string.split():
             machine_event, names = utils.split_string_by(item, "=")
             event = Event.from_string(machine_event)
-            recipient_names = set(names.split(","))
-            subscribers = utils.find_subscribers(recipients, recipient_names)
-            subscriptions[event] = cls(utils.sort_items_by(subscribers, "name"))
+            subscriptions[event] = cls.from_names(
+                event, filter(None, names.split(",")), index
+            )
 
         return subscriptions
 
@@ -147,11 +220,31 @@ class Subscription(tuple[Recipient, ...]):
             {'babette': {'foo': ['marduk'], 'pull': ['marduk', 'bob']}}
         """
         subscriptions: dict[Event, Self] = {}
+        index = utils.RecipientIndex(recipients)
 
         for machine, attrs in data.items():
             for event_name, recipient_names in attrs.items():
                 event = Event(name=event_name, machine=machine)
-                subscribers = utils.find_subscribers(recipients, recipient_names)
-                subscriptions[event] = cls(utils.sort_items_by(subscribers, "name"))
+                subscriptions[event] = cls.from_names(event, recipient_names, index)
 
         return subscriptions
+
+    @classmethod
+    def from_names(
+        cls, event: Event, names: Iterable[str], index: utils.RecipientIndex
+    ) -> Self:
+        """Return the Subscription of the Event for the recipients with the given names
+
+        Unknown recipient names are logged and otherwise ignored.
+        """
+        subscribers, unknown = index.find(names)
+
+        for name in unknown:
+            logger.warning(
+                "Unknown recipient %r subscribed to %s.%s",
+                name,
+                event.machine,
+                event.name,
+            )
+
+        return cls(subscribers)
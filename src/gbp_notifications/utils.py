@@ -1,11 +1,11 @@
 """gbp-notifications utility functions"""
 
-from typing import TYPE_CHECKING, Collection, Iterable, TypeVar
-
-from requests.structures import CaseInsensitiveDict
+from typing import TYPE_CHECKING, Callable, Collection, Generic, Iterable, TypeVar
 
 if TYPE_CHECKING:  # pragma: nocover
-    from gbp_notifications.types import Recipient
+    from requests.structures import CaseInsensitiveDict
+
+    from gbp_notifications.types import Event, Recipient
 
 
 def split_string_by(s: str, delim: str) -> tuple[str, str]:
@@ -36,7 +36,62 @@ def sort_items_by(items: Iterable[_T], field: str) -> list[_T]:
     return sorted(items, key=lambda item: getattr(item, field))
 
 
-def parse_webhook_config(config: str) -> tuple[str, CaseInsensitiveDict[str]]:
+class RecipientIndex:  # pylint: disable=too-few-public-methods
+    """Recipients indexed by name
+
+    Recipients are sorted once, when the index is created, so that lookups can return
+    them in name order.
+    """
+
+    def __init__(self, recipients: Iterable["Recipient"]) -> None:
+        self._ranked = {
+            recipient.name: (rank, recipient)
+            for rank, recipient in enumerate(sort_items_by(recipients, "name"))
+        }
+
+    def find(self, names: Iterable[str]) -> tuple[list["Recipient"], list[str]]:
+        """Return the Recipients with the given names and the names not found
+
+        The Recipients are unique and sorted by name.
+        """
+        found: dict[str, tuple[int, "Recipient"]] = {}
+        unknown: list[str] = []
+
+        for name in names:
+            if (item := self._ranked.get(name)) is not None:
+                found[name] = item
+            elif name not in unknown:
+                unknown.append(name)
+
+        return [recipient for _, recipient in sorted(found.values())], unknown
+
+
+class EventMemo(Generic[_T]):  # pylint: disable=too-few-public-methods
+    """Remember the value computed for the most recent Event
+
+    Events are sent to their recipients one after the other, so this allows work that
+    doesn't depend on the recipient to be done once per Event. Events are compared by
+    identity as Events with different data compare equal.
+    """
+
+    def __init__(self) -> None:
+        self._memo: tuple["Event", _T] | None = None
+
+    def get(self, event: "Event", func: Callable[[], _T]) -> _T:
+        """Return the value for the given Event
+
+        If the value was not already computed for the event, call func() to compute it.
+        """
+        if (memo := self._memo) is not None and memo[0] is event:
+            return memo[1]
+
+        value = func()
+        self._memo = (event, value)
+
+        return value
+
+
+def parse_webhook_config(config: str) -> tuple[str, "CaseInsensitiveDict[str]"]:
     """Parse the webhook config into url and headers
 
     The webhook config is a string that looks like this:
@@ -58,11 +113,14 @@ def parse_webhook_config(config: str) -> tuple[str, CaseInsensitiveDict[str]]:
     return url, headers
 
 
-def parse_header_conf(header_conf: str) -> CaseInsensitiveDict[str]:
+def parse_header_conf(header_conf: str) -> "CaseInsensitiveDict[str]":
     """Parse the header portion of the webhook config.
 
     Return a case-insensitive dict.
     """
+    # pylint: disable=import-outside-toplevel
+    from requests.structures import CaseInsensitiveDict
+
     return CaseInsensitiveDict(
         (key, value)
         for part in get_header_assignments(header_conf)
@@ -4,12 +4,27 @@ from pathlib import Path
 from typing import Any
 from unittest import mock
 
+import requests
 from django.test import TestCase as DjangoTestCase
 from gbp_testkit import fixtures as testkit
 from gentoo_build_publisher.types import GBPMetadata, Package, PackageMetadata
 from unittest_fixtures import FixtureContext, Fixtures, fixture, given, where
 
-from gbp_notifications.methods import get_method
+from gbp_notifications import templates
+from gbp_notifications.connections import http_sessions, smtp_pool
+from gbp_notifications.deadletters import clear_dead_letter_store
+from gbp_notifications.dedup import clear_deduplicator
+from gbp_notifications.digest import clear_digest_buffer
+from gbp_notifications.methods import registry
+from gbp_notifications.metrics import clear_metrics_store
+from gbp_notifications.metrics import registry as metrics_registry
+from gbp_notifications.outbox import clear_outbox
+from gbp_notifications.poller import clear_elections
+from gbp_notifications.ratelimit import clear_rate_limiter
+from gbp_notifications.retry import clear_retries
+from gbp_notifications.routing import clear_routing_table
+from gbp_notifications.settings import Settings
+from gbp_notifications.tracing import clear_hooks
 from gbp_notifications.types import Event, Recipient
 
 ENVIRON = {
@@ -99,9 +114,39 @@ def event(fixtures: Fixtures, name: str = "postpull") -> Event:
 
 @fixture()
 def caches(_fixtures: Fixtures) -> FixtureContext[None]:
-    get_method.cache_clear()
+    registry.clear()
+    clear_routing_table()
+    clear_deduplicator()
+    clear_rate_limiter()
+    clear_retries()
+    clear_outbox()
+    clear_elections()
+    clear_dead_letter_store()
+    clear_digest_buffer()
+    metrics_registry.reset()
+    clear_metrics_store()
+    clear_hooks()
+    Settings.cache_clear()
+    templates.cache_clear()
+    smtp_pool.reset()
+    http_sessions.reset()
     yield
-    get_method.cache_clear()
+    registry.clear()
+    clear_routing_table()
+    clear_deduplicator()
+    clear_rate_limiter()
+    clear_retries()
+    clear_outbox()
+    clear_elections()
+    clear_dead_letter_store()
+    clear_digest_buffer()
+    metrics_registry.reset()
+    clear_metrics_store()
+    clear_hooks()
+    Settings.cache_clear()
+    templates.cache_clear()
+    smtp_pool.reset()
+    http_sessions.reset()
 
 
 @fixture(testkit.tmpdir)
@@ -123,3 +168,14 @@ def recipient(
         config["email"] = email
 
     return Recipient(name=name, config=config)
+
+
+def http_error(status: int, retry_after: str = "") -> requests.HTTPError:
+    """Return an HTTPError for a response with the given status (and Retry-After)"""
+    response = requests.Response()
+    response.status_code = status
+
+    if retry_after:
+        response.headers["Retry-After"] = retry_after
+
+    return requests.HTTPError(f"{status}", response=response)
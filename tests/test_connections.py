@@ -0,0 +1,180 @@
+"""Tests for the connections module"""
+
+# pylint: disable=missing-docstring,unused-argument
+import smtplib
+from unittest import mock
+
+from gbp_testkit import fixtures as testkit
+from requests.adapters import HTTPAdapter
+from unittest_fixtures import Fixtures, given, where
+
+from gbp_notifications.connections import HTTPSessions, SMTPPool, SMTPServer
+
+from . import lib
+
+SERVER = SMTPServer(
+    host="smtp.email.invalid", port=465, username="marduk", password="secret"
+)
+
+
+def new_smtp(*_args, **_kwargs) -> mock.Mock:
+    smtp = mock.Mock(spec=smtplib.SMTP)
+    smtp.noop.return_value = (250, b"OK")
+
+    return smtp
+
+
+@given(SMTP=testkit.patch, monotonic=testkit.patch)
+@where(SMTP__target="smtplib.SMTP_SSL", SMTP__side_effect=new_smtp)
+@where(monotonic__target="time.monotonic", monotonic__return_value=0.0)
+class SMTPPoolTests(lib.TestCase):
+    def test_reuses_connections(self, fixtures: Fixtures) -> None:
+        pool = SMTPPool(idle_timeout=60)
+
+        pool.sendmail(SERVER, "from@host.invalid", ["to@host.invalid"], "test 1")
+        pool.sendmail(SERVER, "from@host.invalid", ["to@host.invalid"], "test 2")
+
+        fixtures.SMTP.assert_called_once_with("smtp.email.invalid", port=465)
+        [smtp] = pool_connections(pool)
+        smtp.login.assert_called_once_with("marduk", "secret")
+        self.assertEqual(2, smtp.sendmail.call_count)
+
+    def test_separate_pools_per_user(self, fixtures: Fixtures) -> None:
+        pool = SMTPPool(idle_timeout=60)
+        other = SMTPServer(host="smtp.email.invalid", username="bob")
+
+        pool.sendmail(SERVER, "from@host.invalid", ["to@host.invalid"], "test 1")
+        pool.sendmail(other, "from@host.invalid", ["to@host.invalid"], "test 2")
+
+        self.assertEqual(2, fixtures.SMTP.call_count)
+
+    def test_dead_connections_are_replaced(self, fixtures: Fixtures) -> None:
+        pool = SMTPPool(idle_timeout=60)
+        pool.sendmail(SERVER, "from@host.invalid", ["to@host.invalid"], "test 1")
+        [dead] = pool_connections(pool)
+        dead.noop.side_effect = smtplib.SMTPServerDisconnected()
+        dead.quit.side_effect = smtplib.SMTPServerDisconnected()
+
+        pool.sendmail(SERVER, "from@host.invalid", ["to@host.invalid"], "test 2")
+
+        self.assertEqual(2, fixtures.SMTP.call_count)
+        dead.close.assert_called_once_with()
+
+    def test_does_not_resend_when_dropped_during_send(self, fixtures: Fixtures) -> None:
+        pool = SMTPPool(idle_timeout=60)
+        pool.sendmail(SERVER, "from@host.invalid", ["to@host.invalid"], "test 1")
+        [dropped] = pool_connections(pool)
+        dropped.sendmail.side_effect = smtplib.SMTPServerDisconnected()
+
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            pool.sendmail(SERVER, "from@host.invalid", ["to@host.invalid"], "test 2")
+
+        self.assertEqual(1, fixtures.SMTP.call_count)
+        self.assertEqual([], pool_connections(pool))
+
+    def test_new_connection_failures_are_raised(self, fixtures: Fixtures) -> None:
+        pool = SMTPPool(idle_timeout=60)
+        fixtures.SMTP.side_effect = None
+        fixtures.SMTP.return_value.sendmail.side_effect = (
+            smtplib.SMTPServerDisconnected()
+        )
+
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            pool.sendmail(SERVER, "from@host.invalid", ["to@host.invalid"], "test")
+
+        fixtures.SMTP.assert_called_once_with("smtp.email.invalid", port=465)
+
+    def test_idle_connections_are_closed(self, fixtures: Fixtures) -> None:
+        pool = SMTPPool(idle_timeout=60)
+        pool.sendmail(SERVER, "from@host.invalid", ["to@host.invalid"], "test 1")
+        [idle] = pool_connections(pool)
+
+        fixtures.monotonic.return_value = 61.0
+        pool.sendmail(SERVER, "from@host.invalid", ["to@host.invalid"], "test 2")
+
+        idle.quit.assert_called_once_with()
+        idle.noop.assert_not_called()
+        self.assertEqual(2, fixtures.SMTP.call_count)
+
+    def test_idle_connections_are_closed_on_checkin(self, fixtures: Fixtures) -> None:
+        pool = SMTPPool(idle_timeout=60)
+        other = SMTPServer(host="smtp.email.invalid", username="bob")
+        pool.sendmail(SERVER, "from@host.invalid", ["to@host.invalid"], "test 1")
+        [idle] = pool_connections(pool)
+
+        fixtures.monotonic.return_value = 61.0
+        pool.sendmail(other, "from@host.invalid", ["to@host.invalid"], "test 2")
+
+        idle.quit.assert_called_once_with()
+        self.assertEqual(1, len(pool_connections(pool)))
+
+    def test_no_pooling_when_idle_timeout_is_zero(self, fixtures: Fixtures) -> None:
+        pool = SMTPPool(idle_timeout=0)
+
+        pool.sendmail(SERVER, "from@host.invalid", ["to@host.invalid"], "test 1")
+        pool.sendmail(SERVER, "from@host.invalid", ["to@host.invalid"], "test 2")
+
+        self.assertEqual([], pool_connections(pool))
+        self.assertEqual(2, fixtures.SMTP.call_count)
+
+    def test_close(self, fixtures: Fixtures) -> None:
+        pool = SMTPPool(idle_timeout=60)
+        pool.sendmail(SERVER, "from@host.invalid", ["to@host.invalid"], "test 1")
+        [idle] = pool_connections(pool)
+
+        pool.close()
+
+        idle.quit.assert_called_once_with()
+        self.assertEqual([], pool_connections(pool))
+
+
+def pool_connections(pool: SMTPPool) -> list[mock.Mock]:
+    # pylint: disable=protected-access
+    return [conn.smtp for conns in pool._idle.values() for conn in conns]
+
+
+class HTTPSessionsTests(lib.TestCase):
+    def test_session_per_host(self) -> None:
+        sessions = HTTPSessions()
+
+        session = sessions.session(
+            "https://host.invalid/webhook", pool_size=10, retries=0
+        )
+
+        self.assertIs(
+            session,
+            sessions.session("https://host.invalid/other", pool_size=10, retries=0),
+        )
+        self.assertIsNot(
+            session,
+            sessions.session("https://other.invalid/webhook", pool_size=10, retries=0),
+        )
+        self.assertIsNot(
+            session,
+            sessions.session("http://host.invalid/webhook", pool_size=10, retries=0),
+        )
+
+    def test_adapter(self) -> None:
+        sessions = HTTPSessions()
+
+        session = sessions.session("https://host.invalid/", pool_size=4, retries=3)
+
+        adapter = session.get_adapter("https://host.invalid/")
+        assert isinstance(adapter, HTTPAdapter)
+        self.assertEqual(4, adapter._pool_maxsize)  # pylint: disable=protected-access
+        self.assertEqual(3, adapter.max_retries.connect)
+        self.assertFalse(adapter.max_retries.read)
+        self.assertEqual(0, adapter.max_retries.status)
+        self.assertEqual(0, adapter.max_retries.get_backoff_time())
+
+    def test_close(self) -> None:
+        sessions = HTTPSessions()
+        session = sessions.session("https://host.invalid/", pool_size=4, retries=3)
+
+        with mock.patch.object(session, "close") as close:
+            sessions.close()
+
+        close.assert_called_once_with()
+        self.assertIsNot(
+            session, sessions.session("https://host.invalid/", pool_size=4, retries=3)
+        )
@@ -0,0 +1,186 @@
+"""Tests for dead letters"""
+
+# pylint: disable=missing-docstring,unused-argument
+import argparse
+from pathlib import Path
+from unittest import mock
+
+import requests
+from gbp_testkit import fixtures as testkit
+from unittest_fixtures import Fixtures, given, where
+
+from gbp_notifications import tasks
+from gbp_notifications.cli import deadletters as cli
+from gbp_notifications.deadletters import DeadLetter, DeadLetterStore
+from gbp_notifications.delivery import Delivery
+
+from . import lib
+
+
+def letter(recipient: str, method: str = "email") -> DeadLetter:
+    delivery = Delivery(
+        func=tasks.sendmail, args=("from", [recipient], "msg"), destination="smtp"
+    )
+    return DeadLetter(
+        method=method,
+        recipient=recipient,
+        destination="smtp",
+        job=delivery.to_job(),
+        error="SMTPServerDisconnected()",
+        attempts=3,
+    )
+
+
+def dead_letter_db(fixtures: Fixtures) -> str:
+    return str(Path(fixtures.tmpdir, "deadletters.sqlite"))
+
+
+@given(testkit.tmpdir)
+class DeadLetterStoreTests(lib.TestCase):
+    def store(self, fixtures: Fixtures) -> DeadLetterStore:
+        store = DeadLetterStore(dead_letter_db(fixtures))
+        self.addCleanup(store.close)
+
+        return store
+
+    def test_add_and_find(self, fixtures: Fixtures) -> None:
+        store = self.store(fixtures)
+
+        first = store.add(letter("albert"))
+        second = store.add(letter("bob", method="webhook"))
+
+        self.assertEqual(
+            ["albert", "bob"], [letter.recipient for letter in store.find()]
+        )
+        [found] = store.find(method="webhook")
+        self.assertEqual(second, found.id)
+        self.assertEqual(letter("bob").delivery, found.delivery)
+        self.assertEqual([first], [letter.id for letter in store.find(ids=[first])])
+        self.assertEqual([first], [letter.id for letter in store.find(limit=1)])
+        self.assertEqual([], store.find(recipient="carol"))
+
+        with self.assertRaises(TypeError):
+            store.find(error="boom")
+
+    def test_delete(self, fixtures: Fixtures) -> None:
+        store = self.store(fixtures)
+        ids = [store.add(letter(name)) for name in ["albert", "bob", "carol"]]
+
+        self.assertEqual(2, store.delete(ids[:2]))
+        self.assertEqual(["carol"], [letter.recipient for letter in store.find()])
+
+
+@given(lib.caches, testkit.environ, post=testkit.patch)
+@where(
+    environ={
+        **lib.ENVIRON,
+        "GBP_NOTIFICATIONS_RECIPIENTS": "marduk:webhook=http://host.invalid/webhook",
+    }
+)
+@where(post__target="requests.Session.post")
+class BuryTests(lib.TestCase):
+    def test_failed_delivery_is_recorded(self, fixtures: Fixtures) -> None:
+        fixtures.environ["GBP_NOTIFICATIONS_DEAD_LETTER_DB"] = dead_letter_db(fixtures)
+        fixtures.post.side_effect = requests.ConnectionError("refused")
+
+        with self.assertRaises(requests.ConnectionError):
+            tasks.send_http_request("marduk", "{}")
+
+        [dead] = DeadLetterStore(dead_letter_db(fixtures)).find()
+        self.assertEqual("webhook", dead.method)
+        self.assertEqual("marduk", dead.recipient)
+        self.assertEqual("host.invalid", dead.destination)
+        self.assertEqual(
+            Delivery(
+                func=tasks.send_http_request,
+                args=("marduk", "{}"),
+                destination="host.invalid",
+            ),
+            dead.delivery,
+        )
+        self.assertEqual("ConnectionError('refused')", dead.error)
+        self.assertEqual(1, dead.attempts)
+
+    def test_not_recorded_without_db(self, fixtures: Fixtures) -> None:
+        fixtures.post.side_effect = requests.ConnectionError("refused")
+
+        with self.assertRaises(requests.ConnectionError):
+            tasks.send_http_request("marduk", "{}")
+
+        self.assertFalse(Path(dead_letter_db(fixtures)).exists())
+
+
+@given(lib.caches, testkit.environ, testkit.console, sendmail=testkit.patch)
+@where(sendmail__target="gbp_notifications.connections.SMTPPool.sendmail")
+class CLITests(lib.TestCase):
+    def gbp(self, fixtures: Fixtures, *argv: str) -> int:
+        parser = argparse.ArgumentParser()
+        cli.parse_args(parser)
+
+        return cli.handler(parser.parse_args(argv), mock.Mock(), fixtures.console)
+
+    def store(self, fixtures: Fixtures) -> DeadLetterStore:
+        fixtures.environ["GBP_NOTIFICATIONS_DEAD_LETTER_DB"] = dead_letter_db(fixtures)
+        store = DeadLetterStore(dead_letter_db(fixtures))
+        self.addCleanup(store.close)
+
+        return store
+
+    def test_list(self, fixtures: Fixtures) -> None:
+        store = self.store(fixtures)
+        store.add(letter("albert"))
+        store.add(letter("bob", method="webhook"))
+
+        status = self.gbp(fixtures, "list", "--method", "email")
+
+        self.assertEqual(0, status)
+        self.assertIn("albert", fixtures.console.stdout)
+        self.assertIn("SMTPServer", fixtures.console.stdout)
+        self.assertNotIn("bob", fixtures.console.stdout)
+
+    def test_replay(self, fixtures: Fixtures) -> None:
+        store = self.store(fixtures)
+        for name in ["albert", "bob", "carol"]:
+            store.add(letter(name))
+
+        status = self.gbp(fixtures, "replay", "--batch-size", "2")
+
+        self.assertEqual(0, status)
+        self.assertEqual(
+            [["albert"], ["bob"], ["carol"]],
+            sorted(call.args[2] for call in fixtures.sendmail.call_args_list),
+        )
+        self.assertEqual([], store.find())
+        self.assertIn(
+            "Replayed 3 dead letters. 0 failed again", fixtures.console.stdout
+        )
+
+    def test_replay_failures_are_recorded_again(self, fixtures: Fixtures) -> None:
+        store = self.store(fixtures)
+        first = store.add(letter("albert"))
+        fixtures.sendmail.side_effect = ValueError("boom")
+
+        status = self.gbp(fixtures, "replay")
+
+        self.assertEqual(1, status)
+        [dead] = store.find()
+        self.assertNotEqual(first, dead.id)
+        self.assertEqual("ValueError('boom')", dead.error)
+        self.assertIn(f"{first}: ValueError('boom')", fixtures.console.stderr)
+
+    def test_delete(self, fixtures: Fixtures) -> None:
+        store = self.store(fixtures)
+        first = store.add(letter("albert"))
+        store.add(letter("bob"))
+
+        status = self.gbp(fixtures, "delete", str(first))
+
+        self.assertEqual(0, status)
+        self.assertEqual(["bob"], [letter.recipient for letter in store.find()])
+        self.assertIn("Deleted 1 dead letters", fixtures.console.stdout)
+
+    def test_no_database(self, fixtures: Fixtures) -> None:
+        status = self.gbp(fixtures, "list")
+
+        self.assertEqual(1, status)
+        self.assertIn("DEAD_LETTER_DB is not set", fixtures.console.stderr)
@@ -0,0 +1,121 @@
+"""Tests for the dedup module"""
+
+# pylint: disable=missing-docstring,unused-argument
+from pathlib import Path
+from unittest import mock
+
+from gbp_testkit import fixtures as testkit
+from unittest_fixtures import Fixtures, given, where
+
+from gbp_notifications.dedup import Deduplicator, DedupStore
+from gbp_notifications.methods.email import EmailMethod
+from gbp_notifications.settings import Settings
+from gbp_notifications.signals import send_event_to_recipients
+from gbp_notifications.types import Event
+
+from . import lib
+
+KEY = ("marduk", "email", "babette", "1234", "postpull")
+
+
+class DeduplicatorTests(lib.TestCase):
+    def test_first(self) -> None:
+        dedup = Deduplicator(ttl=60, size=10)
+
+        self.assertTrue(dedup.first(KEY))
+        self.assertFalse(dedup.first(KEY))
+        self.assertTrue(dedup.first((*KEY[:4], "published")))
+
+    def test_ttl(self) -> None:
+        dedup = Deduplicator(ttl=60, size=10)
+
+        with mock.patch("time.monotonic", return_value=1000.0):
+            dedup.first(KEY)
+
+        with mock.patch("time.monotonic", return_value=1061.0):
+            self.assertTrue(dedup.first(KEY))
+
+    def test_size(self) -> None:
+        dedup = Deduplicator(ttl=60, size=2)
+
+        for build_id in ["1", "2", "3"]:
+            dedup.first((*KEY[:3], build_id, KEY[4]))
+
+        self.assertTrue(dedup.first(KEY[:3] + ("1", KEY[4])))
+
+
+@given(lib.event, bob=lib.recipient, marduk=lib.recipient)
+@where(bob__name="bob")
+class FilterTests(lib.TestCase):
+    def test(self, fixtures: Fixtures) -> None:
+        dedup = Deduplicator(ttl=60, size=10)
+        method = EmailMethod(Settings())
+        recipients = [fixtures.bob, fixtures.marduk]
+
+        self.assertEqual(
+            [fixtures.marduk], dedup.filter(method, fixtures.event, [fixtures.marduk])
+        )
+        self.assertEqual(
+            [fixtures.bob], dedup.filter(method, fixtures.event, recipients)
+        )
+
+    def test_event_without_build(self, fixtures: Fixtures) -> None:
+        dedup = Deduplicator(ttl=60, size=10)
+        method = EmailMethod(Settings())
+        event = Event(name="postpull", machine="babette")
+
+        dedup.filter(method, event, [fixtures.bob])
+
+        self.assertEqual([fixtures.bob], dedup.filter(method, event, [fixtures.bob]))
+
+
+@given(testkit.tmpdir)
+class DedupStoreTests(lib.TestCase):
+    def test_shared_between_deduplicators(self, fixtures: Fixtures) -> None:
+        path = str(Path(fixtures.tmpdir, "dedup.sqlite"))
+        store1 = DedupStore(path)
+        store2 = DedupStore(path)
+        dedup1 = Deduplicator(ttl=60, size=10, store=store1)
+        dedup2 = Deduplicator(ttl=60, size=10, store=store2)
+
+        self.assertTrue(dedup1.first(KEY))
+        self.assertFalse(dedup2.first(KEY))
+
+        store1.close()
+        store2.close()
+
+    def test_expired(self, fixtures: Fixtures) -> None:
+        store = DedupStore(str(Path(fixtures.tmpdir, "dedup.sqlite")))
+
+        with mock.patch("time.time", return_value=1000.0):
+            self.assertTrue(store.claim(KEY, 60))
+            self.assertFalse(store.claim(KEY, 60))
+
+        with mock.patch("time.time", return_value=1061.0):
+            self.assertTrue(store.claim(KEY, 60))
+
+        store.close()
+
+
+@given(lib.caches, testkit.environ, lib.event, worker_run=testkit.patch)
+@where(environ={**lib.ENVIRON, "GBP_NOTIFICATIONS_DEDUP_TTL": "3600"})
+@where(worker_run__target="gentoo_build_publisher.worker.run")
+class DedupModeTests(lib.TestCase):
+    def test_duplicate_event_is_not_sent(self, fixtures: Fixtures) -> None:
+        fixtures.environ["GBP_NOTIFICATIONS_RECIPIENTS"] = (
+            "albert:email=marduk@host.invalid bob:email=bob@host.invalid"
+        )
+        fixtures.environ["GBP_NOTIFICATIONS_SUBSCRIPTIONS"] = (
+            "babette.postpull=albert *.postpull=bob"
+        )
+
+        send_event_to_recipients(fixtures.event)
+        self.assertEqual(2, fixtures.worker_run.call_count)
+
+        send_event_to_recipients(fixtures.event)
+        self.assertEqual(2, fixtures.worker_run.call_count)
+
+        published = Event(name="published", machine="babette", data=fixtures.event.data)
+        fixtures.environ["GBP_NOTIFICATIONS_SUBSCRIPTIONS"] = "*.*=bob"
+        send_event_to_recipients(published)
+        self.assertEqual(3, fixtures.worker_run.call_count)
@@ -0,0 +1,268 @@
+"""Tests for the delivery module"""
+
+# pylint: disable=missing-docstring,unused-argument
+import secrets
+import threading
+import time
+from dataclasses import replace
+from unittest import mock
+
+from django.core.signing import BadSignature
+from gbp_testkit import fixtures as testkit
+from unittest_fixtures import Fixtures, given, where
+
+from gbp_notifications import tasks
+from gbp_notifications.delivery import (
+    Delivery,
+    collect,
+    decode_event,
+    deliver,
+    encode_event,
+    enqueue,
+)
+from gbp_notifications.signals import send_event_to_recipients
+from gbp_notifications.types import Event
+
+from . import lib
+
+
+class Tracker:  # pylint: disable=too-few-public-methods
+    """Keeps track of how many calls to .work() happen at the same time"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.running: dict[str, int] = {}
+        self.max_running: dict[str, int] = {}
+        self.max_total = 0
+
+    def work(self, destination: str) -> None:
+        with self.lock:
+            self.running[destination] = self.running.get(destination, 0) + 1
+            self.max_running[destination] = max(
+                self.max_running.get(destination, 0), self.running[destination]
+            )
+            self.max_total = max(self.max_total, sum(self.running.values()))
+        time.sleep(0.01)
+        with self.lock:
+            self.running[destination] -= 1
+
+
+def fail(message: str) -> None:
+    raise ValueError(message)
+
+
+@given(worker_run=testkit.patch)
+@where(worker_run__target="gentoo_build_publisher.worker.run")
+class EnqueueTests(lib.TestCase):
+    def test_runs_on_worker(self, fixtures: Fixtures) -> None:
+        enqueue(tasks.sendmail, "from", ["to"], "msg", destination="host.invalid")
+
+        fixtures.worker_run.assert_called_once_with(
+            tasks.sendmail, "from", ["to"], "msg"
+        )
+
+    def test_collect(self, fixtures: Fixtures) -> None:
+        with collect() as deliveries:
+            enqueue(tasks.sendmail, "from", ["to"], "msg", destination="host.invalid")
+
+        fixtures.worker_run.assert_not_called()
+        self.assertEqual(
+            [
+                Delivery(
+                    func=tasks.sendmail,
+                    args=("from", ["to"], "msg"),
+                    destination="host.invalid",
+                )
+            ],
+            deliveries,
+        )
+
+        enqueue(tasks.sendmail, "from", ["to"], "msg")
+        fixtures.worker_run.assert_called_once()
+
+
+class DeliveryTests(lib.TestCase):
+    def test_job_round_trip(self) -> None:
+        delivery = Delivery(
+            func=tasks.sendmail, args=("from", ["to"], "msg"), destination="host"
+        )
+
+        job = delivery.to_job()
+
+        self.assertEqual(
+            ["gbp_notifications.tasks:sendmail", ["from", ["to"], "msg"], "host"], job
+        )
+        self.assertEqual(delivery, Delivery.from_job(job))
+
+
+class DeliverTests(lib.TestCase):
+    def test_limits_concurrency(self) -> None:
+        tracker = Tracker()
+        deliveries = [
+            Delivery(func=tracker.work, args=(dest,), destination=dest)
+            for dest in ["slow.invalid"] * 8 + ["fast.invalid"] * 8
+        ]
+
+        errors = deliver(deliveries, max_concurrency=3, max_per_destination=2)
+
+        self.assertEqual([], errors)
+        self.assertEqual({"slow.invalid": 2, "fast.invalid": 2}, tracker.max_running)
+        self.assertLessEqual(tracker.max_total, 3)
+
+    def test_returns_errors(self) -> None:
+        tracker = Tracker()
+        deliveries = [
+            Delivery(func=fail, args=("boom",), destination="bad.invalid"),
+            Delivery(func=tracker.work, args=("good.invalid",)),
+        ]
+
+        errors = deliver(deliveries, max_concurrency=2, max_per_destination=2)
+
+        self.assertEqual(["boom"], [str(error) for error in errors])
+        self.assertEqual({"good.invalid": 1}, tracker.max_running)
+
+
+@given(sendmail=testkit.patch)
+@where(sendmail__target="gbp_notifications.tasks.sendmail")
+class DeliverTaskTests(lib.TestCase):
+    def test(self, fixtures: Fixtures) -> None:
+        jobs = [["gbp_notifications.tasks:sendmail", ["from", ["to"], "msg"], "host"]]
+
+        tasks.deliver(jobs)
+
+        fixtures.sendmail.assert_called_once_with("from", ["to"], "msg")
+
+    def test_failures(self, fixtures: Fixtures) -> None:
+        fixtures.sendmail.side_effect = [None, ValueError("boom")]
+        jobs = [["gbp_notifications.tasks:sendmail", ["from", ["to"], "msg"], "host"]]
+
+        with self.assertRaises(ExceptionGroup) as context:
+            tasks.deliver(jobs * 2)
+
+        self.assertEqual("1 of 2 deliveries failed", context.exception.message)
+
+
+@given(lib.caches, testkit.environ, lib.event, worker_run=testkit.patch)
+@where(environ={**lib.ENVIRON, "GBP_NOTIFICATIONS_ASYNC_DELIVERY": "1"})
+@where(worker_run__target="gentoo_build_publisher.worker.run")
+class AsyncDeliveryTests(lib.TestCase):
+    def test_single_job_per_event(self, fixtures: Fixtures) -> None:
+        fixtures.environ["GBP_NOTIFICATIONS_RECIPIENTS"] = (
+            "albert:email=marduk@host.invalid bob:email=bob@host.invalid"
+        )
+        fixtures.environ["GBP_NOTIFICATIONS_SUBSCRIPTIONS"] = (
+            "babette.postpull=albert,bob"
+        )
+
+        send_event_to_recipients(fixtures.event)
+
+        fixtures.worker_run.assert_called_once_with(tasks.deliver, mock.ANY)
+        jobs = fixtures.worker_run.call_args.args[1]
+        self.assertEqual(
+            [["albert <marduk@host.invalid>"], ["bob <bob@host.invalid>"]],
+            [job[1][1] for job in jobs],
+        )
+        self.assertEqual(
+            ["smtp.email.invalid", "smtp.email.invalid"], [job[2] for job in jobs]
+        )
+
+
+@given(lib.event)
+class EncodeEventTests(lib.TestCase):
+    def test_round_trip(self, fixtures: Fixtures) -> None:
+        event = decode_event(encode_event(fixtures.event))
+
+        self.assertEqual(fixtures.event, event)
+        self.assertEqual(
+            fixtures.event.data["gbp_metadata"], event.data["gbp_metadata"]
+        )
+        self.assertEqual(
+            replace(fixtures.event.data["build"], logs=None, note=None),
+            event.data["build"],
+        )
+
+    def test_leaves_out_logs_and_note(self, fixtures: Fixtures) -> None:
+        # Random, so that the logs don't compress away
+        logs = secrets.token_hex(1024 * 1024)
+        build = replace(fixtures.event.data["build"], logs=logs, note=logs)
+        event = replace(fixtures.event, data={**fixtures.event.data, "build": build})
+
+        data = encode_event(event)
+
+        self.assertLess(len(data), 10_000)
+        self.assertIsNone(decode_event(data).data["build"].logs)
+        self.assertEqual(logs, build.logs)
+
+    def test_event_without_build(self, fixtures: Fixtures) -> None:
+        event = Event(name="postpull", machine="babette", data={"build": None})
+
+        self.assertEqual(event.data, decode_event(encode_event(event)).data)
+
+    def test_tampered(self, fixtures: Fixtures) -> None:
+        data = encode_event(fixtures.event)
+
+        with self.assertRaises(BadSignature):
+            decode_event(f"x{data}")
+
+
+FANOUT_ENVIRON = {
+    **lib.ENVIRON,
+    "GBP_NOTIFICATIONS_FANOUT_JOB": "1",
+    "GBP_NOTIFICATIONS_RECIPIENTS": "albert:email=marduk@host.invalid"
+    " bob:email=bob@host.invalid,webhook=http://host.invalid/webhook",
+    "GBP_NOTIFICATIONS_SUBSCRIPTIONS": "babette.postpull=albert,bob",
+}
+
+
+@given(lib.caches, testkit.environ, lib.event, worker_run=testkit.patch)
+@where(environ=FANOUT_ENVIRON)
+@where(worker_run__target="gentoo_build_publisher.worker.run")
+class FanoutJobTests(lib.TestCase):
+    def test_single_job_per_event(self, fixtures: Fixtures) -> None:
+        # The job doesn't carry the build's logs
+        build = replace(fixtures.event.data["build"], logs=secrets.token_hex(1024**2))
+        send_event_to_recipients(
+            replace(fixtures.event, data={**fixtures.event.data, "build": build})
+        )
+
+        fixtures.worker_run.assert_called_once_with(
+            tasks.send_event, mock.ANY, ["albert", "bob"]
+        )
+        data = fixtures.worker_run.call_args.args[1]
+        event = decode_event(data)
+        self.assertEqual(
+            fixtures.event.data["gbp_metadata"], event.data["gbp_metadata"]
+        )
+        self.assertLess(len(data), 10_000)
+
+    def test_no_recipients(self, fixtures: Fixtures) -> None:
+        fixtures.environ["GBP_NOTIFICATIONS_SUBSCRIPTIONS"] = ""
+
+        send_event_to_recipients(fixtures.event)
+
+        fixtures.worker_run.assert_not_called()
+
+
+@given(lib.caches, testkit.environ, lib.event, sendmail=testkit.patch)
+@given(send_http_request=testkit.patch)
+@where(environ=FANOUT_ENVIRON)
+@where(sendmail__target="gbp_notifications.tasks.sendmail")
+@where(send_http_request__target="gbp_notifications.tasks.send_http_request")
+class SendEventTaskTests(lib.TestCase):
+    def test(self, fixtures: Fixtures) -> None:
+        with self.assertLogs("gbp_notifications.signals", "WARNING"):
+            tasks.send_event(encode_event(fixtures.event), ["albert", "bob", "bogus"])
+
+        self.assertEqual(
+            [["albert <marduk@host.invalid>"], ["bob <bob@host.invalid>"]],
+            sorted(call.args[1] for call in fixtures.sendmail.call_args_list),
+        )
+        fixtures.send_http_request.assert_called_once_with("bob", mock.ANY)
+
+    def test_failures(self, fixtures: Fixtures) -> None:
+        fixtures.send_http_request.side_effect = ValueError("boom")
+
+        with self.assertRaises(ExceptionGroup) as context:
+            tasks.send_event(encode_event(fixtures.event), ["albert", "bob"])
+
+        self.assertEqual("1 deliveries failed", context.exception.message)
@@ -0,0 +1,279 @@
+"""Tests for the digest module"""
+
+# pylint: disable=missing-docstring,unused-argument
+from pathlib import Path
+from typing import Sequence
+from unittest import mock
+
+from gbp_testkit import fixtures as testkit
+from unittest_fixtures import Fixtures, given, where
+
+from gbp_notifications import tasks
+from gbp_notifications.digest import (
+    DigestBuffer,
+    DigestStore,
+    flush_digests,
+    get_digest_buffer,
+    send_digest,
+)
+from gbp_notifications.methods import register_method
+from gbp_notifications.outbox import get_outbox
+from gbp_notifications.routing import get_routing_table
+from gbp_notifications.settings import Settings
+from gbp_notifications.signals import send_event_to_recipients
+from gbp_notifications.types import Event, Recipient
+
+from . import lib
+
+
+class DigestMethod:
+    def __init__(self, _settings: Settings | None = None) -> None:
+        self.sent: list[tuple[Event, Recipient]] = []
+        self.digests: list[tuple[tuple[Event, ...], Recipient]] = []
+
+    def send(self, event: Event, recipient: Recipient) -> None:
+        self.sent.append((event, recipient))
+
+    def send_digest(self, events: Sequence[Event], recipient: Recipient) -> None:
+        self.digests.append((tuple(events), recipient))
+
+
+def make_events(count: int) -> list[Event]:
+    return [Event(name="postpull", machine=f"babette{i}") for i in range(count)]
+
+
+@given(testkit.tmpdir, clock=testkit.patch)
+@where(clock__target="time.time", clock__return_value=1000.0)
+class DigestStoreTests(lib.TestCase):
+    def store(self, fixtures: Fixtures) -> DigestStore:
+        store = DigestStore(str(Path(fixtures.tmpdir, "digests.sqlite")))
+        self.addCleanup(store.close)
+
+        return store
+
+    def test_window(self, fixtures: Fixtures) -> None:
+        store = self.store(fixtures)
+        store.add("email", ["bob", "marduk"], "e1")
+        fixtures.clock.return_value = 1030.0
+        store.add("email", ["bob"], "e2")
+
+        self.assertFalse(store.due(60, 10))
+        self.assertEqual([], store.take(60, 10))
+
+        fixtures.clock.return_value = 1060.0
+        self.assertTrue(store.due(60, 10))
+        self.assertEqual(
+            [("email", "bob", ["e1", "e2"]), ("email", "marduk", ["e1"])],
+            sorted(store.take(60, 10)),
+        )
+        self.assertEqual(0, len(store))
+
+    def test_max_events(self, fixtures: Fixtures) -> None:
+        store = self.store(fixtures)
+        store.add("email", ["bob", "marduk"], "e1")
+        store.add("email", ["bob"], "e2")
+
+        self.assertTrue(store.due(60, 2))
+        self.assertEqual([("email", "bob", ["e1", "e2"])], store.take(60, 2))
+        self.assertEqual(1, len(store))
+
+    def test_everything(self, fixtures: Fixtures) -> None:
+        store = self.store(fixtures)
+        store.add("email", ["bob"], "e1")
+
+        self.assertEqual(
+            [("email", "bob", ["e1"])], store.take(60, 10, everything=True)
+        )
+
+    def test_events_are_stored_once(self, fixtures: Fixtures) -> None:
+        store = self.store(fixtures)
+        store.add("email", ["bob", "marduk"], "e1")
+        store.add("webhook", ["bob"], "e1")
+        self.assertEqual(1, self.stored_events(store))
+
+        fixtures.clock.return_value = 1030.0
+        store.add("email", ["albert"], "e2")
+        self.assertEqual(2, self.stored_events(store))
+
+        fixtures.clock.return_value = 1060.0
+        self.assertEqual(3, len(store.take(60, 10)))
+        self.assertEqual(1, self.stored_events(store))
+        self.assertEqual(1, len(store))
+
+    def stored_events(self, store: DigestStore) -> int:
+        with store.db.lock:
+            conn = store.db.connection()
+            [count] = conn.execute("SELECT COUNT(*) FROM digest_event_data").fetchone()
+
+        return int(count)
+
+    def test_shared_between_processes(self, fixtures: Fixtures) -> None:
+        store1 = self.store(fixtures)
+        store2 = self.store(fixtures)
+        store1.add("email", ["bob"], "e1")
+        fixtures.clock.return_value = 1060.0
+
+        self.assertEqual([("email", "bob", ["e1"])], store2.take(60, 10))
+        self.assertEqual([], store1.take(60, 10))
+
+
+@given(lib.caches, testkit.environ, clock=testkit.patch)
+@where(
+    environ={
+        **lib.ENVIRON,
+        "GBP_NOTIFICATIONS_DIGEST_WINDOW": "60",
+        "GBP_NOTIFICATIONS_DIGEST_MAX_EVENTS": "3",
+        "GBP_NOTIFICATIONS_RECIPIENTS": "bob:digest=yes marduk:digest=yes",
+    }
+)
+@where(clock__target="time.time", clock__return_value=1000.0)
+class DigestBufferTests(lib.TestCase):
+    def buffer(self) -> tuple[DigestBuffer, DigestMethod, dict[str, Recipient]]:
+        register_method("digest", DigestMethod)
+        settings = Settings.from_environ()
+        buffer = DigestBuffer(settings)
+        self.addCleanup(buffer.close)
+        method = get_routing_table(settings).instances.get(DigestMethod)
+        assert isinstance(method, DigestMethod)
+
+        return buffer, method, settings.recipients_by_name
+
+    def test_flush(self, fixtures: Fixtures) -> None:
+        buffer, method, recipients = self.buffer()
+        bob, marduk = recipients["bob"], recipients["marduk"]
+        e1, e2 = make_events(2)
+
+        buffer.add(method, e1, [bob, marduk])
+        buffer.add(method, e2, [bob])
+
+        self.assertEqual(3, len(buffer))
+        self.assertEqual([], method.digests)
+
+        buffer.flush(everything=True)
+
+        self.assertEqual(0, len(buffer))
+        self.assertEqual([((e1, e2), bob)], method.digests)
+        self.assertEqual([(e1, marduk)], method.sent)
+
+    def test_window(self, fixtures: Fixtures) -> None:
+        buffer, method, recipients = self.buffer()
+        e1, e2 = make_events(2)
+        buffer.add(method, e1, [recipients["bob"]])
+        buffer.add(method, e2, [recipients["bob"]])
+
+        buffer.flush()
+        self.assertFalse(buffer.due())
+        self.assertEqual([], method.digests)
+
+        fixtures.clock.return_value = 1060.0
+        self.assertTrue(buffer.due())
+        buffer.flush()
+
+        self.assertEqual([((e1, e2), recipients["bob"])], method.digests)
+
+    def test_max_events(self, fixtures: Fixtures) -> None:
+        buffer, method, recipients = self.buffer()
+        e1, e2, e3, e4 = make_events(4)
+
+        for event in [e1, e2, e3, e4]:
+            buffer.add(method, event, [recipients["bob"]])
+
+        self.assertEqual([((e1, e2, e3), recipients["bob"])], method.digests)
+        self.assertEqual(1, len(buffer))
+
+    def test_unknown_recipient(self, fixtures: Fixtures) -> None:
+        buffer, method, _ = self.buffer()
+        [event] = make_events(1)
+        buffer.add(method, event, [Recipient(name="albert")])
+
+        with self.assertLogs("gbp_notifications.digest", "WARNING"):
+            buffer.flush(everything=True)
+
+        self.assertEqual([], method.sent)
+
+
+@given(lib.caches)
+class GetDigestBufferTests(lib.TestCase):
+    def test_settings_change_keeps_the_store(self, fixtures: Fixtures) -> None:
+        buffer = get_digest_buffer(Settings(DIGEST_WINDOW=60))
+        buffer.store.add("email", ["bob"], "event")
+
+        new_buffer = get_digest_buffer(Settings(DIGEST_WINDOW=60))
+
+        self.assertIsNot(buffer, new_buffer)
+        self.assertIs(buffer.store, new_buffer.store)
+        self.assertEqual(1, len(new_buffer))
+
+
+@given(bob=lib.recipient)
+class SendDigestTests(lib.TestCase):
+    def test_method_without_digest_support(self, fixtures: Fixtures) -> None:
+        method = mock.Mock(spec=["send"])
+        e1, e2 = make_events(2)
+
+        send_digest(method, [e1, e2], fixtures.bob)
+
+        self.assertEqual(
+            [mock.call(e1, fixtures.bob), mock.call(e2, fixtures.bob)],
+            method.send.call_args_list,
+        )
+
+
+@given(lib.caches, testkit.environ, lib.event)
+@where(
+    environ={
+        **lib.ENVIRON,
+        "GBP_NOTIFICATIONS_DIGEST_WINDOW": "60",
+        "GBP_NOTIFICATIONS_RECIPIENTS": "marduk:digest=yes",
+        "GBP_NOTIFICATIONS_SUBSCRIPTIONS": "*.postpull=marduk",
+    }
+)
+class DigestModeTests(lib.TestCase):
+    def test_events_are_buffered(self, fixtures: Fixtures) -> None:
+        register_method("digest", DigestMethod)
+        settings = Settings.from_environ()
+        [(method, [recipient])] = get_routing_table(settings).routes(fixtures.event)
+        assert isinstance(method, DigestMethod)
+
+        send_event_to_recipients(fixtures.event)
+        send_event_to_recipients(fixtures.event)
+
+        self.assertEqual([], method.digests)
+        self.assertEqual(2, len(get_digest_buffer(settings)))
+
+        flush_digests()
+
+        self.assertEqual(
+            [((fixtures.event, fixtures.event), recipient)], method.digests
+        )
+        self.assertEqual([], method.sent)
+
+
+@given(lib.caches, testkit.environ, testkit.tmpdir, lib.event, worker_run=testkit.patch)
+@where(environ={**lib.ENVIRON, "GBP_NOTIFICATIONS_DIGEST_WINDOW": "60"})
+@where(worker_run__target="gentoo_build_publisher.worker.run")
+class SharedDigestTests(lib.TestCase):
+    def test_flushed_by_worker_to_outbox(self, fixtures: Fixtures) -> None:
+        fixtures.environ["GBP_NOTIFICATIONS_DIGEST_DB"] = str(
+            Path(fixtures.tmpdir, "digests.sqlite")
+        )
+        fixtures.environ["GBP_NOTIFICATIONS_OUTBOX_DB"] = str(
+            Path(fixtures.tmpdir, "outbox.sqlite")
+        )
+        settings = Settings.from_environ()
+
+        send_event_to_recipients(fixtures.event)
+        send_event_to_recipients(fixtures.event)
+
+        # The buffered events outlive the process
+        flush_digests()
+        self.assertEqual(2, len(get_digest_buffer(settings)))
+        fixtures.worker_run.assert_not_called()
+
+        with mock.patch("time.time", return_value=2e9):
+            tasks.flush_digests()
+
+        self.assertEqual(0, len(get_digest_buffer(settings)))
+        fixtures.worker_run.assert_called_once_with(tasks.drain_outbox)
+        [entry] = get_outbox(settings).claim(10, 60)
+        self.assertIs(tasks.sendmail, entry.delivery.func)
@@ -1,14 +1,17 @@
 """Tests for the methods module"""
 
-# pylint: disable=missing-docstring
+# pylint: disable=missing-docstring,unused-argument
+import importlib.metadata
 
-from unittest_fixtures import Fixtures, params
+from gbp_testkit import fixtures as testkit
+from unittest_fixtures import Fixtures, given, params, where
 
 from gbp_notifications import methods
 from gbp_notifications.exceptions import MethodNotFoundError
 from gbp_notifications.methods.email import EmailMethod
 from gbp_notifications.methods.webhook import WebhookMethod
 
+from . import lib
 from .lib import TestCase
 
 
@@ -22,3 +25,36 @@ class GetMethodTests(TestCase):
 
         with self.assertRaises(MethodNotFoundError):
             methods.get_method("bogus")
+
+
+@given(lib.caches, entry_points=testkit.patch)
+@where(entry_points__target="importlib.metadata.entry_points")
+@where(entry_points__wraps=importlib.metadata.entry_points)
+class MethodRegistryTests(TestCase):
+    def test_scans_entry_points_once(self, fixtures: Fixtures) -> None:
+        registry = methods.MethodRegistry()
+
+        self.assertIs(EmailMethod, registry.get("email"))
+        self.assertIs(WebhookMethod, registry.get("webhook"))
+        with self.assertRaises(MethodNotFoundError):
+            registry.get("bogus")
+
+        fixtures.entry_points.assert_called_once_with(
+            group="gbp_notifications.notification_method"
+        )
+
+    def test_register(self, fixtures: Fixtures) -> None:
+        methods.register_method("email", WebhookMethod)
+        methods.register_method("test", EmailMethod)
+
+        self.assertIs(WebhookMethod, methods.get_method("email"))
+        self.assertIs(EmailMethod, methods.get_method("test"))
+
+    def test_warm(self, fixtures: Fixtures) -> None:
+        registry = methods.MethodRegistry()
+
+        registry.warm()
+        fixtures.entry_points.reset_mock()
+
+        self.assertIs(EmailMethod, registry.get("email"))
+        fixtures.entry_points.assert_not_called()
@@ -2,6 +2,10 @@
 
 # pylint: disable=missing-docstring,unused-argument
 from dataclasses import replace
+from email import message_from_string, policy
+from email.message import EmailMessage
+from typing import cast
+from unittest import mock
 
 import gbp_testkit.fixtures as testkit
 from unittest_fixtures import Fixtures, given, where
@@ -9,7 +13,7 @@ from unittest_fixtures import Fixtures, given, where
 from gbp_notifications import tasks
 from gbp_notifications.methods import email
 from gbp_notifications.settings import Settings
-from gbp_notifications.types import Subscription
+from gbp_notifications.types import Event, Recipient, Subscription
 
 from . import lib
 
@@ -51,6 +55,149 @@ class SendTests(lib.TestCase):
         warning.assert_called_once_with("No template found for event: %s", "bogus")
 
 
+@given(lib.caches, lib.event, bob=lib.recipient, marduk=lib.recipient)
+@given(albert=lib.recipient, worker_run=testkit.patch)
+@where(albert__name="albert", albert__email="albert@host.invalid")
+@where(bob__name="bob", bob__email="bob@host.invalid")
+@where(worker_run__target="gentoo_build_publisher.worker.run")
+class SendBatchTests(lib.TestCase):
+    def recipients(self, fixtures: Fixtures) -> list[Recipient]:
+        return [fixtures.albert, fixtures.bob, fixtures.marduk]
+
+    def test_batches(self, fixtures: Fixtures) -> None:
+        settings = Settings(EMAIL_FROM="gbp@host.invalid", EMAIL_BATCH_SIZE=2)
+        method = email.EmailMethod(settings)
+
+        method.send_batch(fixtures.event, self.recipients(fixtures))
+
+        msg = method.compose_batch(fixtures.event, self.recipients(fixtures))
+        self.assertEqual("undisclosed-recipients:;", msg["to"])
+        worker_run = fixtures.worker_run
+        self.assertEqual(
+            worker_run.call_args_list,
+            [
+                mock.call(
+                    tasks.sendmail,
+                    "gbp@host.invalid",
+                    ["albert <albert@host.invalid>", "bob <bob@host.invalid>"],
+                    msg.as_string(),
+                ),
+                mock.call(
+                    tasks.sendmail,
+                    "gbp@host.invalid",
+                    ["marduk <marduk@host.invalid>"],
+                    msg.as_string(),
+                ),
+            ],
+        )
+
+    def test_batching_disabled(self, fixtures: Fixtures) -> None:
+        method = email.EmailMethod(Settings(EMAIL_FROM="gbp@host.invalid"))
+
+        method.send_batch(fixtures.event, self.recipients(fixtures))
+
+        self.assertEqual(3, fixtures.worker_run.call_count)
+        to_addrs = [c.args[2] for c in fixtures.worker_run.call_args_list]
+        self.assertEqual(
+            [
+                ["albert <albert@host.invalid>"],
+                ["bob <bob@host.invalid>"],
+                ["marduk <marduk@host.invalid>"],
+            ],
+            to_addrs,
+        )
+
+    def test_personalized_templates_are_not_batched(self, fixtures: Fixtures) -> None:
+        settings = Settings(EMAIL_FROM="gbp@host.invalid", EMAIL_BATCH_SIZE=2)
+        method = email.EmailMethod(settings)
+
+        with mock.patch.object(email, "template_uses", return_value=True):
+            method.send_batch(fixtures.event, self.recipients(fixtures))
+
+        self.assertEqual(3, fixtures.worker_run.call_count)
+
+    def test_missing_template(self, fixtures: Fixtures) -> None:
+        settings = Settings(EMAIL_FROM="gbp@host.invalid", EMAIL_BATCH_SIZE=2)
+        method = email.EmailMethod(settings)
+        event = replace(fixtures.event, name="bogus")
+
+        method.send_batch(event, self.recipients(fixtures))
+
+        fixtures.worker_run.assert_not_called()
+
+
+@given(lib.caches, lib.event, lib.recipient, worker_run=testkit.patch)
+@where(worker_run__target="gentoo_build_publisher.worker.run")
+class SendDigestTests(lib.TestCase):
+    def test(self, fixtures: Fixtures) -> None:
+        method = email.EmailMethod(Settings(EMAIL_FROM="gbp@host.invalid"))
+        published = Event(name="published", machine="babette", data=fixtures.event.data)
+
+        method.send_digest([fixtures.event, published], fixtures.recipient)
+
+        fixtures.worker_run.assert_called_once()
+        func, from_addr, to_addrs, msg = fixtures.worker_run.call_args.args
+        self.assertIs(tasks.sendmail, func)
+        self.assertEqual("gbp@host.invalid", from_addr)
+        self.assertEqual(["marduk <marduk@host.invalid>"], to_addrs)
+        message = message_from_string(msg, policy=policy.default)
+        self.assertEqual("Gentoo Build Publisher: 2 events", message["Subject"])
+        build_id = fixtures.event.data["build"].build_id
+        content = cast(EmailMessage, message).get_content()
+        self.assertIn(f"babette: build {build_id} (postpull)", content)
+        self.assertIn(f"babette: build {build_id} (published)", content)
+
+    def test_events_without_template_are_left_out(self, fixtures: Fixtures) -> None:
+        method = email.EmailMethod(Settings(EMAIL_FROM="gbp@host.invalid"))
+        died = Event(name="died", machine="babette", data=fixtures.event.data)
+
+        method.send_digest([fixtures.event, died], fixtures.recipient)
+
+        # Sent as a regular (non-digest) message
+        fixtures.worker_run.assert_called_once()
+        msg = fixtures.worker_run.call_args.args[3]
+        self.assertIn("Subject: Gentoo Build Publisher: build pulled", msg)
+
+
+@given(lib.caches, lib.event, bob=lib.recipient, marduk=lib.recipient)
+@given(render_template=testkit.patch)
+@where(bob__name="bob", bob__email="bob@host.invalid")
+@where(render_template__target="gbp_notifications.methods.email.render_template")
+class EmailContentTests(lib.TestCase):
+    def test_renders_once_per_event(self, fixtures: Fixtures) -> None:
+        method = email.EmailMethod(Settings(EMAIL_FROM="gbp@host.invalid"))
+        fixtures.render_template.return_value = "This is a test"
+
+        bob_msg = method.compose(fixtures.event, fixtures.bob)
+        marduk_msg = method.compose(fixtures.event, fixtures.marduk)
+
+        fixtures.render_template.assert_called_once()
+        self.assertEqual(bob_msg.get_content(), marduk_msg.get_content())
+        self.assertEqual("bob <bob@host.invalid>", bob_msg["to"])
+        self.assertEqual("marduk <marduk@host.invalid>", marduk_msg["to"])
+
+    def test_renders_for_each_event(self, fixtures: Fixtures) -> None:
+        method = email.EmailMethod(Settings(EMAIL_FROM="gbp@host.invalid"))
+        fixtures.render_template.return_value = "This is a test"
+
+        method.compose(fixtures.event, fixtures.bob)
+        method.compose(replace(fixtures.event), fixtures.bob)
+
+        self.assertEqual(2, fixtures.render_template.call_count)
+
+    def test_renders_per_recipient_when_template_uses_recipient(
+        self, fixtures: Fixtures
+    ) -> None:
+        method = email.EmailMethod(Settings(EMAIL_FROM="gbp@host.invalid"))
+        fixtures.render_template.return_value = "This is a test"
+
+        with mock.patch.object(email, "template_uses", return_value=True):
+            method.compose(fixtures.event, fixtures.bob)
+            method.compose(fixtures.event, fixtures.marduk)
+
+        self.assertEqual(2, fixtures.render_template.call_count)
+
+
 @given(lib.event, lib.package, lib.recipient)
 class GenerateEmailContentTests(lib.TestCase):
     def test(self, fixtures: Fixtures) -> None:
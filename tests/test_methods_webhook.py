@@ -3,14 +3,21 @@
 # pylint: disable=missing-docstring
 
 import json
+import tracemalloc
+from dataclasses import asdict, replace
+from typing import Any, Callable
 from unittest import mock
 
+import orjson
 from gbp_testkit import fixtures as testkit
+from gentoo_build_publisher.types import PackageMetadata
 from unittest_fixtures import Fixtures, given, where
 
 from gbp_notifications import tasks
 from gbp_notifications.methods import webhook
+from gbp_notifications.settings import Settings
 from gbp_notifications.signals import send_event_to_recipients
+from gbp_notifications.types import Event
 
 from . import lib
 
@@ -37,6 +44,102 @@ class SendTests(lib.TestCase):
         worker_run.assert_called_once_with(tasks.send_http_request, "marduk", body)
 
 
+@given(lib.caches, testkit.environ, lib.event, worker_run=testkit.patch)
+@given(create_body=testkit.patch)
+@where(environ=ENVIRON)
+@where(worker_run__target="gentoo_build_publisher.worker.run")
+@where(create_body__target="gbp_notifications.methods.webhook.create_body")
+@where(create_body__return_value='{"this": "that"}')
+class SendBatchTests(lib.TestCase):
+    def test(self, fixtures: Fixtures) -> None:
+        fixtures.environ["GBP_NOTIFICATIONS_RECIPIENTS"] = (
+            "marduk:webhook=http://host.invalid/webhook "
+            "bob:webhook=http://other.invalid/webhook"
+        )
+        fixtures.environ["GBP_NOTIFICATIONS_SUBSCRIPTIONS"] = "*.postpull=marduk,bob"
+
+        send_event_to_recipients(fixtures.event)
+
+        fixtures.create_body.assert_called_once()
+        self.assertEqual(
+            [
+                mock.call(tasks.send_http_request, "bob", '{"this": "that"}'),
+                mock.call(tasks.send_http_request, "marduk", '{"this": "that"}'),
+            ],
+            fixtures.worker_run.call_args_list,
+        )
+
+    def test_invalid_endpoints_are_skipped(self, fixtures: Fixtures) -> None:
+        fixtures.environ["GBP_NOTIFICATIONS_RECIPIENTS"] = (
+            "marduk:webhook=http://host.invalid/webhook "
+            "bob:webhook=http://other.invalid/webhook|bogus"
+        )
+        fixtures.environ["GBP_NOTIFICATIONS_SUBSCRIPTIONS"] = "*.postpull=marduk,bob"
+
+        with self.assertLogs("gbp_notifications", "WARNING"):
+            send_event_to_recipients(fixtures.event)
+
+        fixtures.worker_run.assert_called_once_with(
+            tasks.send_http_request, "marduk", '{"this": "that"}'
+        )
+
+    def test_body_shared_with_send(self, fixtures: Fixtures) -> None:
+        method = webhook.WebhookMethod(Settings.from_environ())
+        recipients = Settings.from_environ().RECIPIENTS
+
+        method.send(fixtures.event, recipients[0])
+        method.send(fixtures.event, recipients[0])
+
+        fixtures.create_body.assert_called_once()
+        self.assertEqual(2, fixtures.worker_run.call_count)
+
+
+@given(lib.caches, testkit.environ, lib.event, worker_run=testkit.patch)
+@where(environ=ENVIRON)
+@where(worker_run__target="gentoo_build_publisher.worker.run")
+class InvalidWebhookTests(lib.TestCase):
+    def test_other_notifications_are_sent(self, fixtures: Fixtures) -> None:
+        fixtures.environ["GBP_NOTIFICATIONS_RECIPIENTS"] = (
+            "marduk:webhook=http://host.invalid/webhook|bogus "
+            "bob:email=bob@host.invalid"
+        )
+        fixtures.environ["GBP_NOTIFICATIONS_SUBSCRIPTIONS"] = "*.postpull=marduk,bob"
+
+        with self.assertLogs("gbp_notifications", "WARNING") as logs:
+            send_event_to_recipients(fixtures.event)
+
+        fixtures.worker_run.assert_called_once()
+        self.assertIs(tasks.sendmail, fixtures.worker_run.call_args[0][0])
+        self.assertIn(
+            "WARNING:gbp_notifications.methods.webhook:No valid webhook for marduk."
+            " Skipping",
+            logs.output,
+        )
+
+
+@given(lib.caches, testkit.environ, lib.event, worker_run=testkit.patch)
+@where(environ=ENVIRON)
+@where(worker_run__target="gentoo_build_publisher.worker.run")
+class SendDigestTests(lib.TestCase):
+    def test(self, fixtures: Fixtures) -> None:
+        settings = Settings.from_environ()
+        method = webhook.WebhookMethod(settings)
+        published = Event(name="published", machine="babette", data=fixtures.event.data)
+        [recipient] = settings.RECIPIENTS
+
+        method.send_digest([fixtures.event, published], recipient)
+
+        fixtures.worker_run.assert_called_once()
+        func, name, body = fixtures.worker_run.call_args.args
+        self.assertIs(tasks.send_http_request, func)
+        self.assertEqual("marduk", name)
+        payloads = json.loads(body)
+        self.assertEqual(["postpull", "published"], [p["name"] for p in payloads])
+        self.assertEqual(
+            json.loads(webhook.create_body(fixtures.event, recipient)), payloads[0]
+        )
+
+
 @given(lib.event, recipient=testkit.patch)
 class CreateBodyTests(lib.TestCase):
     def test(self, fixtures: Fixtures) -> None:
@@ -60,3 +163,45 @@ class CreateBodyTests(lib.TestCase):
             },
         }
         self.assertEqual(expected, json.loads(body))
+
+
+def asdict_body(event: Event) -> str:
+    """The (previous) asdict()-based implementation of create_body(). For comparison"""
+    event_dict = asdict(event)
+    build = event_dict["data"]["build"]
+    event_dict["data"]["build"] = {
+        k: v for k, v in build.items() if k in webhook.WANTED_FIELDS
+    }
+    return orjson.dumps(event_dict).decode("utf8")  # pylint: disable=no-member
+
+
+def peak_allocation(func: Callable[[], Any]) -> int:
+    """Return the peak memory allocation of calling func"""
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return peak
+
+
+@given(lib.event, lib.package, recipient=testkit.patch)
+class CreateBodyAllocationTests(lib.TestCase):
+    def test(self, fixtures: Fixtures) -> None:
+        logs = "x" * 5_000_000
+        build = replace(fixtures.build_record, logs=logs, note=logs)
+        packages = PackageMetadata(total=2000, size=0, built=[fixtures.package] * 2000)
+        gbp_metadata = replace(fixtures.gbp_metadata, packages=packages)
+        event = replace(
+            fixtures.event, data={"build": build, "gbp_metadata": gbp_metadata}
+        )
+        body = webhook.create_body(event, fixtures.recipient)
+
+        peak = peak_allocation(lambda: webhook.create_body(event, fixtures.recipient))
+        asdict_peak = peak_allocation(lambda: asdict_body(event))
+
+        # The body is built, encoded and decoded. Nothing else of note is allocated
+        self.assertLess(peak, 3 * len(body))
+        self.assertLess(peak, asdict_peak)
@@ -0,0 +1,250 @@
+"""Tests for the metrics module"""
+
+# pylint: disable=missing-docstring,unused-argument
+from pathlib import Path
+
+import requests
+from django.urls import reverse
+from gbp_testkit import fixtures as testkit
+from unittest_fixtures import Fixtures, given, where
+
+from gbp_notifications import metrics, tasks
+from gbp_notifications.delivery import Delivery
+from gbp_notifications.metrics import Counter, Histogram, MetricsStore, Registry
+from gbp_notifications.outbox import Outbox, drain
+from gbp_notifications.settings import Settings
+from gbp_notifications.signals import send_event_to_recipients
+
+from . import lib
+
+
+class RegistryTests(lib.TestCase):
+    def test_counter(self) -> None:
+        registry = Registry()
+        counter = registry.counter("things_total", "Things", ["kind"])
+
+        counter.inc(kind="a")
+        counter.inc(2, kind="a")
+        counter.inc(kind="b")
+
+        self.assertEqual(3, counter.value(kind="a"))
+        self.assertEqual(0, counter.value(kind="c"))
+        self.assertIs(counter, registry.counter("things_total", "Things", ["kind"]))
+
+        with self.assertRaises(ValueError):
+            counter.inc(color="red")
+
+        with self.assertRaises(ValueError):
+            registry.histogram("things_total", "Things")
+
+    def test_histogram(self) -> None:
+        registry = Registry()
+        histogram = registry.histogram("size", "Sizes", buckets=[1, 10])
+
+        for value in [0.5, 1, 5, 50]:
+            histogram.observe(value)
+
+        self.assertEqual(4, histogram.count())
+        self.assertEqual(56.5, histogram.sum())
+
+    def test_render(self) -> None:
+        registry = Registry()
+        registry.counter("things_total", "Things", ["kind"]).inc(kind='a"b')
+        histogram = registry.histogram("size", "Sizes", buckets=[1, 10])
+        histogram.observe(0.5)
+        histogram.observe(5)
+        histogram.observe(50)
+
+        self.assertEqual(
+            """\
+# HELP size Sizes
+# TYPE size histogram
+size_bucket{le="1.0"} 1.0
+size_bucket{le="10.0"} 2.0
+size_bucket{le="+Inf"} 3.0
+size_sum 55.5
+size_count 3.0
+# HELP things_total Things
+# TYPE things_total counter
+things_total{kind="a\\"b"} 1.0
+""",
+            registry.render(),
+        )
+
+    def test_reset(self) -> None:
+        registry = Registry()
+        counter = registry.counter("things_total", "Things")
+        counter.inc()
+
+        registry.reset()
+
+        self.assertEqual(0, counter.value())
+        self.assertIs(counter, registry.get("things_total"))
+
+
+def process_registry() -> tuple[Registry, Counter, Histogram]:
+    registry = Registry()
+    counter = registry.counter("things_total", "Things", ["kind"])
+    histogram = registry.histogram("size", "Sizes", buckets=[1, 10])
+
+    return registry, counter, histogram
+
+
+@given(testkit.tmpdir)
+class MetricsStoreTests(lib.TestCase):
+    def store(self, fixtures: Fixtures) -> MetricsStore:
+        store = MetricsStore(str(Path(fixtures.tmpdir, "metrics.sqlite")))
+        self.addCleanup(store.close)
+
+        return store
+
+    def test_aggregates_processes(self, fixtures: Fixtures) -> None:
+        store = self.store(fixtures)
+        registry1, counter1, histogram1 = process_registry()
+        registry2, counter2, histogram2 = process_registry()
+        counter1.inc(kind="a")
+        counter2.inc(2, kind="a")
+        counter2.inc(kind="b")
+        histogram1.observe(0.5)
+        histogram2.observe(50)
+
+        registry1.flush(store)
+        registry2.flush(store)
+
+        aggregated = registry1.aggregate(store)
+        counter = aggregated.get("things_total")
+        histogram = aggregated.get("size")
+        assert isinstance(counter, Counter) and isinstance(histogram, Histogram)
+        self.assertEqual(3, counter.value(kind="a"))
+        self.assertEqual(1, counter.value(kind="b"))
+        self.assertEqual(2, histogram.count())
+        self.assertEqual(50.5, histogram.sum())
+        self.assertEqual(1, counter1.value(kind="a"))
+
+    def test_flush_adds_what_changed(self, fixtures: Fixtures) -> None:
+        store = self.store(fixtures)
+        registry, counter, _ = process_registry()
+        counter.inc(kind="a")
+        registry.flush(store)
+        registry.flush(store)
+        counter.inc(kind="a")
+        registry.flush(store)
+
+        self.assertEqual({"things_total": {("a",): [2.0]}}, store.load())
+
+        registry.reset()
+        counter.inc(kind="a")
+        registry.flush(store)
+
+        self.assertEqual({"things_total": {("a",): [3.0]}}, store.load())
+
+    def test_forked_child_flushes_its_own_values(self, fixtures: Fixtures) -> None:
+        store = self.store(fixtures)
+        registry, counter, _ = process_registry()
+        counter.inc(kind="a")
+
+        # What the child does after os.fork(). The parent flushes the inherited values
+        registry.mark_flushed()
+        counter.inc(kind="b")
+        registry.flush(store)
+
+        self.assertEqual({"things_total": {("b",): [1.0]}}, store.load())
+
+
+@given(lib.caches, testkit.environ, lib.event, worker_run=testkit.patch)
+@where(worker_run__target="gentoo_build_publisher.worker.run")
+class DispatchMetricsTests(lib.TestCase):
+    def test(self, fixtures: Fixtures) -> None:
+        send_event_to_recipients(fixtures.event)
+
+        self.assertEqual(1, metrics.EVENTS.value(machine="babette", event="postpull"))
+        self.assertEqual(1, metrics.RECIPIENTS.value(method="email"))
+        self.assertEqual(1, metrics.DISPATCH_SECONDS.count())
+        self.assertEqual(1, metrics.RENDER_SECONDS.count(template="email_postpull.eml"))
+        self.assertEqual(1, metrics.PAYLOAD_BYTES.count(task="sendmail"))
+        self.assertGreater(metrics.PAYLOAD_BYTES.sum(task="sendmail"), 100)
+
+
+@given(lib.caches, testkit.environ, testkit.tmpdir, post=testkit.patch)
+@where(
+    environ={
+        **lib.ENVIRON,
+        "GBP_NOTIFICATIONS_RECIPIENTS": "marduk:webhook=http://host.invalid/webhook",
+    }
+)
+@where(post__target="requests.Session.post")
+class SendMetricsTests(lib.TestCase):
+    def test_send_latency(self, fixtures: Fixtures) -> None:
+        tasks.send_http_request("marduk", "{}")
+
+        self.assertEqual(1, metrics.SEND_SECONDS.count(method="webhook"))
+
+    def test_failures(self, fixtures: Fixtures) -> None:
+        fixtures.post.side_effect = requests.ConnectionError()
+
+        with self.assertRaises(requests.ConnectionError):
+            tasks.send_http_request("marduk", "{}")
+
+        self.assertEqual(
+            1, metrics.FAILURES.value(method="webhook", error="ConnectionError")
+        )
+
+    def test_flushed_by_the_worker(self, fixtures: Fixtures) -> None:
+        path = str(Path(fixtures.tmpdir, "metrics.sqlite"))
+        fixtures.environ["GBP_NOTIFICATIONS_METRICS_DB"] = path
+
+        tasks.send_http_request("marduk", "{}")
+
+        store = MetricsStore(path)
+        self.addCleanup(store.close)
+        [values] = store.load()[metrics.SEND_SECONDS.name].values()
+        self.assertEqual(1, sum(values[:-1]))
+
+
+@given(lib.caches, testkit.tmpdir, clock=testkit.patch)
+@where(clock__target="time.time")
+class QueueMetricsTests(lib.TestCase):
+    def test(self, fixtures: Fixtures) -> None:
+        outbox = Outbox(str(Path(fixtures.tmpdir, "outbox.sqlite")))
+        self.addCleanup(outbox.close)
+        fixtures.clock.return_value = 1000.0
+        outbox.append([("x", Delivery(func=str, args=("x",)))])
+        fixtures.clock.return_value = 1002.5
+
+        drain(outbox, Settings())
+
+        self.assertEqual(2.5, metrics.QUEUE_SECONDS.sum(task="str"))
+
+
+@given(lib.caches, testkit.environ, testkit.tmpdir)
+class MetricsViewTests(lib.TestCase):
+    def test_all_processes(self, fixtures: Fixtures) -> None:
+        path = str(Path(fixtures.tmpdir, "metrics.sqlite"))
+        fixtures.environ["GBP_NOTIFICATIONS_METRICS_DB"] = path
+        store = MetricsStore(path)
+        self.addCleanup(store.close)
+        worker = Registry()
+        worker.register(metrics.EVENTS.clone()).inc(machine="babette", event="postpull")
+        worker.flush(store)
+        metrics.EVENTS.inc(machine="babette", event="postpull")
+
+        response = self.client.get(reverse("gbp-notifications-metrics"))
+
+        self.assertIn(
+            'gbp_notifications_events_total{machine="babette",event="postpull"} 2.0',
+            response.content.decode(),
+        )
+
+    def test(self, fixtures: Fixtures) -> None:
+        metrics.EVENTS.inc(machine="babette", event="postpull")
+
+        response = self.client.get(reverse("gbp-notifications-metrics"))
+
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(
+            response["Content-Type"].startswith("text/plain; version=0.0.4")
+        )
+        self.assertIn(
+            'gbp_notifications_events_total{machine="babette",event="postpull"} 1.0',
+            response.content.decode(),
+        )
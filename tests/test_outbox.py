@@ -0,0 +1,294 @@
+"""Tests for the outbox module"""
+
+# pylint: disable=missing-docstring,unused-argument
+import time
+from dataclasses import replace
+from pathlib import Path
+from unittest import mock
+
+from gbp_testkit import fixtures as testkit
+from unittest_fixtures import Fixtures, given, where
+
+from gbp_notifications import tasks
+from gbp_notifications.delivery import Delivery
+from gbp_notifications.outbox import Outbox, drain
+from gbp_notifications.settings import Settings
+from gbp_notifications.signals import send_event_to_recipients
+
+from . import lib
+
+
+def delivery(to: str) -> Delivery:
+    return Delivery(
+        func=tasks.sendmail, args=("from", [to], "msg"), destination="smtp.invalid"
+    )
+
+
+def keyed(*tos: str) -> list[tuple[str, Delivery]]:
+    return [(to, delivery(to)) for to in tos]
+
+
+@given(testkit.tmpdir, clock=testkit.patch)
+@where(clock__target="time.time", clock__return_value=1000.0)
+class OutboxTests(lib.TestCase):
+    def outbox(self, fixtures: Fixtures) -> Outbox:
+        outbox = Outbox(str(Path(fixtures.tmpdir, "outbox.sqlite")))
+        self.addCleanup(outbox.close)
+
+        return outbox
+
+    def test_append_and_claim(self, fixtures: Fixtures) -> None:
+        outbox = self.outbox(fixtures)
+
+        self.assertEqual(3, outbox.append(keyed("a", "b", "c")))
+        self.assertEqual(3, outbox.pending())
+
+        entries = outbox.claim(2, 60)
+
+        self.assertEqual([delivery("a"), delivery("b")], [e.delivery for e in entries])
+        self.assertEqual([delivery("c")], [e.delivery for e in outbox.claim(2, 60)])
+        self.assertEqual([], outbox.claim(2, 60))
+
+        outbox.done(entries)
+        self.assertEqual(1, outbox.pending())
+
+    def test_append_is_idempotent(self, fixtures: Fixtures) -> None:
+        outbox = self.outbox(fixtures)
+        outbox.append(keyed("a"))
+
+        self.assertEqual(0, outbox.append(keyed("a")))
+
+        outbox.done(outbox.claim(10, 60))
+
+        self.assertEqual(0, outbox.append(keyed("a")))
+        self.assertEqual(0, outbox.pending())
+
+    def test_same_content_different_keys(self, fixtures: Fixtures) -> None:
+        outbox = self.outbox(fixtures)
+        outbox.append([("first", delivery("a"))])
+        outbox.done(outbox.claim(10, 60))
+
+        self.assertEqual(1, outbox.append([("second", delivery("a"))]))
+        self.assertEqual(1, outbox.pending())
+
+    def test_expired_leases_are_claimed_again(self, fixtures: Fixtures) -> None:
+        outbox = self.outbox(fixtures)
+        outbox.append(keyed("a"))
+        [first] = outbox.claim(10, 60)
+        self.assertEqual([], outbox.claim(10, 60))
+
+        fixtures.clock.return_value = 1061.0
+        [second] = outbox.claim(10, 60)
+
+        # The first drainer lost its lease, so it can't mark the entry done
+        outbox.done([first])
+        self.assertEqual(1, outbox.pending())
+
+        outbox.done([second])
+        self.assertEqual(0, outbox.pending())
+
+    def test_shared_between_processes(self, fixtures: Fixtures) -> None:
+        outbox1 = self.outbox(fixtures)
+        outbox2 = self.outbox(fixtures)
+        outbox1.append(keyed("a", "b"))
+
+        self.assertEqual(1, len(outbox1.claim(1, 60)))
+        self.assertEqual(1, len(outbox2.claim(10, 60)))
+        self.assertEqual([], outbox1.claim(10, 60))
+
+    def test_not_before(self, fixtures: Fixtures) -> None:
+        outbox = self.outbox(fixtures)
+        outbox.append(keyed("a"), not_before=1060.0, attempt=2)
+
+        self.assertFalse(outbox.due())
+        self.assertEqual([], outbox.claim(10, 60))
+
+        fixtures.clock.return_value = 1060.0
+        self.assertTrue(outbox.due())
+        [entry] = outbox.claim(10, 60)
+        self.assertEqual(2, entry.attempt)
+
+    def test_defer(self, fixtures: Fixtures) -> None:
+        outbox = self.outbox(fixtures)
+        outbox.append(keyed("a"))
+        [entry] = outbox.claim(10, 60)
+
+        self.assertTrue(outbox.defer(entry, 1030.0, 2))
+
+        # The deferred entry is no longer the drainer's to mark done
+        outbox.done([entry])
+        self.assertEqual(1, outbox.pending())
+        self.assertFalse(outbox.due())
+
+        fixtures.clock.return_value = 1030.0
+        [again] = outbox.claim(10, 60)
+        self.assertEqual((entry.key, 2), (again.key, again.attempt))
+        self.assertFalse(outbox.defer(entry, 1060.0, 3))
+
+    def test_due_after_lease_expires(self, fixtures: Fixtures) -> None:
+        outbox = self.outbox(fixtures)
+        outbox.append(keyed("a"))
+        outbox.claim(10, 60)
+
+        self.assertFalse(outbox.due())
+
+        fixtures.clock.return_value = 1060.0
+        self.assertTrue(outbox.due())
+
+    def test_purge(self, fixtures: Fixtures) -> None:
+        outbox = self.outbox(fixtures)
+        outbox.append(keyed("a"))
+        outbox.done(outbox.claim(10, 60))
+
+        self.assertEqual(0, outbox.purge(1000.0))
+        self.assertEqual(1, outbox.purge(1001.0))
+        self.assertEqual(1, outbox.append(keyed("a")))
+
+
+@given(lib.caches, testkit.tmpdir, sendmail=testkit.patch)
+@where(sendmail__target="gbp_notifications.connections.SMTPPool.sendmail")
+class DrainTests(lib.TestCase):
+    def test(self, fixtures: Fixtures) -> None:
+        settings = Settings(OUTBOX_BATCH_SIZE=2)
+        outbox = Outbox(str(Path(fixtures.tmpdir, "outbox.sqlite")))
+        self.addCleanup(outbox.close)
+        outbox.append(keyed("a", "b", "c"))
+        fixtures.sendmail.side_effect = [None, ValueError("boom"), None]
+
+        errors = drain(outbox, settings)
+
+        self.assertEqual(["boom"], [str(error) for error in errors])
+        self.assertEqual(3, fixtures.sendmail.call_count)
+        self.assertEqual(0, outbox.pending())
+
+        # Failed deliveries are not retried by the drainer
+        fixtures.sendmail.reset_mock()
+        self.assertEqual([], drain(outbox, settings))
+        fixtures.sendmail.assert_not_called()
+
+
+RETRY_ENVIRON = {
+    **lib.ENVIRON,
+    "GBP_NOTIFICATIONS_RECIPIENTS": "marduk:webhook=http://host.invalid/webhook",
+    "GBP_NOTIFICATIONS_RETRY_MAX_ATTEMPTS": "3",
+}
+
+
+@given(lib.caches, testkit.environ, testkit.tmpdir, post=testkit.patch)
+@where(environ=RETRY_ENVIRON)
+@where(post__target="requests.Session.post")
+class DeferTests(lib.TestCase):
+    def outbox(self, fixtures: Fixtures) -> Outbox:
+        path = str(Path(fixtures.tmpdir, "outbox.sqlite"))
+        fixtures.environ["GBP_NOTIFICATIONS_OUTBOX_DB"] = path
+        outbox = Outbox(path)
+        self.addCleanup(outbox.close)
+
+        return outbox
+
+    def test_retry_stays_in_the_outbox(self, fixtures: Fixtures) -> None:
+        outbox = self.outbox(fixtures)
+        webhook = Delivery(
+            func=tasks.send_http_request,
+            args=("marduk", "{}"),
+            destination="host.invalid",
+        )
+        outbox.append([("webhook", webhook)])
+        fixtures.post.return_value.raise_for_status.side_effect = lib.http_error(503)
+
+        with self.assertLogs("gbp_notifications.retry", "WARNING"):
+            self.assertEqual([], drain(outbox, Settings.from_environ()))
+
+        self.assertEqual(1, outbox.pending())
+        self.assertFalse(outbox.due())
+
+        with mock.patch("time.time", return_value=time.time() + 3600):
+            [entry] = outbox.claim(10, 60)
+
+        self.assertEqual(
+            ("webhook", webhook, 2), (entry.key, entry.delivery, entry.attempt)
+        )
+
+    def test_retry_of_other_delivery_is_appended(self, fixtures: Fixtures) -> None:
+        outbox = self.outbox(fixtures)
+        fixtures.post.return_value.raise_for_status.side_effect = lib.http_error(503)
+
+        with self.assertLogs("gbp_notifications.retry", "WARNING"):
+            tasks.send_http_request("marduk", "{}")
+
+        self.assertEqual(1, outbox.pending())
+
+        with mock.patch("time.time", return_value=time.time() + 3600):
+            [entry] = outbox.claim(10, 60)
+
+        self.assertEqual(2, entry.attempt)
+        self.assertEqual(("marduk", "{}"), entry.delivery.args)
+        self.assertTrue(
+            entry.key.startswith("deferred/send_http_request/host.invalid/")
+        )
+
+
+@given(lib.caches, testkit.environ, lib.event, sendmail=testkit.patch)
+@where(sendmail__target="gbp_notifications.connections.SMTPPool.sendmail")
+class SpoolTests(lib.TestCase):
+    def test_spools_then_drains(self, fixtures: Fixtures) -> None:
+        path = str(Path(fixtures.tmpdir, "outbox.sqlite"))
+        fixtures.environ["GBP_NOTIFICATIONS_OUTBOX_DB"] = path
+        fixtures.environ["GBP_NOTIFICATIONS_RECIPIENTS"] = (
+            "albert:email=marduk@host.invalid bob:email=bob@host.invalid"
+        )
+        fixtures.environ["GBP_NOTIFICATIONS_SUBSCRIPTIONS"] = (
+            "babette.postpull=albert,bob"
+        )
+
+        with mock.patch("gentoo_build_publisher.worker.run") as worker_run:
+            send_event_to_recipients(fixtures.event)
+
+        worker_run.assert_called_once_with(tasks.drain_outbox)
+        fixtures.sendmail.assert_not_called()
+        outbox = Outbox(path)
+        self.addCleanup(outbox.close)
+        self.assertEqual(2, outbox.pending())
+
+        tasks.drain_outbox()
+
+        self.assertEqual(2, fixtures.sendmail.call_count)
+        self.assertEqual(0, outbox.pending())
+
+    def test_builds_with_identical_deliveries(self, fixtures: Fixtures) -> None:
+        path = str(Path(fixtures.tmpdir, "outbox.sqlite"))
+        fixtures.environ.update(lib.PUSHOVER_ENVIRON)
+        fixtures.environ["GBP_NOTIFICATIONS_OUTBOX_DB"] = path
+        build1 = replace(fixtures.event.data["build"], build_id="1")
+        build2 = replace(fixtures.event.data["build"], build_id="2")
+        event1 = replace(fixtures.event, data={"build": build1})
+        event2 = replace(fixtures.event, data={"build": build2})
+        outbox = Outbox(path)
+        self.addCleanup(outbox.close)
+
+        with mock.patch("gentoo_build_publisher.worker.run") as worker_run:
+            send_event_to_recipients(event1)
+            [first] = outbox.claim(10, 60)
+            outbox.done([first])
+
+            # The Pushover notification of the second build is the same as the first's
+            send_event_to_recipients(event2)
+
+        [second] = outbox.claim(10, 60)
+        self.assertEqual(first.delivery, second.delivery)
+        self.assertNotEqual(first.key, second.key)
+        self.assertTrue(second.key.startswith("babette.2.postpull/"))
+        self.assertEqual(2, worker_run.call_count)
+
+    def test_drain_outbox_failures(self, fixtures: Fixtures) -> None:
+        path = str(Path(fixtures.tmpdir, "outbox.sqlite"))
+        fixtures.environ["GBP_NOTIFICATIONS_OUTBOX_DB"] = path
+        fixtures.sendmail.side_effect = ValueError("boom")
+
+        with mock.patch("gentoo_build_publisher.worker.run"):
+            send_event_to_recipients(fixtures.event)
+
+        with self.assertRaises(ExceptionGroup) as context:
+            tasks.drain_outbox()
+
+        self.assertEqual("1 outbox deliveries failed", context.exception.message)
@@ -0,0 +1,158 @@
+"""Tests for the poller module"""
+
+# pylint: disable=missing-docstring,unused-argument
+from pathlib import Path
+from unittest import mock
+
+from gbp_testkit import fixtures as testkit
+from unittest_fixtures import Fixtures, given, where
+
+from gbp_notifications import poller, tasks
+from gbp_notifications.digest import get_digest_buffer
+from gbp_notifications.outbox import get_outbox
+from gbp_notifications.settings import Settings
+
+from . import lib
+from .test_outbox import keyed
+
+
+@given(lib.caches, testkit.tmpdir, worker_run=testkit.patch)
+@where(worker_run__target="gentoo_build_publisher.worker.run")
+class PollTests(lib.TestCase):
+    def test_submits_drain_when_due(self, fixtures: Fixtures) -> None:
+        settings = Settings(OUTBOX_DB=str(Path(fixtures.tmpdir, "outbox.sqlite")))
+        get_outbox(settings).append(keyed("a"))
+
+        poller.poll(settings)
+
+        fixtures.worker_run.assert_called_once_with(tasks.drain_outbox)
+
+    def test_nothing_due(self, fixtures: Fixtures) -> None:
+        settings = Settings(OUTBOX_DB=str(Path(fixtures.tmpdir, "outbox.sqlite")))
+        get_outbox(settings).append(keyed("a"), not_before=2e9)
+
+        poller.poll(settings)
+
+        fixtures.worker_run.assert_not_called()
+
+    def test_only_the_elected_poller_submits(self, fixtures: Fixtures) -> None:
+        settings = Settings(OUTBOX_DB=str(Path(fixtures.tmpdir, "outbox.sqlite")))
+        get_outbox(settings).append(keyed("a"))
+        other = poller.Election(settings.OUTBOX_DB)
+        self.addCleanup(other.close)
+
+        with mock.patch("os.getpid", return_value=-1):
+            self.assertTrue(other.elected(90))
+        poller.poll(settings)
+
+        fixtures.worker_run.assert_not_called()
+
+        # The lease expires
+        with mock.patch("time.time", return_value=2e9):
+            poller.poll(settings)
+
+        fixtures.worker_run.assert_called_once_with(tasks.drain_outbox)
+
+    def test_nothing_to_poll(self, fixtures: Fixtures) -> None:
+        poller.poll(Settings())
+
+        fixtures.worker_run.assert_not_called()
+
+    def test_submits_flush_when_digests_are_due(self, fixtures: Fixtures) -> None:
+        settings = Settings(
+            DIGEST_WINDOW=60,
+            DIGEST_MAX_EVENTS=1,
+            DIGEST_DB=str(Path(fixtures.tmpdir, "digests.sqlite")),
+        )
+        get_digest_buffer(settings).store.add("email", ["bob"], "event")
+
+        poller.poll(settings)
+
+        fixtures.worker_run.assert_called_once_with(tasks.flush_digests)
+
+    def test_flushes_digests_in_memory(self, fixtures: Fixtures) -> None:
+        settings = Settings(DIGEST_WINDOW=60, DIGEST_MAX_EVENTS=1)
+        buffer = get_digest_buffer(settings)
+        buffer.store.add("email", ["bob"], "event")
+
+        with mock.patch.object(buffer, "flush") as flush:
+            poller.poll(settings)
+
+        flush.assert_called_once_with()
+        fixtures.worker_run.assert_not_called()
+
+
+@given(lib.caches, testkit.environ, testkit.tmpdir, sleep=testkit.patch)
+@where(sleep__target="gbp_notifications.poller.time.sleep")
+class RunTests(lib.TestCase):
+    def test_polls_while_there_is_something_to_poll(self, fixtures: Fixtures) -> None:
+        fixtures.environ["GBP_NOTIFICATIONS_OUTBOX_DB"] = str(
+            Path(fixtures.tmpdir, "outbox.sqlite")
+        )
+        fixtures.environ["GBP_NOTIFICATIONS_POLL_INTERVAL"] = "5"
+
+        def sleep(seconds: float) -> None:
+            del fixtures.environ["GBP_NOTIFICATIONS_OUTBOX_DB"]
+            Settings.cache_clear()
+
+        fixtures.sleep.side_effect = sleep
+
+        with mock.patch.object(poller, "poll", side_effect=OSError) as poll:
+            with self.assertLogs("gbp_notifications.poller", "ERROR"):
+                poller.run()
+
+        poll.assert_called_once()
+        fixtures.sleep.assert_called_once_with(5)
+
+    def test_nothing_to_poll(self, fixtures: Fixtures) -> None:
+        poller.run()
+
+        fixtures.sleep.assert_not_called()
+
+
+@given(testkit.tmpdir)
+class ElectionTests(lib.TestCase):
+    def test_lease(self, fixtures: Fixtures) -> None:
+        path = str(Path(fixtures.tmpdir, "outbox.sqlite"))
+        this, other = poller.Election(path), poller.Election(path)
+        self.addCleanup(this.close)
+        self.addCleanup(other.close)
+
+        with mock.patch("time.time", return_value=1000.0):
+            self.assertTrue(this.elected(90))
+            self.assertTrue(this.elected(90))
+
+            with mock.patch("os.getpid", return_value=-1):
+                self.assertFalse(other.elected(90))
+
+        with mock.patch("time.time", return_value=1090.0):
+            with mock.patch("os.getpid", return_value=-1):
+                self.assertTrue(other.elected(90))
+
+            self.assertFalse(this.elected(90))
+
+
+class EnabledTests(lib.TestCase):
+    def test(self) -> None:
+        self.assertFalse(poller.enabled({}))
+        self.assertFalse(poller.enabled({"GBP_NOTIFICATIONS_DIGEST_WINDOW": "0"}))
+        self.assertFalse(poller.enabled({"GBP_NOTIFICATIONS_DIGEST_WINDOW": "bogus"}))
+        self.assertTrue(poller.enabled({"GBP_NOTIFICATIONS_DIGEST_WINDOW": "60"}))
+        self.assertTrue(poller.enabled({"GBP_NOTIFICATIONS_OUTBOX_DB": "outbox.db"}))
+
+
+@given(thread=testkit.patch)
+@where(thread__target="gbp_notifications.poller.threading.Thread")
+class StartTests(lib.TestCase):
+    def test_starts_one_thread(self, fixtures: Fixtures) -> None:
+        fixtures.thread.return_value.is_alive.return_value = True
+        self.addCleanup(setattr, poller, "_thread", None)
+        poller._thread = None  # pylint: disable=protected-access
+
+        poller.start()
+        poller.start()
+
+        fixtures.thread.assert_called_once_with(
+            target=poller.run, name="gbp-notifications-poller", daemon=True
+        )
+        fixtures.thread.return_value.start.assert_called_once_with()
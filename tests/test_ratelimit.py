@@ -0,0 +1,191 @@
+"""Tests for the ratelimit module"""
+
+# pylint: disable=missing-docstring,unused-argument
+from pathlib import Path
+from unittest import mock
+
+from gbp_testkit import fixtures as testkit
+from unittest_fixtures import Fixtures, given, where
+
+from gbp_notifications import tasks
+from gbp_notifications.deadletters import get_dead_letter_store
+from gbp_notifications.exceptions import RateLimitedError
+from gbp_notifications.outbox import get_outbox
+from gbp_notifications.ratelimit import (
+    Rate,
+    RateLimiter,
+    RateLimitStore,
+    parse_rate_limits,
+)
+from gbp_notifications.settings import Settings
+
+from . import lib
+
+
+class RateTests(lib.TestCase):
+    def test_from_string(self) -> None:
+        self.assertEqual(Rate(tokens=10, period=60), Rate.from_string("10/m"))
+        self.assertEqual(2.0, Rate.from_string("2/s").per_second)
+
+    def test_invalid(self) -> None:
+        for string in ["10", "0/s", "10/d", "x/s"]:
+            with self.subTest(string=string), self.assertRaises(ValueError):
+                Rate.from_string(string)
+
+    def test_parse_rate_limits(self) -> None:
+        self.assertEqual(
+            {
+                "method:email": Rate(tokens=10, period=60),
+                "method:pushover": Rate(tokens=1, period=1),
+            },
+            parse_rate_limits("email=10/m pushover=1/s", "method"),
+        )
+
+        with self.assertRaises(ValueError):
+            parse_rate_limits("email", "method")
+
+    def test_settings(self) -> None:
+        settings = Settings(
+            METHOD_RATE_LIMITS="email=10/m", DESTINATION_RATE_LIMITS="h.invalid=1/s"
+        )
+
+        self.assertEqual(
+            {
+                "method:email": Rate(tokens=10, period=60),
+                "destination:h.invalid": Rate(tokens=1, period=1),
+            },
+            settings.rate_limits,
+        )
+
+        with self.assertLogs("gbp_notifications.settings", "ERROR"):
+            settings = Settings(METHOD_RATE_LIMITS="email=often pushover=1/s")
+
+        self.assertEqual(
+            {"method:pushover": Rate(tokens=1, period=1)}, settings.rate_limits
+        )
+
+
+@given(sleep=testkit.patch, clock=testkit.patch)
+@where(sleep__target="time.sleep", clock__target="time.time")
+@where(clock__return_value=1000.0)
+class RateLimiterTests(lib.TestCase):
+    def test_burst_then_wait(self, fixtures: Fixtures) -> None:
+        limiter = RateLimiter({"method:email": Rate(tokens=2, period=1)})
+
+        self.assertEqual(0, limiter.acquire("method:email"))
+        self.assertEqual(0, limiter.acquire("method:email"))
+        self.assertAlmostEqual(0.5, limiter.acquire("method:email"))
+
+        fixtures.clock.return_value = 1000.5
+        self.assertEqual(0, limiter.acquire("method:email"))
+        fixtures.sleep.assert_not_called()
+
+    def test_unlimited_keys(self, fixtures: Fixtures) -> None:
+        limiter = RateLimiter({"method:email": Rate(tokens=1, period=1)})
+
+        for _ in range(5):
+            self.assertEqual(
+                0, limiter.acquire("method:webhook", "destination:h.invalid")
+            )
+
+    def test_gives_back_tokens_when_limited(self, fixtures: Fixtures) -> None:
+        limiter = RateLimiter(
+            {
+                "method:email": Rate(tokens=2, period=1),
+                "destination:h.invalid": Rate(tokens=1, period=60),
+            }
+        )
+
+        self.assertEqual(0, limiter.acquire("method:email", "destination:h.invalid"))
+        self.assertAlmostEqual(
+            60, limiter.acquire("method:email", "destination:h.invalid")
+        )
+
+        # The email token taken by the limited acquire was given back
+        self.assertEqual(0, limiter.acquire("method:email"))
+        self.assertNotEqual(0, limiter.acquire("method:email"))
+
+
+@given(testkit.tmpdir)
+class RateLimitStoreTests(lib.TestCase):
+    def test_shared_between_limiters(self, fixtures: Fixtures) -> None:
+        path = str(Path(fixtures.tmpdir, "ratelimit.sqlite"))
+        rate = Rate(tokens=2, period=60)
+        store1 = RateLimitStore(path)
+        store2 = RateLimitStore(path)
+
+        self.assertEqual(0, store1.take("method:email", rate, 1000.0))
+        self.assertEqual(0, store2.take("method:email", rate, 1000.0))
+        self.assertAlmostEqual(30.0, store1.take("method:email", rate, 1000.0))
+        self.assertEqual(0, store2.take("method:email", rate, 1030.0))
+
+        store1.give("method:email", rate)
+        self.assertEqual(0, store2.take("method:email", rate, 1030.0))
+
+        store1.close()
+        store2.close()
+
+
+@given(
+    lib.caches, testkit.environ, testkit.tmpdir, post=testkit.patch, sleep=testkit.patch
+)
+@where(
+    environ={
+        **lib.ENVIRON,
+        "GBP_NOTIFICATIONS_RECIPIENTS": "marduk:webhook=http://host.invalid/webhook",
+        "GBP_NOTIFICATIONS_DESTINATION_RATE_LIMITS": "host.invalid=1/h",
+    }
+)
+@where(post__target="requests.Session.post", sleep__target="time.sleep")
+class ThrottleTests(lib.TestCase):
+    def test_webhook_requests_are_throttled(self, fixtures: Fixtures) -> None:
+        fixtures.environ["GBP_NOTIFICATIONS_DESTINATION_RATE_LIMITS"] = (
+            "host.invalid=6/m"
+        )
+        with mock.patch("time.time", return_value=1000.0):
+            for _ in range(6):
+                tasks.send_http_request("marduk", "{}")
+        fixtures.sleep.assert_not_called()
+
+        with mock.patch("time.time", side_effect=[1000.0, 1010.0]):
+            tasks.send_http_request("marduk", "{}")
+
+        fixtures.sleep.assert_called_once_with(10.0)
+        self.assertEqual(7, fixtures.post.call_count)
+
+    def test_long_waits_fail(self, fixtures: Fixtures) -> None:
+        fixtures.environ["GBP_NOTIFICATIONS_DEAD_LETTER_DB"] = str(
+            Path(fixtures.tmpdir, "deadletters.sqlite")
+        )
+        tasks.send_http_request("marduk", "{}")
+
+        with (
+            mock.patch("time.time", return_value=1000.0),
+            self.assertRaises(RateLimitedError),
+        ):
+            tasks.send_http_request("marduk", "{}")
+
+        fixtures.sleep.assert_not_called()
+        fixtures.post.assert_called_once()
+        [letter] = get_dead_letter_store(Settings.from_environ()).find()
+        self.assertEqual("host.invalid", letter.destination)
+
+    def test_limited_requests_are_deferred(self, fixtures: Fixtures) -> None:
+        fixtures.environ["GBP_NOTIFICATIONS_OUTBOX_DB"] = str(
+            Path(fixtures.tmpdir, "outbox.sqlite")
+        )
+        tasks.send_http_request("marduk", "{}")
+
+        with mock.patch("time.time", return_value=1000.0):
+            tasks.send_http_request("marduk", "{}")
+
+        fixtures.sleep.assert_not_called()
+        fixtures.post.assert_called_once()
+        outbox = get_outbox(Settings.from_environ())
+        self.assertEqual(1, outbox.pending())
+
+        with mock.patch("time.time", return_value=4600.0):
+            [entry] = outbox.claim(10, 60)
+
+        # It's still the first attempt
+        self.assertEqual(1, entry.attempt)
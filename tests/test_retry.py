@@ -0,0 +1,210 @@
+"""Tests for the retry module"""
+
+# pylint: disable=missing-docstring,unused-argument
+import smtplib
+from unittest import mock
+
+import requests
+from gbp_testkit import fixtures as testkit
+from unittest_fixtures import Fixtures, given, where
+
+from gbp_notifications import tasks
+from gbp_notifications.delivery import Delivery, attempt_number
+from gbp_notifications.exceptions import CircuitOpenError
+from gbp_notifications.retry import (
+    CircuitBreaker,
+    RetryPolicy,
+    is_transient,
+    requested_delay,
+)
+from gbp_notifications.settings import Settings
+
+from . import lib
+
+POLICY = RetryPolicy(max_attempts=5, base_delay=10, max_delay=60)
+
+
+class RetryPolicyTests(lib.TestCase):
+    def test_delay_backs_off_with_jitter(self) -> None:
+        for attempt, low, high in [(1, 5, 10), (2, 10, 20), (3, 20, 40), (9, 30, 60)]:
+            with self.subTest(attempt=attempt):
+                delay = POLICY.delay(attempt)
+                self.assertTrue(low <= delay <= high, delay)
+
+    def test_retry_after(self) -> None:
+        self.assertEqual(7, POLICY.delay(1, 7))
+        self.assertEqual(60, POLICY.delay(1, 7200))
+
+    def test_from_string(self) -> None:
+        self.assertEqual(
+            RetryPolicy(max_attempts=3, base_delay=10, max_delay=60),
+            RetryPolicy.from_string("3", POLICY),
+        )
+        self.assertEqual(
+            RetryPolicy(max_attempts=3, base_delay=1, max_delay=60),
+            RetryPolicy.from_string("3,1", POLICY),
+        )
+        self.assertEqual(
+            RetryPolicy(max_attempts=3, base_delay=1, max_delay=2),
+            RetryPolicy.from_string("3,1,2", POLICY),
+        )
+
+        for string in ["", "0", "x", "1,2,3,4", "3,-1"]:
+            with self.subTest(string=string), self.assertRaises(ValueError):
+                RetryPolicy.from_string(string, POLICY)
+
+    def test_settings(self) -> None:
+        settings = Settings(
+            RETRY_MAX_ATTEMPTS=3, RETRY_POLICIES="email=5 webhook=10,30,3600"
+        )
+
+        self.assertEqual(3, settings.retry_policies[""].max_attempts)
+        self.assertEqual(
+            RetryPolicy(max_attempts=5, base_delay=10, max_delay=3600),
+            settings.retry_policies["email"],
+        )
+        self.assertEqual(
+            RetryPolicy(max_attempts=10, base_delay=30, max_delay=3600),
+            settings.retry_policies["webhook"],
+        )
+
+        with self.assertLogs("gbp_notifications.settings", "ERROR"):
+            settings = Settings(RETRY_POLICIES="email webhook=2")
+
+        self.assertEqual(["", "webhook"], list(settings.retry_policies))
+
+
+class IsTransientTests(lib.TestCase):
+    def test(self) -> None:
+        cases: list[tuple[Exception, bool]] = [
+            (lib.http_error(503), True),
+            (lib.http_error(429), True),
+            (lib.http_error(404), False),
+            (requests.ConnectionError(), True),
+            (requests.Timeout(), True),
+            (smtplib.SMTPResponseException(451, b"try later"), True),
+            (smtplib.SMTPAuthenticationError(535, b"denied"), False),
+            (smtplib.SMTPRecipientsRefused({"a@b": (450, b"busy")}), True),
+            (smtplib.SMTPRecipientsRefused({"a@b": (550, b"unknown")}), False),
+            (smtplib.SMTPServerDisconnected(), True),
+            (CircuitOpenError("host.invalid", 5), True),
+            (ValueError(), False),
+        ]
+
+        for error, expected in cases:
+            with self.subTest(error=error):
+                self.assertEqual(expected, is_transient(error))
+
+    def test_requested_delay(self) -> None:
+        self.assertEqual(7, requested_delay(lib.http_error(429, "7")))
+        self.assertEqual(5, requested_delay(CircuitOpenError("host.invalid", 5)))
+        self.assertIsNone(requested_delay(lib.http_error(503)))
+        self.assertIsNone(requested_delay(lib.http_error(503, "soon")))
+        self.assertIsNone(requested_delay(ValueError()))
+
+        with mock.patch("time.time", return_value=784111777.0):
+            delay = requested_delay(
+                lib.http_error(503, "Sun, 06 Nov 1994 08:50:37 GMT")
+            )
+
+        self.assertEqual(60, delay)
+
+
+@given(clock=testkit.patch)
+@where(clock__target="time.monotonic", clock__return_value=1000.0)
+class CircuitBreakerTests(lib.TestCase):
+    def test_opens_and_resets(self, fixtures: Fixtures) -> None:
+        breaker = CircuitBreaker(threshold=2, reset_timeout=30)
+
+        breaker.failure("host.invalid")
+        self.assertEqual(0, breaker.check("host.invalid"))
+
+        breaker.failure("host.invalid")
+        self.assertEqual(30, breaker.check("host.invalid"))
+        self.assertEqual(0, breaker.check("other.invalid"))
+
+        # After the reset timeout a single delivery is let through
+        fixtures.clock.return_value = 1030.0
+        self.assertEqual(0, breaker.check("host.invalid"))
+        self.assertEqual(30, breaker.check("host.invalid"))
+
+        # ...and if it fails the circuit opens again
+        breaker.failure("host.invalid")
+        self.assertEqual(30, breaker.check("host.invalid"))
+
+        breaker.success("host.invalid")
+        self.assertEqual(0, breaker.check("host.invalid"))
+
+    def test_disabled(self, fixtures: Fixtures) -> None:
+        breaker = CircuitBreaker(threshold=0, reset_timeout=30)
+
+        for _ in range(10):
+            breaker.failure("host.invalid")
+
+        self.assertEqual(0, breaker.check("host.invalid"))
+
+
+RETRY_ENVIRON = {
+    **lib.ENVIRON,
+    "GBP_NOTIFICATIONS_RECIPIENTS": "marduk:webhook=http://host.invalid/webhook",
+    "GBP_NOTIFICATIONS_RETRY_MAX_ATTEMPTS": "3",
+}
+
+
+@given(lib.caches, testkit.environ, post=testkit.patch, defer=testkit.patch)
+@where(environ=RETRY_ENVIRON)
+@where(post__target="requests.Session.post")
+@where(defer__target="gbp_notifications.retry.defer", defer__return_value=True)
+class RetryingTests(lib.TestCase):
+    def test_transient_failure_is_deferred(self, fixtures: Fixtures) -> None:
+        fixtures.post.return_value.raise_for_status.side_effect = lib.http_error(
+            503, "7"
+        )
+
+        with self.assertLogs("gbp_notifications.retry", "WARNING"):
+            tasks.send_http_request("marduk", "{}")
+
+        delivery = Delivery(
+            func=tasks.send_http_request,
+            args=("marduk", "{}"),
+            destination="host.invalid",
+        )
+        fixtures.defer.assert_called_once_with(mock.ANY, delivery, 7, attempt=2)
+
+    def test_last_attempt_raises(self, fixtures: Fixtures) -> None:
+        fixtures.post.return_value.raise_for_status.side_effect = lib.http_error(503)
+
+        with self.assertRaises(requests.HTTPError), attempt_number(3):
+            tasks.send_http_request("marduk", "{}")
+
+        fixtures.defer.assert_not_called()
+
+    def test_permanent_failure_raises(self, fixtures: Fixtures) -> None:
+        fixtures.post.return_value.raise_for_status.side_effect = lib.http_error(404)
+
+        with self.assertRaises(requests.HTTPError):
+            tasks.send_http_request("marduk", "{}")
+
+        fixtures.defer.assert_not_called()
+
+    def test_no_outbox_raises(self, fixtures: Fixtures) -> None:
+        fixtures.post.return_value.raise_for_status.side_effect = lib.http_error(503)
+        fixtures.defer.return_value = False
+
+        with self.assertRaises(requests.HTTPError):
+            with self.assertLogs("gbp_notifications.retry", "WARNING") as logs:
+                tasks.send_http_request("marduk", "{}")
+
+        self.assertIn("OUTBOX_DB is not set", logs.output[0])
+
+    def test_open_circuit_skips_delivery(self, fixtures: Fixtures) -> None:
+        fixtures.environ["GBP_NOTIFICATIONS_CIRCUIT_BREAKER_THRESHOLD"] = "1"
+        fixtures.post.return_value.raise_for_status.side_effect = lib.http_error(503)
+
+        with self.assertLogs("gbp_notifications.retry", "WARNING"):
+            tasks.send_http_request("marduk", "{}")
+            tasks.send_http_request("marduk", "{}")
+
+        fixtures.post.assert_called_once()
+        self.assertEqual(2, fixtures.defer.call_count)
+        self.assertAlmostEqual(60, fixtures.defer.call_args.args[2], delta=1)
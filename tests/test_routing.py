@@ -0,0 +1,139 @@
+"""Tests for the routing module"""
+
+# pylint: disable=missing-docstring,unused-argument
+from unittest import mock
+
+from unittest_fixtures import Fixtures, given, where
+
+from gbp_notifications.methods import MethodInstances, register_method
+from gbp_notifications.methods.email import EmailMethod
+from gbp_notifications.routing import (
+    RoutingTable,
+    clear_routing_table,
+    get_routing_table,
+)
+from gbp_notifications.settings import Settings
+from gbp_notifications.types import Event, Recipient, Subscription
+
+from . import lib
+
+
+def make_settings(subs: str, *recipients: Recipient) -> Settings:
+    return Settings(
+        RECIPIENTS=recipients, SUBSCRIPTIONS=Subscription.from_string(subs, recipients)
+    )
+
+
+class ManagedMethod:
+    def __init__(self, settings: Settings) -> None:
+        self.settings = settings
+        self.calls: list[str] = []
+
+    def send(self, event: Event, recipient: Recipient) -> None:
+        self.calls.append("send")
+
+    def open(self) -> None:
+        self.calls.append("open")
+
+    def close(self) -> None:
+        self.calls.append("close")
+
+
+@given(lib.caches, bob=lib.recipient, marduk=lib.recipient)
+@where(bob__name="bob", bob__email="bob@host.invalid")
+class RoutingTableTests(lib.TestCase):
+    def test_routes(self, fixtures: Fixtures) -> None:
+        bob = fixtures.bob
+        marduk = fixtures.marduk
+        settings = make_settings(
+            "babette.postpull=bob,marduk *.published=bob", bob, marduk
+        )
+        table = RoutingTable(settings)
+
+        [(method, recipients)] = table.routes(Event(name="postpull", machine="babette"))
+
+        self.assertIsInstance(method, EmailMethod)
+        self.assertEqual((bob, marduk), recipients)
+
+        [(_, recipients)] = table.routes(Event(name="published", machine="lighthouse"))
+        self.assertEqual((bob,), recipients)
+
+        self.assertEqual((), table.routes(Event(name="postpull", machine="lighthouse")))
+
+    def test_wildcards_resolve_to_single_route(self, fixtures: Fixtures) -> None:
+        bob = fixtures.bob
+        settings = make_settings("*.*=bob babette.*=bob *.postpull=bob", bob)
+        table = RoutingTable(settings)
+
+        for machine in ["babette", "lighthouse"]:
+            for name in ["postpull", "published"]:
+                [(_, recipients)] = table.routes(Event(name=name, machine=machine))
+                self.assertEqual((bob,), recipients)
+
+    def test_method_instances_are_shared(self, fixtures: Fixtures) -> None:
+        settings = make_settings(
+            "babette.postpull=bob lighthouse.postpull=marduk",
+            fixtures.bob,
+            fixtures.marduk,
+        )
+        table = RoutingTable(settings)
+
+        [(method1, _)] = table.routes(Event(name="postpull", machine="babette"))
+        [(method2, _)] = table.routes(Event(name="postpull", machine="lighthouse"))
+
+        self.assertIs(method1, method2)
+
+    def test_get_routing_table_reuses_table(self, fixtures: Fixtures) -> None:
+        settings = make_settings("babette.postpull=bob", fixtures.bob)
+
+        table = get_routing_table(settings)
+
+        self.assertIs(table, get_routing_table(settings))
+        self.assertIsNot(table, get_routing_table(Settings()))
+
+
+@given(lib.caches)
+class MethodLifecycleTests(lib.TestCase):
+    def test_instances_opened_once_and_closed_on_settings_change(
+        self, fixtures: Fixtures
+    ) -> None:
+        register_method("managed", ManagedMethod)
+        bob = Recipient(name="bob", config={"managed": "yes"})
+        marduk = Recipient(name="marduk", config={"managed": "yes"})
+        settings = make_settings("babette.postpull=bob *.published=marduk", bob, marduk)
+
+        table = get_routing_table(settings)
+        [(method1, _)] = table.routes(Event(name="postpull", machine="babette"))
+        [(method2, _)] = table.routes(Event(name="published", machine="babette"))
+
+        self.assertIs(method1, method2)
+        assert isinstance(method1, ManagedMethod)
+        self.assertEqual(["open"], method1.calls)
+
+        get_routing_table(make_settings("babette.postpull=bob", bob))
+
+        self.assertEqual(["open", "close"], method1.calls)
+
+    def test_clear_closes_instances(self, fixtures: Fixtures) -> None:
+        register_method("managed", ManagedMethod)
+        bob = Recipient(name="bob", config={"managed": "yes"})
+        table = get_routing_table(make_settings("babette.postpull=bob", bob))
+        [(method, _)] = table.routes(Event(name="postpull", machine="babette"))
+        assert isinstance(method, ManagedMethod)
+
+        clear_routing_table()
+
+        self.assertEqual(["open", "close"], method.calls)
+
+
+class MethodInstancesTests(lib.TestCase):
+    def test_close_errors_are_logged(self) -> None:
+        instances = MethodInstances(Settings())
+        method = instances.get(ManagedMethod)
+        assert isinstance(method, ManagedMethod)
+        method.close = mock.Mock(side_effect=OSError("boom"))  # type: ignore
+
+        with self.assertLogs("gbp_notifications.methods", "ERROR"):
+            instances.close()
+
+        self.assertIsNot(method, instances.get(ManagedMethod))
@@ -7,9 +7,9 @@ from pathlib import Path
 from unittest_fixtures import Fixtures, given, where
 
 from gbp_notifications.settings import Settings
-from gbp_notifications.types import Event, Subscription
+from gbp_notifications.types import Event, Recipient, Subscription
 
-from .lib import TestCase, recipient
+from .lib import TestCase, caches, recipient
 
 
 @given(bob=recipient, marduk=recipient)
@@ -41,3 +41,83 @@ babette = {pull = ["marduk", "bob"], foo = ["marduk"]}
         self.assertEqual(settings.SUBSCRIPTIONS, expected_subs)
 
         self.assertEqual(settings.RECIPIENTS, (bob, marduk))
+
+    def test_recipients_by_name(self, fixtures: Fixtures) -> None:
+        settings = Settings(RECIPIENTS=(fixtures.bob, fixtures.marduk))
+
+        index = settings.recipients_by_name
+
+        self.assertEqual({"bob": fixtures.bob, "marduk": fixtures.marduk}, index)
+        self.assertIs(fixtures.bob, index["bob"])
+        self.assertIs(index, settings.recipients_by_name)
+
+        with self.assertRaises(TypeError):
+            index["fred"] = fixtures.bob  # type: ignore[index]
+
+    def test_webhook_endpoints(self, fixtures: Fixtures) -> None:
+        recipients = Recipient.from_string(
+            "bob:email=bob@host.invalid marduk:webhook=http://host.invalid/hook"
+        )
+        settings = Settings(RECIPIENTS=recipients, REQUESTS_TIMEOUT=3)
+
+        endpoints = settings.webhook_endpoints
+
+        self.assertEqual(["marduk"], list(endpoints))
+        self.assertEqual("http://host.invalid/hook", endpoints["marduk"].url)
+        self.assertEqual(3, endpoints["marduk"].timeout)
+
+    def test_invalid_webhook_left_out_on_load(self, fixtures: Fixtures) -> None:
+        with self.assertLogs("gbp_notifications.settings", "ERROR") as logs:
+            settings = Settings.from_dict(
+                "",
+                {
+                    "RECIPIENTS": "marduk:webhook=http://host.invalid/hook|bogus"
+                    " bob:webhook=http://host.invalid/bob"
+                },
+            )
+
+        self.assertEqual(["bob"], list(settings.webhook_endpoints))
+        self.assertIn("marduk", logs.output[0])
+
+
+@given(caches)
+class FromEnvironTests(TestCase):
+    def test_returns_cached_settings(self, fixtures: Fixtures) -> None:
+        settings = Settings.from_environ()
+
+        self.assertIs(settings, Settings.from_environ())
+
+    def test_environment_change(self, fixtures: Fixtures) -> None:
+        settings = Settings.from_environ()
+        fixtures.environ["GBP_NOTIFICATIONS_EMAIL_FROM"] = "bob@host.invalid"
+
+        new_settings = Settings.from_environ()
+
+        self.assertIsNot(settings, new_settings)
+        self.assertEqual("bob@host.invalid", new_settings.EMAIL_FROM)
+
+    def test_config_file_change(self, fixtures: Fixtures) -> None:
+        config_file = Path(fixtures.tmpdir, "config.toml")
+        config_file.write_text(
+            '[recipients]\nbob = {email = "bob@host.invalid"}\n', "UTF-8"
+        )
+        fixtures.environ["GBP_NOTIFICATIONS_CONFIG_FILE"] = str(config_file)
+
+        settings = Settings.from_environ()
+        self.assertEqual(["bob"], [r.name for r in settings.RECIPIENTS])
+        self.assertIs(settings, Settings.from_environ())
+
+        config_file.write_text(
+            '[recipients]\nmarduk = {email = "m@host.invalid"}\n', "UTF-8"
+        )
+        settings = Settings.from_environ()
+
+        self.assertEqual(["marduk"], [r.name for r in settings.RECIPIENTS])
+
+    def test_cache_clear(self, fixtures: Fixtures) -> None:
+        settings = Settings.from_environ()
+
+        Settings.cache_clear()
+
+        self.assertIsNot(settings, Settings.from_environ())
+        self.assertEqual(settings, Settings.from_environ())
@@ -1,13 +1,21 @@
 """Tests for the signal handlers"""
 
 # pylint: disable=missing-docstring
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Sequence
 from unittest import mock
 
 from gbp_testkit import fixtures as testkit
 from gentoo_build_publisher.types import GBPMetadata, Package, PackageMetadata
 from unittest_fixtures import Fixtures, given, where
 
-from gbp_notifications.signals import dispatcher
+from gbp_notifications import signals
+from gbp_notifications.settings import Settings
+from gbp_notifications.signals import dispatcher, environ_events, send
+from gbp_notifications.types import Event, Recipient
 
 from . import lib
 
@@ -100,3 +108,163 @@ class HandlerTests(lib.TestCase):
         self.assertEqual(event.name, "postpull")
         self.assertEqual(event.machine, "babette")
         self.assertEqual(event.data, data)
+
+
+class BatchMethod:
+    def __init__(self, _settings: Settings) -> None:
+        self.sent: list[tuple[Event, tuple[Recipient, ...]]] = []
+
+    def send(self, event: Event, recipient: Recipient) -> None:
+        raise AssertionError("send() should not be called")
+
+    def send_batch(self, event: Event, recipients: Sequence[Recipient]) -> None:
+        self.sent.append((event, tuple(recipients)))
+
+
+@given(lib.event, bob=lib.recipient, marduk=lib.recipient)
+@where(bob__name="bob")
+class SendTests(lib.TestCase):
+    def test_send_batch(self, fixtures: Fixtures) -> None:
+        method = BatchMethod(Settings())
+        recipients = [fixtures.bob, fixtures.marduk]
+
+        send(method, fixtures.event, recipients)
+
+        self.assertEqual(
+            [(fixtures.event, (fixtures.bob, fixtures.marduk))], method.sent
+        )
+
+    def test_send(self, fixtures: Fixtures) -> None:
+        method = mock.Mock(spec=["send"])
+        recipients = [fixtures.bob, fixtures.marduk]
+
+        send(method, fixtures.event, recipients)
+
+        self.assertEqual(
+            [
+                mock.call(fixtures.event, fixtures.bob),
+                mock.call(fixtures.event, fixtures.marduk),
+            ],
+            method.send.call_args_list,
+        )
+
+
+@given(testkit.environ)
+class EnvironEventsTests(lib.TestCase):
+    def test_default(self, fixtures: Fixtures) -> None:
+        fixtures.environ.pop("GBP_NOTIFICATIONS_EVENTS", None)
+
+        self.assertEqual(Settings.from_environ().EVENTS, environ_events())
+
+    def test_from_environ(self, fixtures: Fixtures) -> None:
+        fixtures.environ["GBP_NOTIFICATIONS_EVENTS"] = "postpull  died"
+
+        self.assertEqual(Settings.from_environ().EVENTS, environ_events())
+
+
+@given(lib.caches, testkit.environ, testkit.tmpdir, lib.event, sendmail=testkit.patch)
+@where(
+    environ={
+        **lib.ENVIRON,
+        "GBP_NOTIFICATIONS_RECIPIENTS": "",
+        "GBP_NOTIFICATIONS_SUBSCRIPTIONS": "",
+    }
+)
+@where(sendmail__target="gbp_notifications.connections.SMTPPool.sendmail")
+class ConfigFileChangeTests(lib.TestCase):
+    def test_recipient_email_change(self, fixtures: Fixtures) -> None:
+        config_file = Path(fixtures.tmpdir, "config.toml")
+        config = (
+            '[recipients]\nalbert = {{email = "{}@host.invalid"}}\n'
+            '[subscriptions]\nbabette = {{postpull = ["albert"]}}\n'
+        )
+        config_file.write_text(config.format("bob"), "UTF-8")
+        fixtures.environ["GBP_NOTIFICATIONS_CONFIG_FILE"] = str(config_file)
+
+        signals.send_event_to_recipients(fixtures.event)
+
+        # Only the recipient's config changes. The (equal) Settings can't tell
+        config_file.write_text(config.format("rob"), "UTF-8")
+        os.utime(config_file, ns=(0, 0))
+        signals.send_event_to_recipients(fixtures.event)
+
+        to_addrs = [call.args[2] for call in fixtures.sendmail.call_args_list]
+        expected = [["albert <bob@host.invalid>"], ["albert <rob@host.invalid>"]]
+        self.assertEqual(expected, to_addrs)
+
+
+# Modules that should not be imported when the signal handlers are bound
+HEAVY_MODULES = {
+    "celery",
+    "gbp_notifications.settings",
+    "jinja2",
+    "orjson",
+    "requests",
+    "tomllib",
+}
+
+
+class ImportTimeTests(lib.TestCase):
+    def test_binding_handlers_does_not_import_heavy_modules(self) -> None:
+        # GBPNotificationsConfig.ready(), after GBP has imported its signals
+        code = (
+            "import sys, gentoo_build_publisher.signals;"
+            " from gbp_notifications.django.gbp_notifications import apps;"
+            " apps.GBPNotificationsConfig("
+            "'gbp_notifications.django.gbp_notifications', sys.modules[apps.__name__]"
+            ").ready();"
+            " print(*sys.modules, sep='\\n')"
+        )
+        env = {
+            name: value
+            for name, value in os.environ.items()
+            if name
+            not in {"GBP_NOTIFICATIONS_OUTBOX_DB", "GBP_NOTIFICATIONS_DIGEST_WINDOW"}
+        }
+        env["PYTHONDONTWRITEBYTECODE"] = "1"
+
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            capture_output=True,
+            check=True,
+            env=env,
+            text=True,
+        )
+        imported = importtime_modules(
+            process.stderr, after="gentoo_build_publisher.signals"
+        )
+
+        # import_module() imports aren't timed, so look for them in sys.modules
+        loaded = process.stdout.splitlines()
+        self.assertIn("gbp_notifications.signals", loaded)
+        self.assertIn("gbp_notifications.poller", loaded)
+        heavy = {
+            name
+            for name in imported
+            if name in HEAVY_MODULES or name.partition(".")[0] in HEAVY_MODULES
+        }
+        self.assertEqual(set(), heavy, imported)
+
+
+def importtime_modules(output: str, *, after: str) -> dict[str, int]:
+    """Parse the -X importtime output
+
+    Return the modules that finished importing after the given module, and their
+    cumulative import time (in microseconds).
+    """
+    modules: dict[str, int] = {}
+    found = False
+
+    for line in output.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, cumulative, name = line.split("|")
+        if not (cumulative := cumulative.strip()).isdigit():
+            continue  # header
+        name = name.strip()
+
+        if found:
+            modules[name] = int(cumulative)
+        found = found or name == after
+
+    return modules
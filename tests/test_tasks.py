@@ -2,7 +2,6 @@
 
 # pylint: disable=missing-docstring
 
-
 from gbp_testkit import fixtures as testkit
 from unittest_fixtures import Fixtures, given, where
 
@@ -19,7 +18,7 @@ ENVIRON = {
 }
 
 
-@given(SMTP=testkit.patch)
+@given(lib.caches, SMTP=testkit.patch)
 @where(SMTP__target="smtplib.SMTP_SSL")
 class SendmailTests(lib.TestCase):
     def test(self, fixtures: Fixtures) -> None:
@@ -31,20 +30,30 @@ class SendmailTests(lib.TestCase):
 
         fixtures.SMTP.assert_called_once_with("smtp.email.invalid", port=465)
 
-        smtp = fixtures.SMTP.return_value.__enter__.return_value
+        smtp = fixtures.SMTP.return_value
         smtp.login.assert_called_once_with("marduk@host.invalid", "supersecret")
         smtp.sendmail.assert_called_once_with(from_addr, [to_addr], msg)
 
+    def test_reuses_connection(self, fixtures: Fixtures) -> None:
+        smtp = fixtures.SMTP.return_value
+        smtp.noop.return_value = (250, b"OK")
+
+        tasks.sendmail("from@host.invalid", ["to@host.invalid"], "test 1")
+        tasks.sendmail("from@host.invalid", ["to@host.invalid"], "test 2")
+
+        fixtures.SMTP.assert_called_once_with("smtp.email.invalid", port=465)
+        smtp.login.assert_called_once_with("marduk@host.invalid", "supersecret")
+        self.assertEqual(2, smtp.sendmail.call_count)
+
 
-@given(testkit.environ, lib.imports)
-@where(environ=ENVIRON, imports=["requests"])
+@given(testkit.environ, post=testkit.patch)
+@where(environ=ENVIRON, post__target="requests.Session.post")
 class SendHTTPRequestTests(lib.TestCase):
     def test(self, fixtures: Fixtures) -> None:
         settings = Settings.from_environ()
         tasks.send_http_request("marduk", '{"this": "that"}')
 
-        requests = fixtures.imports["requests"]
-        requests.post.assert_called_once_with(
+        fixtures.post.assert_called_once_with(
             "http://host.invalid/webhook",
             data='{"this": "that"}',
             headers={
@@ -55,9 +64,26 @@ class SendHTTPRequestTests(lib.TestCase):
             timeout=settings.REQUESTS_TIMEOUT,
         )
 
+    def test_invalid_endpoint(self, fixtures: Fixtures) -> None:
+        fixtures.environ["GBP_NOTIFICATIONS_RECIPIENTS"] = (
+            "marduk:webhook=http://host.invalid/webhook|bogus"
+        )
+
+        with self.assertLogs("gbp_notifications", "ERROR") as logs:
+            tasks.send_http_request("marduk", '{"this": "that"}')
+
+        self.assertIn("No valid webhook for marduk", logs.output[-1])
+        fixtures.post.assert_not_called()
+
+    def test_unknown_recipient(self, fixtures: Fixtures) -> None:
+        with self.assertLogs("gbp_notifications", "ERROR"):
+            tasks.send_http_request("bob", '{"this": "that"}')
+
+        fixtures.post.assert_not_called()
+
 
-@given(testkit.environ, lib.imports)
-@where(environ=lib.PUSHOVER_ENVIRON, imports=["requests"])
+@given(testkit.environ, post=testkit.patch)
+@where(environ=lib.PUSHOVER_ENVIRON, post__target="requests.Session.post")
 class SendPushoverNotificationTests(lib.TestCase):
     def test(self, fixtures: Fixtures) -> None:
         settings = Settings.from_environ()
@@ -65,7 +91,6 @@ class SendPushoverNotificationTests(lib.TestCase):
 
         tasks.send_pushover_notification(args["device"], args["title"], args["message"])
 
-        requests = fixtures.imports["requests"]
-        requests.post.assert_called_once_with(
+        fixtures.post.assert_called_once_with(
             pushover.URL, json=lib.PUSHOVER_PARAMS, timeout=settings.REQUESTS_TIMEOUT
         )
@@ -1,12 +1,16 @@
 """Tests for the templates subpackage"""
 
 # pylint: disable=missing-docstring,unused-argument
+from pathlib import Path
+from unittest import mock
+
 import gbp_testkit.fixtures as testkit
 from jinja2 import Template
 from unittest_fixtures import Fixtures, given
 
+from gbp_notifications import templates
 from gbp_notifications.exceptions import TemplateNotFoundError
-from gbp_notifications.templates import load_template, render_template
+from gbp_notifications.templates import load_template, render_template, template_uses
 
 from . import lib
 
@@ -39,3 +43,43 @@ class RenderTemplateTests(lib.TestCase):
         context = {"event": event}
 
         render_template(template, context)
+
+
+@given(lib.caches)
+class TemplateCacheTests(lib.TestCase):
+    def test_template_compiled_once(self, fixtures: Fixtures) -> None:
+        template = load_template("email_postpull.eml")
+
+        self.assertIs(template, load_template("email_postpull.eml"))
+
+    def test_missing_template_is_remembered(self, fixtures: Fixtures) -> None:
+        with self.assertRaises(TemplateNotFoundError):
+            load_template("bogus")
+
+        with mock.patch.object(templates, "get_environment") as get_environment:
+            with self.assertRaises(TemplateNotFoundError):
+                load_template("bogus")
+
+        get_environment.assert_not_called()
+
+    def test_bytecode_cache(self, fixtures: Fixtures) -> None:
+        cache_dir = Path(fixtures.tmpdir, "bytecode")
+        cache_dir.mkdir()
+        fixtures.environ["GBP_NOTIFICATIONS_TEMPLATE_BYTECODE_CACHE_DIR"] = str(
+            cache_dir
+        )
+
+        load_template("email_postpull.eml")
+
+        self.assertTrue(any(cache_dir.iterdir()))
+
+
+@given(lib.caches)
+class TemplateUsesTests(lib.TestCase):
+    def test(self, fixtures: Fixtures) -> None:
+        self.assertTrue(template_uses("email_postpull.eml", "event"))
+        self.assertFalse(template_uses("email_postpull.eml", "recipient"))
+
+    def test_template_not_found(self, fixtures: Fixtures) -> None:
+        with self.assertRaises(TemplateNotFoundError):
+            template_uses("bogus", "recipient")
@@ -0,0 +1,168 @@
+"""Tests for the tracing module"""
+
+# pylint: disable=missing-docstring,unused-argument
+from unittest import mock
+
+from gbp_testkit import fixtures as testkit
+from unittest_fixtures import Fixtures, given, where
+
+from gbp_notifications import tracing
+from gbp_notifications.signals import dispatcher
+from gbp_notifications.tracing import Span, Tracer
+
+from . import lib
+
+
+class RecordingHook:
+    def __init__(self) -> None:
+        self.started: list[Span] = []
+        self.ended: list[Span] = []
+
+    def start(self, span: Span) -> None:
+        self.started.append(span)
+
+    def end(self, span: Span) -> None:
+        self.ended.append(span)
+
+    def stages(self) -> list[str]:
+        return [span.stage for span in self.started]
+
+
+@given(lib.caches)
+class SpanTests(lib.TestCase):
+    def test_no_hooks(self, fixtures: Fixtures) -> None:
+        with tracing.span("build", method="email") as span:
+            pass
+
+        self.assertIsNone(span)
+
+    def test_hooks(self, fixtures: Fixtures) -> None:
+        hook = RecordingHook()
+        tracing.add_hook(hook)
+
+        with tracing.span("signal", event="postpull") as outer:
+            self.assertIs(outer, tracing.current_span())
+
+            with tracing.span("build", method="email") as inner:
+                assert inner
+                self.assertIsNone(inner.end)
+                inner.set(size=10)
+
+        self.assertIsNone(tracing.current_span())
+        self.assertEqual(["signal", "build"], hook.stages())
+        self.assertEqual([inner, outer], hook.ended)
+        self.assertIs(outer, inner.parent)
+        self.assertEqual({"method": "email", "size": 10}, inner.attributes)
+        assert outer and outer.end is not None
+        self.assertGreaterEqual(outer.duration, inner.duration)
+        self.assertEqual(outer.end - outer.start, outer.duration)
+
+    def test_error(self, fixtures: Fixtures) -> None:
+        hook = RecordingHook()
+        tracing.add_hook(hook)
+        error = ValueError("bad")
+
+        with self.assertRaises(ValueError):
+            with tracing.span("send"):
+                raise error
+
+        self.assertIs(error, hook.ended[0].error)
+
+    def test_failing_hook_does_not_fail_the_stage(self, fixtures: Fixtures) -> None:
+        hook = mock.Mock(start=mock.Mock(side_effect=RuntimeError()))
+        tracing.add_hook(hook)
+
+        with self.assertLogs("gbp_notifications.tracing", "ERROR"):
+            with tracing.span("send") as span:
+                pass
+
+        hook.end.assert_called_once_with(span)
+
+    def test_remove_hook(self, fixtures: Fixtures) -> None:
+        hook = RecordingHook()
+        tracing.add_hook(hook)
+        tracing.remove_hook(hook)
+
+        with tracing.span("send") as span:
+            pass
+
+        self.assertIsNone(span)
+        self.assertEqual([], hook.started)
+
+
+@given(entry_points=testkit.patch)
+@where(entry_points__target="importlib.metadata.entry_points")
+class TracerTests(lib.TestCase):
+    def test_loads_entry_points(self, fixtures: Fixtures) -> None:
+        hook = RecordingHook()
+        entry_point = mock.Mock()
+        entry_point.name = "recording"
+        entry_point.load.return_value = lambda: hook
+        broken = mock.Mock()
+        broken.name = "broken"
+        broken.load.side_effect = ImportError()
+        fixtures.entry_points.return_value = [entry_point, broken]
+        tracer = Tracer()
+
+        with self.assertLogs("gbp_notifications.tracing", "ERROR"):
+            self.assertEqual((hook,), tracer.hooks)
+
+        self.assertEqual((hook,), tracer.hooks)
+        fixtures.entry_points.assert_called_once_with(group="gbp_notifications.tracing")
+
+    def test_clear(self, fixtures: Fixtures) -> None:
+        tracer = Tracer()
+        tracer.add(RecordingHook())
+
+        tracer.clear()
+
+        self.assertEqual((), tracer.hooks)
+
+
+@given(lib.caches, testkit.environ, testkit.build, sendmail=testkit.patch)
+@where(sendmail__target="gbp_notifications.connections.SMTPPool.sendmail")
+class PipelineTests(lib.TestCase):
+    def test(self, fixtures: Fixtures) -> None:
+        hook = RecordingHook()
+        tracing.add_hook(hook)
+
+        dispatcher.emit("postpull", build=fixtures.build)
+
+        self.assertEqual(
+            ["signal", "resolve", "build", "enqueue", "send"], hook.stages()
+        )
+        spans = dict(zip(hook.stages(), hook.started))
+        signal, enqueue, send = spans["signal"], spans["enqueue"], spans["send"]
+        self.assertEqual(
+            {
+                "event": "postpull",
+                "machine": "babette",
+                "build_id": fixtures.build.build_id,
+            },
+            signal.attributes,
+        )
+        self.assertEqual(1, spans["resolve"].attributes["recipients"])
+        self.assertEqual("albert", spans["build"].attributes["recipient"])
+        self.assertEqual("sendmail", enqueue.attributes["task"])
+        self.assertEqual(
+            {
+                "method": "email",
+                "recipient": "albert <marduk@host.invalid>",
+                "destination": "smtp.email.invalid",
+                "attempt": 1,
+            },
+            send.attributes,
+        )
+        # The sync worker sends in the signal's context
+        self.assertIs(enqueue, send.parent)
+        self.assertIs(signal, enqueue.parent)
+
+    def test_failed_send(self, fixtures: Fixtures) -> None:
+        hook = RecordingHook()
+        tracing.add_hook(hook)
+        fixtures.sendmail.side_effect = ValueError()
+
+        dispatcher.emit("postpull", build=fixtures.build)
+
+        [send] = [span for span in hook.ended if span.stage == "send"]
+        self.assertIsInstance(send.error, ValueError)
@@ -4,9 +4,11 @@
 
 from unittest_fixtures import Fixtures, given, params, where
 
+from gbp_notifications import plugin
+from gbp_notifications.exceptions import WebhookConfigError
 from gbp_notifications.methods.email import EmailMethod
 from gbp_notifications.settings import Settings
-from gbp_notifications.types import Event, Recipient, Subscription
+from gbp_notifications.types import Event, Recipient, Subscription, WebhookEndpoint
 
 from .lib import TestCase, recipient
 
@@ -26,6 +28,24 @@ class SubscriptionTests(TestCase):
         expected = {ev1: Subscription([r1]), ev2: Subscription([r2])}
         self.assertEqual(result, expected)
 
+    def test_unknown_recipients_are_logged(self, fixtures: Fixtures) -> None:
+        r1 = fixtures.r1
+        r2 = fixtures.r2
+        s = "babette.postpull=foo,bogus,bar,foo"
+
+        with self.assertLogs("gbp_notifications.types", "WARNING") as logs:
+            result = Subscription.from_string(s, [r1, r2])
+
+        ev1 = Event(name="postpull", machine="babette")
+        self.assertEqual({ev1: Subscription([r2, r1])}, result)
+        self.assertEqual(
+            [
+                "WARNING:gbp_notifications.types:"
+                "Unknown recipient 'bogus' subscribed to babette.postpull"
+            ],
+            logs.output,
+        )
+
 
 class RecipientTests(TestCase):
     def test_methods(self) -> None:
@@ -39,7 +59,7 @@ class RecipientTests(TestCase):
         r = Recipient(name="foo")
         settings = Settings(RECIPIENTS=(r,))
 
-        self.assertEqual(Recipient.from_name("foo", settings), r)
+        self.assertIs(Recipient.from_name("foo", settings), r)
 
     def test_from_name_lookuperror(self) -> None:
         settings = Settings(RECIPIENTS=())
@@ -76,3 +96,30 @@ class RecipientFromStringTests(TestCase):
 
         expected = {Recipient(name=v[0], config=dict(v[1])) for v in values}
         self.assertEqual(set(recipients), expected)
+
+
+class WebhookEndpointTests(TestCase):
+    def test_from_config(self) -> None:
+        endpoint = WebhookEndpoint.from_config(
+            "https://host.invalid:8080/webhook|X-Pre-Shared-Key=1234", timeout=5
+        )
+
+        self.assertEqual("https://host.invalid:8080/webhook", endpoint.url)
+        self.assertEqual("host.invalid:8080", endpoint.host)
+        self.assertEqual(5, endpoint.timeout)
+        self.assertEqual(
+            (
+                ("X-Pre-Shared-Key", "1234"),
+                ("Content-Type", "application/json"),
+                ("User-Agent", f"{plugin['name']}/{plugin['version']}"),
+            ),
+            endpoint.headers,
+        )
+
+    def test_invalid_header(self) -> None:
+        with self.assertRaises(WebhookConfigError):
+            WebhookEndpoint.from_config("http://host.invalid/webhook|bogus", timeout=5)
+
+    def test_invalid_url(self) -> None:
+        with self.assertRaises(WebhookConfigError):
+            WebhookEndpoint.from_config("host.invalid/webhook", timeout=5)
@@ -3,10 +3,13 @@
 # pylint: disable=missing-docstring
 import collections
 import unittest
+from dataclasses import replace
 
 from unittest_fixtures import Fixtures, given, where
 
 from gbp_notifications.utils import (
+    EventMemo,
+    RecipientIndex,
     find_subscribers,
     parse_header_conf,
     parse_webhook_config,
@@ -61,6 +64,18 @@ class FindSubscribersTests(unittest.TestCase):
         self.assertEqual({fixtures.r2}, subs)
 
 
+@given(r1=lib.recipient, r2=lib.recipient, r3=lib.recipient)
+@where(r1__name="foo", r2__name="bar", r3__name="baz")
+class RecipientIndexTests(unittest.TestCase):
+    def test_find(self, fixtures: Fixtures) -> None:
+        index = RecipientIndex([fixtures.r1, fixtures.r2, fixtures.r3])
+
+        found, unknown = index.find(["foo", "bogus", "bar", "foo", "bogus"])
+
+        self.assertEqual([fixtures.r2, fixtures.r1], found)
+        self.assertEqual(["bogus"], unknown)
+
+
 class SortItemsByTests(unittest.TestCase):
     def test(self) -> None:
         Bag = collections.namedtuple("Bag", "spam eggs")
@@ -135,3 +150,18 @@ class ParseHeaderConfTests(unittest.TestCase):
         error = exc_info.exception
 
         self.assertEqual(f"Invalid header assignment: {header_conf!r}", str(error))
+
+
+@given(lib.event)
+class EventMemoTests(unittest.TestCase):
+    def test(self, fixtures: Fixtures) -> None:
+        memo: EventMemo[int] = EventMemo()
+        event = fixtures.event
+        values = iter(range(10))
+
+        self.assertEqual(0, memo.get(event, lambda: next(values)))
+        self.assertEqual(0, memo.get(event, lambda: next(values)))
+
+        # Events with different data are equal, but not the same
+        other_event = replace(event, data={})
+        self.assertEqual(1, memo.get(other_event, lambda: next(values)))